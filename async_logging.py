@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+"""Logging off the request threads.
+
+The handlers of the server write to the console and rotate files, which
+takes time under load. `install` moves the handlers of a logger behind a
+queue: the request threads only put their records in it (`QueueHandler`) and
+a background thread (`QueueListener`) formats and writes them. Python 2 has
+no `logging.handlers.QueueHandler`, hence these ones. When the queue is full,
+the records are dropped and counted rather than blocking the requests.
+
+`summarize` shortens the request bodies, which may list thousands of tickers,
+before they are logged.
+"""
+
+import sys
+import atexit
+import logging
+import threading
+import Queue
+
+
+__author__ = ('eruiz070210', 'dgaraud111714')
+
+DEFAULT_QUEUE_SIZE = 10000
+# Lists longer than this are summarized in the logs.
+DEFAULT_MAX_ITEMS = 10
+DEFAULT_MAX_LENGTH = 200
+_STOP = None
+
+
+class QueueHandler(logging.Handler):
+    """Put the records in `queue`, or count them as dropped if it's full.
+    """
+
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.dropped = 0
+
+    def prepare(self, record):
+        """Merge the arguments and the traceback in the record, which may not
+        be valid anymore when it's written.
+        """
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except Queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+
+class QueueListener(object):
+    """Thread passing the records of `queue` to `handlers`.
+    """
+
+    def __init__(self, queue, *handlers):
+        self.queue = queue
+        self.handlers = handlers
+        # `QueueHandler` feeding the queue, see `install`.
+        self.handler = None
+        self.written = 0
+        self._thread = None
+
+    def stats(self):
+        return {'queued': self.queue.qsize(),
+                'written': self.written,
+                'dropped': self.handler.dropped if self.handler else 0}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._monitor,
+                                        name='ezbbg-log-listener')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Write the records left in the queue and stop the thread.
+        """
+        if self._thread is None:
+            return
+        self.queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+
+    def handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        self.written += 1
+
+    def _monitor(self):
+        while True:
+            record = self.queue.get()
+            if record is _STOP:
+                break
+            try:
+                self.handle(record)
+            except Exception:
+                # Never let the logging thread die.
+                sys.stderr.write("Failed to write a log record\n")
+
+
+def install(logger=None, queue_size=DEFAULT_QUEUE_SIZE):
+    """Move the handlers of `logger` (the root logger by default) to a
+    `QueueListener` thread, return the listener once started.
+
+    The records left are written when the interpreter exits.
+    """
+    logger = logger or logging.getLogger()
+    queue = Queue.Queue(queue_size)
+    handlers = list(logger.handlers)
+    for handler in handlers:
+        logger.removeHandler(handler)
+    listener = QueueListener(queue, *handlers)
+    listener.handler = QueueHandler(queue)
+    logger.addHandler(listener.handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def summarize(obj, max_items=DEFAULT_MAX_ITEMS, max_length=DEFAULT_MAX_LENGTH):
+    """`obj`, a JSON request body, where the lists longer than `max_items`
+    and the strings longer than `max_length` are replaced by their size and
+    first elements.
+    """
+    if isinstance(obj, dict):
+        return {k: summarize(v, max_items, max_length) for k, v in obj.iteritems()}
+    if isinstance(obj, (list, tuple)):
+        if len(obj) > max_items:
+            head = [summarize(x, max_items, max_length) for x in obj[:3]]
+            return u'<{} items: {}, ...>'.format(len(obj),
+                                                 u', '.join(unicode(x) for x in head))
+        return [summarize(x, max_items, max_length) for x in obj]
+    if isinstance(obj, basestring) and len(obj) > max_length:
+        return u'<{} chars: {}...>'.format(len(obj), obj[:max_length // 4])
+    return obj
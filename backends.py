@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+
+"""Backends of the server, i.e. where the Bloomberg data come from.
+
+- 'live': `ezbbg.bloomberg`, through the terminal. ezbbg is only imported by
+  the first query, so that the server can start without a terminal.
+- 'record': the live backend, whose responses are also written to a
+  `RecordingStore` directory.
+- 'replay': the responses of a recording, after a latency. A query which
+  wasn't recorded fails with `ReplayMiss`.
+- 'synthetic': deterministic data generated at any scale, see
+  `ezbbg.ws.synthetic`.
+
+The historical data are recorded per ticker and the reference data and
+field information per ticker or field, so that the replay answers the
+queries grouped differently from the recorded ones, e.g. by the coalescing,
+and the historical data of any period within a recorded one. The other
+queries are replayed when they are sent again with the same arguments.
+
+Only the live backend needs Windows: the others can run the server anywhere,
+e.g. to load test or profile it.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+
+import numpy as np
+import pandas as pd
+
+from ezbbg.ws import wire
+from ezbbg.ws import compression
+from ezbbg.ws import synthetic
+from ezbbg.ws.cache import options_key
+
+
+__author__ = ('eruiz070210', 'dgaraud111714')
+
+BACKENDS = ('live', 'record', 'replay', 'synthetic')
+# Query functions of `ezbbg.bloomberg`, and of `ezbbg.helpers` for the chain.
+FUNCTIONS = ('get_historical_data', 'get_reference_data', 'get_fields_info',
+             'search_fields', 'search_fields_by_category',
+             'get_and_chain_historical_data')
+DESKTOP_SWITCHDESKTOP = 0x0100
+RECORDING_EXTENSION = '.ezbc.gz'
+_MISSING = object()
+
+
+def is_windows_session_locked():
+    """Whether the Windows session is locked, in which case the terminal
+    can't be queried. Always False off Windows.
+    """
+    if os.name != 'nt':
+        return False
+    import ctypes
+    user32 = ctypes.windll.User32
+    desktop = user32.OpenDesktopA("default", 0, False, DESKTOP_SWITCHDESKTOP)
+    return not user32.SwitchDesktop(desktop)
+
+
+class ReplayMiss(LookupError):
+    """The query wasn't recorded.
+    """
+
+
+class LiveBackend(object):
+    """`ezbbg.bloomberg`, imported on first use.
+    """
+
+    name = 'live'
+
+    def __getattr__(self, name):
+        if name not in FUNCTIONS:
+            raise AttributeError(name)
+        if name == 'get_and_chain_historical_data':
+            from ezbbg import helpers as module
+        else:
+            from ezbbg import bloomberg as module
+        return getattr(module, name)
+
+    @property
+    def version(self):
+        from ezbbg import __version__
+        return __version__
+
+    def is_session_locked(self):
+        return is_windows_session_locked()
+
+
+class RecordingStore(object):
+    """Responses of the Bloomberg queries stored in the directory `path`,
+    one compressed columnar file (see `wire`) per key.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        # Held to read and update a key.
+        self.lock = threading.RLock()
+        # Decoded files, by key name.
+        self._loaded = {}
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def __repr__(self):
+        return "<RecordingStore {}>".format(self.path)
+
+    def __len__(self):
+        return len([name for name in os.listdir(self.path)
+                    if name.endswith(RECORDING_EXTENSION)])
+
+    def _name(self, key):
+        return hashlib.md5(json.dumps(key, sort_keys=True, default=str)).hexdigest()
+
+    def read(self, key, default=None):
+        name = self._name(key)
+        with self.lock:
+            if name in self._loaded:
+                return self._loaded[name]
+            try:
+                with open(os.path.join(self.path, name + RECORDING_EXTENSION), 'rb') as f:
+                    payload = f.read()
+            except IOError:
+                return default
+            value = _restore_dates(wire.decode(bytearray(
+                compression.decompress(payload, compression.GZIP))))['value']
+            self._loaded[name] = value
+            return value
+
+    def write(self, key, value):
+        name = self._name(key)
+        payload = compression.compress(wire.encode({'key': key, 'value': value}),
+                                       compression.GZIP)
+        path = os.path.join(self.path, name + RECORDING_EXTENSION)
+        with self.lock:
+            with open(path + '.tmp', 'wb') as f:
+                f.write(payload)
+            # os.rename doesn't overwrite on Windows.
+            if os.name == 'nt' and os.path.exists(path):
+                os.remove(path)
+            os.rename(path + '.tmp', path)
+            self._loaded[name] = value
+
+
+def _restore_dates(obj):
+    # The columnar format decodes the dates as numpy.datetime64.
+    if isinstance(obj, dict):
+        return {k: _restore_dates(v) for k, v in obj.iteritems()}
+    if isinstance(obj, list):
+        return [_restore_dates(x) for x in obj]
+    if isinstance(obj, np.datetime64):
+        return obj.astype('M8[D]').astype(object)
+    return obj
+
+
+def _day(date):
+    return pd.Timestamp(date).strftime('%Y-%m-%d')
+
+
+def _add_period(periods, start_date, end_date):
+    """Sorted disjoint periods [start, end] (ISO dates) covering `periods`
+    and the period from `start_date` to `end_date`.
+    """
+    merged = []
+    for start, end in sorted(list(periods) + [[_day(start_date), _day(end_date)]]):
+        # Consecutive periods are merged too.
+        if merged and start <= _day(pd.Timestamp(merged[-1][1]) + pd.Timedelta(days=1)):
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def _is_covered(periods, start_date, end_date):
+    start, end = _day(start_date), _day(end_date)
+    return any(first <= start and end <= last for first, last in periods)
+
+
+def _historical_key(ticker, kwargs):
+    return ['historical_data', ticker, options_key(kwargs)]
+
+
+def _reference_key(ticker, kwargs):
+    return ['reference_data', ticker, options_key(kwargs)]
+
+
+def _call_key(name, args, kwargs):
+    return [name, args, options_key(kwargs)]
+
+
+class Recorder(object):
+    """`backend` writing its responses to the `RecordingStore` `store`.
+    """
+
+    name = 'record'
+
+    def __init__(self, backend, store):
+        self.backend = backend
+        self.store = store
+
+    @property
+    def version(self):
+        return self.backend.version
+
+    def is_session_locked(self):
+        return self.backend.is_session_locked()
+
+    def get_historical_data(self, ticker_list, field_list, start_date, end_date,
+                            **kwargs):
+        data = self.backend.get_historical_data(ticker_list, field_list,
+                                                start_date, end_date, **kwargs)
+        with self.store.lock:
+            for ticker in ticker_list:
+                frame = (data or {}).get(ticker)
+                if frame is None:
+                    frame = pd.DataFrame(index=pd.DatetimeIndex([], name='date'))
+                # The requested fields are recorded even without data.
+                frame = frame.reindex(columns=list(field_list)).sort_index()
+                key = _historical_key(ticker, kwargs)
+                recorded = self.store.read(key) or {'frame': None, 'periods': {}}
+                if recorded['frame'] is not None:
+                    frame = frame.combine_first(recorded['frame'])
+                # The periods covered by the recording, per field.
+                periods = dict(recorded['periods'])
+                for field in field_list:
+                    periods[field] = _add_period(periods.get(field, []),
+                                                 start_date, end_date)
+                self.store.write(key, {'frame': frame, 'periods': periods})
+        return data
+
+    def get_reference_data(self, ticker_list, field_list, **kwargs):
+        data = self.backend.get_reference_data(ticker_list, field_list, **kwargs)
+        with self.store.lock:
+            for ticker in ticker_list:
+                key = _reference_key(ticker, kwargs)
+                values = dict(self.store.read(key) or {})
+                received = (data or {}).get(ticker) or {}
+                for field in field_list:
+                    # None for the fields without value.
+                    values[field] = received.get(field)
+                self.store.write(key, values)
+        return data
+
+    def get_fields_info(self, field_list, return_field_documentation=True):
+        data = self.backend.get_fields_info(field_list, return_field_documentation)
+        for field in field_list:
+            self.store.write(['fields_info', field, return_field_documentation],
+                             (data or {}).get(field))
+        return data
+
+    def _call(self, name, *args, **kwargs):
+        data = getattr(self.backend, name)(*args, **kwargs)
+        self.store.write(_call_key(name, args, kwargs), data)
+        return data
+
+    def search_fields(self, *args, **kwargs):
+        return self._call('search_fields', *args, **kwargs)
+
+    def search_fields_by_category(self, *args, **kwargs):
+        return self._call('search_fields_by_category', *args, **kwargs)
+
+    def get_and_chain_historical_data(self, *args, **kwargs):
+        return self._call('get_and_chain_historical_data', *args, **kwargs)
+
+
+class Replay(object):
+    """Serve the responses of the `RecordingStore` `store`, each query taking
+    `latency` seconds.
+    """
+
+    name = 'replay'
+    version = 'replay'
+
+    def __init__(self, store, latency=0.):
+        self.store = store
+        self.latency = latency
+        self.queries = 0
+        self.misses = 0
+
+    def is_session_locked(self):
+        return False
+
+    def _read(self, key):
+        value = self.store.read(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            raise ReplayMiss("Query not recorded: {}".format(key))
+        return value
+
+    def _query(self):
+        self.queries += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def get_historical_data(self, ticker_list, field_list, start_date, end_date,
+                            **kwargs):
+        self._query()
+        start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+        data = {}
+        for ticker in ticker_list:
+            recorded = self._read(_historical_key(ticker, kwargs))
+            missing = [field for field in field_list
+                       if not _is_covered(recorded['periods'].get(field, []),
+                                          start_date, end_date)]
+            if missing:
+                self.misses += 1
+                raise ReplayMiss("Fields {} of {} not recorded from {} to {}".format(
+                    missing, ticker, start_date, end_date))
+            frame = recorded['frame'].loc[start:end, list(field_list)].dropna(how='all')
+            if len(frame.index):
+                data[ticker] = frame
+        return data
+
+    def get_reference_data(self, ticker_list, field_list, **kwargs):
+        self._query()
+        data = {}
+        for ticker in ticker_list:
+            recorded = self._read(_reference_key(ticker, kwargs))
+            values = {}
+            for field in field_list:
+                if field not in recorded:
+                    raise ReplayMiss("Field {} of {} not recorded".format(field, ticker))
+                if recorded[field] is not None:
+                    values[field] = recorded[field]
+            if values:
+                data[ticker] = values
+        return data
+
+    def get_fields_info(self, field_list, return_field_documentation=True):
+        self._query()
+        data = {}
+        for field in field_list:
+            info = self._read(['fields_info', field, return_field_documentation])
+            if info is not None:
+                data[field] = info
+        return data
+
+    def _call(self, name, *args, **kwargs):
+        self._query()
+        return self._read(_call_key(name, args, kwargs))
+
+    def search_fields(self, *args, **kwargs):
+        return self._call('search_fields', *args, **kwargs)
+
+    def search_fields_by_category(self, *args, **kwargs):
+        return self._call('search_fields_by_category', *args, **kwargs)
+
+    def get_and_chain_historical_data(self, *args, **kwargs):
+        return self._call('get_and_chain_historical_data', *args, **kwargs)
+
+
+def create(name, path=None, latency=0.):
+    """Backend `name`, one of `BACKENDS`.
+
+    Parameters
+    ----------
+
+    path: str
+        Directory of the recording, for the 'record' and 'replay' backends.
+    latency: float
+        Time in seconds taken by the queries of the 'replay' and 'synthetic'
+        backends.
+    """
+    if name == 'live':
+        return LiveBackend()
+    if name == 'record':
+        return Recorder(LiveBackend(), RecordingStore(path))
+    if name == 'replay':
+        return Replay(RecordingStore(path), latency)
+    if name == 'synthetic':
+        return synthetic.StubBloomberg(latency=latency)
+    raise ValueError("Unknown backend '{}', expected one of {}".format(
+        name, ', '.join(BACKENDS)))
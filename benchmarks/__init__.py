@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmarks of the Web Service with a synthetic Bloomberg backend.
+
+Run them with `python -m ezbbg.ws.benchmarks`, see `runner`.
+"""
+
+__author__ = ('eruiz070210', 'dgaraud111714')
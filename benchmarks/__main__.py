@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+
+from ezbbg.ws.benchmarks.runner import main
+
+__author__ = ('eruiz070210', 'dgaraud111714')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmarks of the Web Service against the synthetic Bloomberg backend.
+
+Each scenario, i.e. a payload shape, is run through the client:
+
+  - 'test_client': in process, through `app.test_client()`,
+  - 'http': over real HTTP, the server running in a thread,
+
+in each wire format, reporting the throughput, the p50/p99 latency and the
+peak memory of the process. The encoding and decoding costs of each payload
+shape and format are measured apart, with the payload sizes.
+
+Run it with `python -m ezbbg.ws.benchmarks --help`.
+"""
+
+import sys
+import json
+import time
+import argparse
+import threading
+import urlparse
+import datetime as dt
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+import requests
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+from ezbbg.ws import client as ws_client
+from ezbbg.ws import server
+from ezbbg.ws import serving
+from ezbbg.ws import wire
+from ezbbg.ws import compression
+from ezbbg.ws import frames_json
+from ezbbg.ws.benchmarks.stub import StubBloomberg, installed
+
+
+__author__ = ('eruiz070210', 'dgaraud111714')
+
+MODES = ('test_client', 'http')
+END_DATE = dt.date(2020, 12, 31)
+REFERENCE_FIELDS = ['PX_LAST', 'NAME', 'ISSUE_DT', 'CUR_MKT_CAP']
+BULK_FIELDS = ['INDX_MEMBERS']
+
+
+# region Scenarios
+def _tickers(config):
+    return ['BENCH{} Equity'.format(i) for i in range(config.tickers)]
+
+def _fields(config):
+    return ['FIELD{}'.format(i) for i in range(config.fields)]
+
+def _start_date(config):
+    return END_DATE - dt.timedelta(days=config.days)
+
+def reference_scalar(client, config):
+    return client.get_reference_data(_tickers(config), REFERENCE_FIELDS)
+
+def reference_bulk(client, config):
+    return client.get_reference_data(_tickers(config), BULK_FIELDS)
+
+def historical(client, config):
+    return client.get_historical_data(_tickers(config), _fields(config),
+                                      _start_date(config), END_DATE)
+
+def historical_stream(client, config):
+    return dict(client.iter_historical_data(_tickers(config), _fields(config),
+                                            _start_date(config), END_DATE))
+
+def chain_historical(client, config):
+    return client.get_and_chain_historical_data(_tickers(config), _fields(config),
+                                                END_DATE, _start_date(config))
+
+def fields_search(client, config):
+    return client.search_fields('synthetic field 1')
+
+def fields_info(client, config):
+    return client.get_fields_info(['FIELD_{:04d}'.format(i) for i in range(50)])
+
+def batch(client, config):
+    with client.batch() as queries:
+        reference = queries.get_reference_data(_tickers(config), REFERENCE_FIELDS)
+        history = queries.get_historical_data(_tickers(config), _fields(config),
+                                              _start_date(config), END_DATE)
+    return reference.result(), history.result()
+
+SCENARIOS = OrderedDict((func.__name__, func) for func in [
+    reference_scalar, reference_bulk, historical, historical_stream,
+    chain_historical, fields_search, fields_info, batch])
+# endregion
+
+
+# region Transports
+class _TestResponse(object):
+    """The parts of a `requests.Response` used by the client.
+    """
+
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.content = response.get_data()
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+
+    def json(self, **kwargs):
+        return json.loads(self.content, **kwargs)
+
+    def iter_lines(self):
+        return iter(self.content.splitlines())
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError("{} Error".format(self.status_code),
+                                     response=self)
+
+    def close(self):
+        pass
+
+
+class InProcessClient(ws_client.EzbbgClient):
+    """Client sending its requests through `app.test_client()`.
+    """
+
+    def _get(self, url, request=None, timeout=None, headers=None,
+             stream=False):
+        path = urlparse.urlparse(url.format(self.host, self.port)).path
+        data = json.dumps(request) if request is not None else None
+        response = server.app.test_client().get(path, data=data,
+                                                headers=headers,
+                                                content_type='application/json',
+                                                buffered=True)
+        response = _TestResponse(response)
+        response.raise_for_status()
+        return response
+
+
+@contextmanager
+def http_server(ssl=True):
+    """Serve the application on a free port, yield the port.
+    """
+    httpd = serving.PooledWSGIServer('localhost', 0, server.app,
+                                     ssl_context='adhoc' if ssl else None)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        yield httpd.socket.getsockname()[1]
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+@contextmanager
+def make_client(mode, wire_format, ssl=True):
+    if mode == 'test_client':
+        with InProcessClient(wire_format=wire_format) as client:
+            yield client
+        return
+    with http_server(ssl) as port:
+        with ws_client.EzbbgClient('localhost', port, wire_format=wire_format,
+                                   scheme='https' if ssl else 'http') as client:
+            yield client
+# endregion
+
+
+# region Measures
+def peak_memory():
+    """Peak resident memory of the process in MB, None if unknown.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS
+    return peak / 1024. ** (2 if sys.platform == 'darwin' else 1)
+
+
+def run_scenario(scenario, client, config):
+    """Throughput and latency of `config.requests` queries, sent by
+    `config.concurrency` threads.
+    """
+    scenario(client, config)
+
+    def timed_query(_):
+        start = time.time()
+        scenario(client, config)
+        return time.time() - start
+    pool = ThreadPool(config.concurrency)
+    try:
+        start = time.time()
+        latencies = pool.map(timed_query, range(config.requests))
+        elapsed = time.time() - start
+    finally:
+        pool.close()
+    return OrderedDict([('requests', config.requests),
+                        ('throughput', config.requests / elapsed),
+                        ('p50_ms', np.percentile(latencies, 50) * 1000),
+                        ('p99_ms', np.percentile(latencies, 99) * 1000),
+                        ('peak_memory_mb', peak_memory())])
+
+
+def _typed_json(data):
+    return json.dumps(server.typed_reference_data(data), cls=server.JSONEncoder)
+
+# Payload shape -> (JSON encoding, JSONEncoder if None, client decoding, JSON
+# mimetype). The stub has the signatures of the client, so the data of a
+# shape are those of its scenario run on the stub.
+CODECS = OrderedDict([
+    ('reference_scalar', (_typed_json, ws_client._decode_reference_data,
+                          ws_client.TYPED_JSON_MIMETYPE)),
+    ('reference_bulk', (_typed_json, ws_client._decode_reference_data,
+                        ws_client.TYPED_JSON_MIMETYPE)),
+    ('historical', (frames_json.dumps, ws_client._decode_historical_data,
+                    frames_json.FRAMES_JSON_MIMETYPE)),
+    ('chain_historical', (frames_json.dumps, ws_client._decode_chain_historical_data,
+                          frames_json.FRAMES_JSON_MIMETYPE)),
+])
+
+
+def measure_codec(data, wire_format, json_encode, decode, json_mimetype,
+                  repeat):
+    """Encoding and decoding times in ms and payload sizes of `data`.
+    """
+    if wire_format == 'columnar':
+        encode = wire.encode
+        parse = lambda payload: wire.decode(bytearray(payload))
+        content_type = wire.COLUMNAR_MIMETYPE
+    else:
+        encode = json_encode or (lambda d: json.dumps(d, cls=server.JSONEncoder))
+        parse = json.loads
+        if json_mimetype == frames_json.FRAMES_JSON_MIMETYPE:
+            parse = lambda payload: json.loads(payload,
+                                               object_hook=frames_json.object_hook)
+        content_type = json_mimetype
+    encode_times, decode_times = [], []
+    for _ in range(repeat):
+        start = time.time()
+        payload = encode(data)
+        encode_times.append(time.time() - start)
+        start = time.time()
+        decode(parse(payload), content_type)
+        decode_times.append(time.time() - start)
+    return OrderedDict([('encode_ms', min(encode_times) * 1000),
+                        ('decode_ms', min(decode_times) * 1000),
+                        ('bytes', len(payload)),
+                        ('gzip_bytes', len(compression.compress(payload,
+                                                                compression.GZIP)))])
+# endregion
+
+
+def run(config, out=sys.stdout):
+    """Run the benchmarks of `config`, return the results.
+    """
+    stub = StubBloomberg(latency=config.latency, bulk_rows=config.bulk_rows)
+    results = {'config': vars(config), 'queries': [], 'codecs': []}
+    with installed(stub, cache=config.cache,
+                   coalesce_window=config.coalesce_window):
+        for mode in config.modes:
+            for wire_format in config.formats:
+                with make_client(mode, wire_format, config.ssl) as client:
+                    for name in config.scenarios:
+                        result = OrderedDict([('mode', mode),
+                                              ('format', wire_format),
+                                              ('scenario', name)])
+                        result.update(run_scenario(SCENARIOS[name], client, config))
+                        results['queries'].append(result)
+                        _print_row(out, result)
+        for name in config.scenarios:
+            if name not in CODECS:
+                continue
+            json_encode, decode, json_mimetype = CODECS[name]
+            data = SCENARIOS[name](stub, config)
+            for wire_format in config.formats:
+                result = OrderedDict([('scenario', name), ('format', wire_format)])
+                result.update(measure_codec(data, wire_format, json_encode,
+                                            decode, json_mimetype,
+                                            config.codec_repeat))
+                results['codecs'].append(result)
+                _print_row(out, result)
+    return results
+
+
+def _print_row(out, result):
+    cells = []
+    for key, value in result.iteritems():
+        if isinstance(value, float):
+            value = '{:.2f}'.format(value)
+        cells.append('{}={}'.format(key, value))
+    out.write('  '.join(cells) + '\n')
+    out.flush()
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m ezbbg.ws.benchmarks',
+        description="Benchmark the Web Service with a synthetic Bloomberg backend.")
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS),
+                        choices=list(SCENARIOS))
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=MODES)
+    parser.add_argument('--formats', nargs='+', default=list(ws_client.WIRE_FORMATS),
+                        choices=ws_client.WIRE_FORMATS)
+    parser.add_argument('--tickers', type=int, default=50)
+    parser.add_argument('--fields', type=int, default=5,
+                        help="number of historical fields")
+    parser.add_argument('--days', type=int, default=5 * 365,
+                        help="length of the histories")
+    parser.add_argument('--bulk-rows', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.,
+                        help="time taken by each Bloomberg query, in seconds")
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--codec-repeat', type=int, default=5)
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+                        help="disable the historical data cache of the server")
+    parser.add_argument('--coalesce-window', type=float, default=None)
+    parser.add_argument('--no-ssl', dest='ssl', action='store_false',
+                        help="serve over plain HTTP (no pyOpenSSL needed)")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    config = parse_args(args)
+    results = run(config)
+    if config.output:
+        with open(config.output, 'w') as fobj:
+            json.dump(results, fobj, indent=2)
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+"""Synthetic Bloomberg backend of the benchmarks.
+
+`StubBloomberg` (see `ezbbg.ws.synthetic`) has the query functions of
+`ezbbg.bloomberg` and returns deterministic data, after an artificial
+latency. `installed` plugs it in the server in place of the terminal.
+"""
+
+from contextlib import contextmanager
+
+from ezbbg.ws.synthetic import StubBloomberg
+
+
+__author__ = ('eruiz070210', 'dgaraud111714')
+
+
+@contextmanager
+def installed(stub, cache=True, coalesce_window=None):
+    """Serve the data of `stub` instead of the terminal's.
+
+    The caches and the field catalog of the server start empty. `cache`
+    enables the historical data and chain caches, and `coalesce_window`
+    overrides the time window of the query coalescing.
+    """
+    from ezbbg.ws import server
+    from ezbbg.ws.cache import HistoricalDataCache
+    from ezbbg.ws.field_catalog import FieldCatalog
+    from ezbbg.ws.chaining import ChainCache
+    saved = (server.bloomberg, server.get_and_chain_historical_data,
+             server.is_session_locked, server.HISTORICAL_CACHE_MAX_CELLS,
+             server.historical_cache, server.field_catalog, server.chain_cache,
+             server.reference_data_coalescer.window,
+             server.historical_data_coalescer.window)
+    server.bloomberg = stub
+    server.get_and_chain_historical_data = stub.get_and_chain_historical_data
+    server.is_session_locked = lambda: False
+    if not cache:
+        server.HISTORICAL_CACHE_MAX_CELLS = 0
+    server.historical_cache = HistoricalDataCache(server.HISTORICAL_CACHE_MAX_CELLS)
+    server.field_catalog = FieldCatalog(stub.search_fields,
+                                        stub.search_fields_by_category,
+                                        stub.get_fields_info)
+    server.chain_cache = ChainCache(server._chain_bloomberg,
+                                    server.CHAIN_CACHE_MAX_CHAINS if cache else 0)
+    if coalesce_window is not None:
+        server.reference_data_coalescer.window = coalesce_window
+        server.historical_data_coalescer.window = coalesce_window
+    try:
+        yield stub
+    finally:
+        (server.bloomberg, server.get_and_chain_historical_data,
+         server.is_session_locked, server.HISTORICAL_CACHE_MAX_CELLS,
+         server.historical_cache, server.field_catalog, server.chain_cache,
+         server.reference_data_coalescer.window,
+         server.historical_data_coalescer.window) = saved
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+"""Server-side cache for Bloomberg historical data.
+
+Each (ticker, field, options) series is stored with the contiguous date range
+it covers. A query only fetches the missing head and/or tail of that range
+from Bloomberg, joins it into the cached series and slices the answer out.
+"""
+
+import json
+import threading
+import datetime as dt
+from collections import OrderedDict
+
+import pandas as pd
+
+
+__author__ = ('eruiz070210', 'dgaraud111714')
+
+# Maximum number of cached data points (one per date, ticker and field).
+DEFAULT_MAX_CELLS = 10000000
+ONE_DAY = pd.Timedelta(days=1)
+
+
+def options_key(options):
+    """Normalized, hashable representation of the extra request options
+    (periodicity, overrides, ...).
+    """
+    return json.dumps(options, sort_keys=True, default=str)
+
+
+def to_request_date(timestamp, like):
+    """Convert a Timestamp back to the type of `like` (date or datetime).
+    """
+    if isinstance(like, dt.datetime):
+        return timestamp.to_pydatetime()
+    return timestamp.date()
+
+
+def missing_ranges(covered, start, end):
+    """Return the list of (start, end) ranges to fetch to cover [start, end].
+
+    Parameters
+    ----------
+
+    covered: (Timestamp, Timestamp) or None
+        Range already held.
+    start, end: Timestamp
+
+    Only the head and the tail are fetched when the requested range overlaps
+    or is adjacent to the covered one. Otherwise, the whole requested range
+    is returned: the cache keeps a single contiguous range per series and
+    bridging a hole could download far more than what was asked.
+    """
+    if covered is None:
+        return [(start, end)]
+    cstart, cend = covered
+    if end < cstart - ONE_DAY or start > cend + ONE_DAY:
+        return [(start, end)]
+    ranges = []
+    if start < cstart:
+        ranges.append((start, cstart - ONE_DAY))
+    if end > cend:
+        ranges.append((cend + ONE_DAY, end))
+    return ranges
+
+
+def merge_series(old, new):
+    """Join two series, values of `new` taking precedence on common dates.
+    """
+    if old is None or old.empty:
+        return new.sort_index()
+    if new.empty:
+        return old
+    merged = pd.concat([old, new])
+    merged = merged[~merged.index.duplicated(keep='last')]
+    return merged.sort_index()
+
+
+class _Entry(object):
+    __slots__ = ('start', 'end', 'series')
+
+    def __init__(self, start, end, series):
+        self.start = start
+        self.end = end
+        self.series = series
+
+
+class HistoricalDataCache(object):
+    """LRU cache of historical series keyed by (ticker, field, options).
+
+    The cache is bounded by its total number of data points `max_cells`, the
+    least recently used series are evicted first. Dates from today onwards are
+    never considered as covered since intraday values still move.
+    """
+
+    def __init__(self, max_cells=DEFAULT_MAX_CELLS):
+        self.max_cells = max_cells
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._cells = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def cells(self):
+        return self._cells
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._cells = 0
+
+    def stats(self):
+        with self._lock:
+            return {'series': len(self._entries),
+                    'cells': self._cells,
+                    'max_cells': self.max_cells,
+                    'hits': self.hits,
+                    'misses': self.misses}
+
+    def get_historical_data(self, fetch, ticker_list, field_list,
+                            start_date, end_date, **kwargs):
+        """Same as `bloomberg.get_historical_data` where `fetch` is only called
+        for the date ranges missing in the cache.
+
+        Parameters
+        ----------
+
+        fetch: callable
+            Function with the signature of `bloomberg.get_historical_data`.
+
+        Return a dict {ticker: DataFrame}.
+        """
+        start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+        opts = options_key(kwargs)
+        # Group the (ticker, field) pairs by missing range to send as few
+        # requests as possible to Bloomberg.
+        to_fetch = OrderedDict()
+        with self._lock:
+            for ticker in ticker_list:
+                for field in field_list:
+                    entry = self._entries.get((ticker, field, opts))
+                    covered = (entry.start, entry.end) if entry else None
+                    ranges = missing_ranges(covered, start, end)
+                    if ranges:
+                        self.misses += 1
+                    else:
+                        self.hits += 1
+                    for rng in ranges:
+                        tickers, fields = to_fetch.setdefault(rng, (OrderedDict(), OrderedDict()))
+                        tickers[ticker] = None
+                        fields[field] = None
+        for (rstart, rend), (tickers, fields) in to_fetch.iteritems():
+            data = fetch(list(tickers), list(fields),
+                         to_request_date(rstart, start_date),
+                         to_request_date(rend, end_date),
+                         **kwargs)
+            self._store(data or {}, list(tickers), list(fields), rstart, rend, opts)
+        result = self._lookup(ticker_list, field_list, start, end, opts)
+        with self._lock:
+            self._evict()
+        return result
+
+    def _store(self, data, ticker_list, field_list, start, end, opts):
+        today = pd.Timestamp(dt.date.today())
+        covered_end = min(end, today - ONE_DAY)
+        with self._lock:
+            for ticker in ticker_list:
+                # An empty series for a ticker without data, not to fetch it
+                # again.
+                frame = data.get(ticker)
+                for field in field_list:
+                    if frame is not None and field in frame:
+                        new = frame[field].dropna()
+                    else:
+                        new = pd.Series([], index=pd.DatetimeIndex([], name='date'), dtype=float)
+                    self._update((ticker, field, opts), new, start, covered_end)
+
+    def _update(self, key, new, start, end):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._cells -= len(entry.series)
+        if (entry is None or end < entry.start - ONE_DAY
+                or start > entry.end + ONE_DAY):
+            # No overlap with what we hold: start over from the new range.
+            entry = _Entry(start, end, new.sort_index())
+        else:
+            entry.series = merge_series(entry.series, new)
+            entry.start = min(entry.start, start)
+            entry.end = max(entry.end, end)
+        if entry.end < entry.start:
+            # Only today's data was fetched. It's returned but not cached.
+            entry.end = entry.start - ONE_DAY
+        self._entries[key] = entry
+        self._cells += len(entry.series)
+
+    def _evict(self):
+        while self._cells > self.max_cells and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self._cells -= len(entry.series)
+
+    def _lookup(self, ticker_list, field_list, start, end, opts):
+        result = OrderedDict()
+        with self._lock:
+            for ticker in ticker_list:
+                columns = OrderedDict()
+                for field in field_list:
+                    key = (ticker, field, opts)
+                    entry = self._entries.pop(key, None)
+                    if entry is None:
+                        continue
+                    # Most recently used at the end.
+                    self._entries[key] = entry
+                    columns[field] = entry.series.loc[start:end]
+                # As Bloomberg, no frame for a ticker without data.
+                if any(len(series.index) for series in columns.itervalues()):
+                    frame = pd.DataFrame(columns, columns=list(columns))
+                    frame.index.name = 'date'
+                    result[ticker] = frame
+        return result
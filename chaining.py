@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+"""Cache of the chained historical data.
+
+`get_and_chain_historical_data` downloads every contract of a chain and
+rebuilds the whole window on each call, although only the last days change
+from one day to the next. `ChainCache` keeps the chained history and the roll
+points (the 'chaining_start_date' of each contract) of each chain:
+
+  - a query within the cached period is answered from the cache,
+  - when `end_date` moves forward, only the tail of the chain is computed
+    again, from its last roll point: this only downloads the contracts used
+    since then. The tail is spliced onto the cached history if it agrees with
+    it over their common dates, otherwise (e.g. the history has been adjusted
+    by a new roll) the whole chain is computed again.
+
+As for the historical data cache, the data of the current day is never
+considered final.
+"""
+
+import threading
+import datetime as dt
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+__author__ = ('eruiz070210', 'dgaraud111714')
+
+# Maximum number of chains kept.
+DEFAULT_MAX_CHAINS = 2000
+ROLL_DATE_KEY = 'chaining_start_date'
+
+
+def _roll_date(couple):
+    return pd.Timestamp(couple[ROLL_DATE_KEY])
+
+
+def _contract(couple):
+    """What identifies the contract of a roll point, i.e. all but its date.
+    """
+    return {k: v for k, v in couple.iteritems() if k != ROLL_DATE_KEY}
+
+
+def same_values(left, right):
+    """Whether two frames with the same index and columns hold the same
+    values, NaN included.
+    """
+    if list(left.columns) != list(right.columns):
+        return False
+    for name in left.columns:
+        a, b = left[name].values, right[name].values
+        if a.dtype.kind in 'fi' and b.dtype.kind in 'fi':
+            if not np.allclose(a, b, equal_nan=True):
+                return False
+        elif not (pd.isnull(a) & pd.isnull(b) | (a == b)).all():
+            return False
+    return True
+
+
+class _Chain(object):
+    """Chained history of a generic ticker, final up to `end`.
+    """
+
+    def __init__(self, start, end, info, data):
+        self.start = pd.Timestamp(start)
+        self.end = pd.Timestamp(end)
+        self.info = info
+        self.data = data
+
+    def last_roll(self):
+        return _roll_date(self.info[-1])
+
+    def extend(self, end, info, data):
+        """Chain spliced with its tail `info`/`data` computed from the last
+        roll point, None if they don't agree.
+        """
+        if (not info or data is None
+                or _contract(info[0]) != _contract(self.info[-1])):
+            return None
+        roll = self.last_roll()
+        index = self.data.index
+        overlap = index[(index >= roll) & (index <= self.end)]
+        if not overlap.isin(data.index).all():
+            return None
+        if not same_values(self.data.loc[overlap], data.loc[overlap]):
+            return None
+        data = pd.concat([self.data[index < roll], data[data.index >= roll]])
+        return _Chain(self.start, end, self.info[:-1] + list(info), data)
+
+    def slice(self, start_date, end_date):
+        """Info and data of the chain over [`start_date`, `end_date`].
+        """
+        start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+        index = self.data.index
+        data = self.data[(index >= start) & (index <= end)]
+        info = [couple for couple in self.info if _roll_date(couple) <= end]
+        if start > self.start:
+            # The contract in use at `start` is the first of the chain.
+            first = 0
+            for i, couple in enumerate(info):
+                if _roll_date(couple) <= start:
+                    first = i
+            info = info[first:]
+            if info and _roll_date(info[0]) < start:
+                info[0] = dict(info[0], **{ROLL_DATE_KEY: start_date})
+        return info, data
+
+
+class ChainCache(object):
+    """Wrap `chain(tickers, fields, end_date, start_date, tolerance_in_days)`
+    which returns {'info': {ticker: roll points}, 'data': {ticker: DataFrame}},
+    i.e. `ezbbg.helpers.get_and_chain_historical_data`.
+    """
+
+    def __init__(self, chain, max_chains=DEFAULT_MAX_CHAINS):
+        self.chain = chain
+        self.max_chains = max_chains
+        self.hits = 0
+        self.extensions = 0
+        self.misses = 0
+        self._chains = OrderedDict()
+        self._lock = threading.Lock()
+
+    def stats(self):
+        with self._lock:
+            return {'chains': len(self._chains),
+                    'max_chains': self.max_chains,
+                    'hits': self.hits,
+                    'extensions': self.extensions,
+                    'misses': self.misses}
+
+    def clear(self):
+        with self._lock:
+            self._chains.clear()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._chains.pop(key, None)
+            if entry is not None:
+                self._chains[key] = entry
+            return entry
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._chains.pop(key, None)
+            self._chains[key] = entry
+            while len(self._chains) > self.max_chains:
+                self._chains.popitem(last=False)
+
+    def _count(self, name, number):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + number)
+
+    def get_and_chain_historical_data(self, tickers, fields, end_date,
+                                      start_date=None, tolerance_in_days=4):
+        if start_date is None or self.max_chains <= 0:
+            return self.chain(tickers, fields, end_date, start_date,
+                              tolerance_in_days)
+        # The data of the current day may still change.
+        covered_end = min(pd.Timestamp(end_date),
+                          pd.Timestamp(dt.date.today() - dt.timedelta(days=1)))
+        keys = {ticker: (ticker, tuple(fields), tolerance_in_days)
+                for ticker in tickers}
+        entries = {}
+        missing = []
+        # last roll point -> (ticker, chain) extended from it
+        tails = {}
+        for ticker in tickers:
+            entry = self._get(keys[ticker])
+            if (entry is None or not entry.info
+                    or entry.start > pd.Timestamp(start_date)):
+                missing.append(ticker)
+            elif entry.end >= pd.Timestamp(end_date):
+                entries[ticker] = entry
+            else:
+                tails.setdefault(entry.last_roll(), []).append((ticker, entry))
+        self._count('hits', len(entries))
+
+        for roll, group in tails.iteritems():
+            result = self.chain([ticker for ticker, _ in group], fields,
+                                end_date, roll.date(), tolerance_in_days)
+            for ticker, entry in group:
+                entry = entry.extend(covered_end, result['info'].get(ticker),
+                                     result['data'].get(ticker))
+                if entry is None:
+                    missing.append(ticker)
+                    continue
+                self._store(keys[ticker], entry)
+                entries[ticker] = entry
+                self._count('extensions', 1)
+
+        if missing:
+            self._count('misses', len(missing))
+            result = self.chain(missing, fields, end_date, start_date,
+                                tolerance_in_days)
+            for ticker in missing:
+                info = result['info'].get(ticker)
+                data = result['data'].get(ticker)
+                if not info or data is None:
+                    continue
+                entry = _Chain(start_date, covered_end, list(info), data)
+                self._store(keys[ticker], entry)
+                entries[ticker] = entry
+
+        info, data = {}, {}
+        for ticker in tickers:
+            if ticker in entries:
+                info[ticker], data[ticker] = entries[ticker].slice(start_date,
+                                                                   end_date)
+        return {'info': info, 'data': data}
@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
 
 import json
-import inspect
-from functools import partial
 from ast import literal_eval
+from collections import OrderedDict
+from functools import partial
 import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 import numpy as np
 from dateutil import parser
 import pandas as pd
@@ -12,6 +14,12 @@ import pandas as pd
 requests.packages.urllib3.disable_warnings()
 
 from ezbbg.ws import git_version
+from ezbbg.ws import wire
+from ezbbg.ws import compression
+from ezbbg.ws import delta
+from ezbbg.ws import frames_json
+from ezbbg.ws import transforms
+from ezbbg.ws import consolidate
 
 
 __author__ = ('eruiz070210', 'dgaraud111714')
@@ -21,6 +29,17 @@ HOST = 'localhost'
 PORT = 6666
 HEADERS = {'Content-type': 'application/json', 'Accept': 'text/plain'}
 DEFAULT_TIMEOUT = 30
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+RETRY_STATUS = (502, 503, 504)
+WIRE_FORMATS = ('json', 'columnar')
+NDJSON_MIMETYPE = 'application/x-ndjson'
+TYPED_JSON_MIMETYPE = 'application/vnd.ezbbg.typed+json'
+REFDATA_SCALAR = 'scalar'
+REFDATA_DATE = 'date'
+REFDATA_DATETIME = 'datetime'
+REFDATA_BULK = 'bulk'
 # ComputerID:PORT or IP_address:PORT only via HTTPS
 URL_EZBBG_ROOT = "https://{0}:{1}"
 URL_REFERENCE_DATA = '/'.join([URL_EZBBG_ROOT, "reference_data"])
@@ -31,6 +50,7 @@ URL_FIELDS_INFO = '/'.join([URL_EZBBG_ROOT, "fields_info"])
 URL_FIELDS = '/'.join([URL_EZBBG_ROOT, "fields"])
 URL_FIELDS_BY_CATEGORY = '/'.join([URL_EZBBG_ROOT, "fields_by_category"])
 URL_CHAIN_HIST = '/'.join([URL_EZBBG_ROOT, "chain_historical_data"])
+URL_BATCH = '/'.join([URL_EZBBG_ROOT, "batch"])
 
 
 def _refdata_converter(data):
@@ -56,98 +76,84 @@ def _refdata_converter(data):
     return data
 
 
-def _ezbbg_server_version(host, port):
-    """Get the version of ezbbg which runs on the server.
+def _bulk_frame(bulk):
+    """DataFrame of a column-oriented bulk field.
     """
-    response = requests.get(URL_BBG_VERSION.format(host, port),
-                            headers=HEADERS,
-                            verify=False)
-    response.raise_for_status()
-    return response.content
-
-def _service_version(host, port):
-    """Get the version of Web Service on server side.
+    columns = bulk['columns']
+    frame = pd.DataFrame(OrderedDict(zip(columns, bulk['data'])),
+                         columns=columns)
+    for name in bulk['dates']:
+        frame[name] = pd.to_datetime(frame[name])
+    return frame
+
+
+def _typed_refdata_converter(typed_data):
+    """Decode the reference data according to the type of each field.
+    """
+    types = typed_data['types']
+    data = typed_data['data']
+    for dictionary in data.itervalues():
+        for key, value in dictionary.iteritems():
+            kind = types.get(key, REFDATA_SCALAR)
+            if kind == REFDATA_SCALAR or value is None:
+                continue
+            if kind == REFDATA_BULK and isinstance(value, dict):
+                dictionary[key] = _bulk_frame(value)
+            elif kind == REFDATA_DATE and isinstance(value, basestring):
+                dictionary[key] = np.datetime64(value)
+            elif kind == REFDATA_DATETIME and isinstance(value, basestring):
+                dictionary[key] = pd.Timestamp(value)
+    return data
+
+
+def _historical_frame(df):
+    """Add the label 'date' to the index, as the returned DataFrame of the
+    original 'get_historical_data', and sort it.
     """
-    response = requests.get(URL_WS_VERSION.format(host, port),
-                            headers=HEADERS,
-                            verify=False)
-    response.raise_for_status()
-    return response.content
+    df.index.name = "date"
+    if not df.index.is_monotonic_increasing:
+        df.sort_index(inplace=True)
+    return df
 
 
-def _get_reference_data(ticker_list, field_list, host, port, **kwargs):
+def _reference_data_request(ticker_list, field_list, **kwargs):
     reference_data_request = {
         'ticker_list': [x for x in ticker_list],
         'field_list': field_list
     }
-    timeout = kwargs.pop('timeout', DEFAULT_TIMEOUT)
     reference_data_request.update(kwargs)
-    reference_data_request_js = json.dumps(reference_data_request)
-    response = requests.get(URL_REFERENCE_DATA.format(host, port),
-                            data=reference_data_request_js,
-                            headers=HEADERS,
-                            verify=False,
-                            timeout=timeout)
-    response.raise_for_status()
-    return _refdata_converter(response.json())
-
-
-def _get_historical_data(ticker_list, field_list, start_date, end_date,
-                        host, port, **kwargs):
+    return reference_data_request
+
+
+def _historical_data_request(ticker_list, field_list, start_date, end_date,
+                             **kwargs):
     historical_data_request = {
         'ticker_list': [x for x in ticker_list],
         'field_list': field_list,
         'start_date': start_date.isoformat(),
         'end_date': end_date.isoformat()}
-    timeout = kwargs.pop('timeout', DEFAULT_TIMEOUT)
     historical_data_request.update(kwargs)
-    historical_data_request_js = json.dumps(historical_data_request)
-    response = requests.get(URL_HISTORICAL_DATA.format(host, port),
-                            data=historical_data_request_js,
-                            headers=HEADERS,
-                            verify=False,
-                            timeout=timeout)
-    response.raise_for_status()
-    if response.text == 'Error':
-        return None
-    data_dict_json = response.json()
-    result = {k: pd.read_json(v) for k,v in data_dict_json.iteritems()}
-    # Add the label 'date' to each index, as the returned DataFrame of the
-    # original 'get_historical_data'.
-    for k, df in result.iteritems():
-        df.index.name = "date"
-        df.sort_index(inplace=True)
-    return result
+    return historical_data_request
 
 
-def _get_fields_info(field_list, host, port, return_field_documentation=True, **kwargs):
+def _fields_info_request(field_list, return_field_documentation=True, **kwargs):
     fields_info_request = {
         'field_list': field_list,
         'return_field_documentation': return_field_documentation
     }
-    timeout = kwargs.pop('timeout', DEFAULT_TIMEOUT)
     fields_info_request.update(kwargs)
-    fields_info_request_js = json.dumps(fields_info_request)
-    response = requests.get(URL_FIELDS_INFO.format(host, port),
-                            data=fields_info_request_js,
-                            headers=HEADERS,
-                            verify=False,
-                            timeout=timeout)
-    response.raise_for_status()
-    return response.json()
-
-
-def _search_fields(search_string,
-                   host,
-                   port,
-                   return_field_documentation=True,
-                   include_categories=None,
-                   include_product_type=None,
-                   include_field_type=None,
-                   exclude_categories=None,
-                   exclude_product_type=None,
-                   exclude_field_type=None,
-                   **kwargs):
+    return fields_info_request
+
+
+def _search_fields_request(search_string,
+                           return_field_documentation=True,
+                           include_categories=None,
+                           include_product_type=None,
+                           include_field_type=None,
+                           exclude_categories=None,
+                           exclude_product_type=None,
+                           exclude_field_type=None,
+                           **kwargs):
     fields_request = {
         'search_string': search_string,
         'return_field_documentation': return_field_documentation,
@@ -158,26 +164,16 @@ def _search_fields(search_string,
         'exclude_product_type': exclude_product_type,
         'exclude_field_type': exclude_field_type
     }
-    timeout = kwargs.pop('timeout', DEFAULT_TIMEOUT)
     fields_request.update(kwargs)
-    fields_request_js = json.dumps(fields_request)
-    response = requests.get(URL_FIELDS.format(host, port),
-                            data=fields_request_js,
-                            headers=HEADERS,
-                            verify=False,
-                            timeout=timeout)
-    response.raise_for_status()
-    return response.json()
-
-
-def _search_fields_by_category(search_string,
-                               host,
-                               port,
-                               return_field_documentation=True,
-                               exclude_categories=None,
-                               exclude_product_type=None,
-                               exclude_field_type=None,
-                               **kwargs):
+    return fields_request
+
+
+def _search_fields_by_category_request(search_string,
+                                       return_field_documentation=True,
+                                       exclude_categories=None,
+                                       exclude_product_type=None,
+                                       exclude_field_type=None,
+                                       **kwargs):
     fields_by_category_request = {
         'search_string': search_string,
         'return_field_documentation': return_field_documentation,
@@ -185,33 +181,75 @@ def _search_fields_by_category(search_string,
         'exclude_product_type': exclude_product_type,
         'exclude_field_type': exclude_field_type
     }
-    timeout = kwargs.pop('timeout', DEFAULT_TIMEOUT)
     fields_by_category_request.update(kwargs)
-    fields_by_category_request_js = json.dumps(fields_by_category_request)
-    response = requests.get(URL_FIELDS_BY_CATEGORY.format(host, port),
-                            data=fields_by_category_request_js,
-                            headers=HEADERS,
-                            verify=False,
-                            timeout=timeout)
-    response.raise_for_status()
-    return response.json()
-
-
-def _chain_historical_data(tickers, fields, end_date, host, port,
-                           start_date=None, tolerance_in_days=4):
+    return fields_by_category_request
+
+
+def _chain_historical_data_request(tickers, fields, end_date, start_date=None,
+                                   tolerance_in_days=4):
     if not start_date:
         start_date = (end_date - pd.DateOffset(years=5)).date()
-    body = {"tickers": [x for x in tickers],
+    return {"tickers": [x for x in tickers],
             'fields': [x for x in fields],
             'start_date': start_date.isoformat(),
             'end_date': end_date.isoformat(),
             'tolerance_days': tolerance_in_days}
-    resp = requests.get(URL_CHAIN_HIST.format(host, port),
-                        data=json.dumps(body), headers=HEADERS, verify=False)
-    resp.raise_for_status()
-    data_json = resp.json()
-    # Load JSON for historical data
-    hist_data = {k: pd.read_json(v) for k,v in data_json["data"].iteritems()}
+
+
+def _is_columnar(content_type):
+    return content_type.startswith(wire.COLUMNAR_MIMETYPE)
+
+
+def _has_frames(content_type):
+    """Whether the DataFrames of the payload are already decoded.
+    """
+    return (_is_columnar(content_type)
+            or content_type.startswith(frames_json.FRAMES_JSON_MIMETYPE))
+
+
+def _payload(response):
+    """Content type and decoded payload of a response: the JSON object or
+    the columnar data, None if the server answered 'Error'.
+    """
+    content_type = response.headers.get('Content-Type', '')
+    if _is_columnar(content_type):
+        # Decode from a bytearray to get writable DataFrames.
+        return content_type, wire.decode(bytearray(response.content))
+    if response.text == 'Error':
+        return content_type, None
+    if content_type.startswith(frames_json.FRAMES_JSON_MIMETYPE):
+        return content_type, response.json(object_hook=frames_json.object_hook)
+    return content_type, response.json()
+
+
+def _decode_json(data, content_type):
+    return data
+
+
+def _decode_reference_data(data, content_type):
+    if _is_columnar(content_type):
+        return data
+    if content_type.startswith(TYPED_JSON_MIMETYPE):
+        return _typed_refdata_converter(data)
+    # Older server: guess the type of each value.
+    return _refdata_converter(data)
+
+
+def _decode_historical_data(data, content_type, sort=True):
+    if not _has_frames(content_type):
+        data = {k: pd.read_json(v) for k,v in data.iteritems()}
+    if sort:
+        for df in data.itervalues():
+            _historical_frame(df)
+    return data
+
+
+def _decode_chain_historical_data(data_json, content_type):
+    if _has_frames(content_type):
+        hist_data = data_json["data"]
+    else:
+        # Load JSON for historical data
+        hist_data = {k: pd.read_json(v) for k,v in data_json["data"].iteritems()}
     for k, df in hist_data.iteritems():
         df.index.name = "date"
     # Convert dates for the chaining info dict
@@ -223,39 +261,522 @@ def _chain_historical_data(tickers, fields, end_date, host, port,
             'data': hist_data}
 
 
-def update_host(host, port=PORT):
+class BatchResult(object):
+    """Result of a query of a `Batch`, available once the batch is executed.
+    """
+
+    def __init__(self, route, decode):
+        self.route = route
+        self._decode = decode
+        self._done = False
+        self._data = None
+        self._error = None
+
+    def _set(self, result, content_type):
+        self._done = True
+        if result['status'] != 200:
+            self._error = requests.HTTPError(
+                "{0} query failed ({1}): {2}".format(self.route, result['status'],
+                                                     result.get('error')))
+        else:
+            self._data = self._decode(result['data'], content_type)
+
+    def done(self):
+        return self._done
+
+    def result(self):
+        """Return the data of the query or raise its error.
+        """
+        if not self._done:
+            raise RuntimeError("The batch has not been executed yet")
+        if self._error is not None:
+            raise self._error
+        return self._data
+
+
+class Batch(object):
+    """Queries sent to the server in a single round trip.
+
+    The methods have the signature of the `EzbbgClient` ones and return a
+    `BatchResult`. The queries are sent by `execute`, or when leaving the
+    `with` block:
+
+    >>> with client.batch() as batch:
+    ...     info = batch.get_fields_info(['PX_LAST'])
+    ...     last = batch.get_reference_data(['SX5E Index'], ['PX_LAST'])
+    >>> last.result()
+    """
+
+    def __init__(self, client, timeout=None):
+        self.client = client
+        self.timeout = timeout
+        self._queries = []
+        self._results = {}
+
+    def __len__(self):
+        return len(self._queries)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+
+    def _add(self, route, request, decode):
+        query_id = str(len(self._queries))
+        self._queries.append({'id': query_id, 'route': route, 'args': request})
+        result = self._results[query_id] = BatchResult(route, decode)
+        return result
+
+    def get_reference_data(self, ticker_list, field_list, **kwargs):
+        return self._add('reference_data',
+                         _reference_data_request(ticker_list, field_list, **kwargs),
+                         _decode_reference_data)
+
+    def get_historical_data(self, ticker_list, field_list, start_date,
+                            end_date, **kwargs):
+        return self._add('historical_data',
+                         _historical_data_request(ticker_list, field_list,
+                                                  start_date, end_date, **kwargs),
+                         _decode_historical_data)
+
+    def get_fields_info(self, field_list, return_field_documentation=True,
+                        **kwargs):
+        return self._add('fields_info',
+                         _fields_info_request(field_list,
+                                              return_field_documentation,
+                                              **kwargs),
+                         _decode_json)
+
+    def search_fields(self, search_string, *args, **kwargs):
+        return self._add('fields',
+                         _search_fields_request(search_string, *args, **kwargs),
+                         _decode_json)
+
+    def search_fields_by_category(self, search_string, *args, **kwargs):
+        return self._add('fields_by_category',
+                         _search_fields_by_category_request(search_string,
+                                                            *args, **kwargs),
+                         _decode_json)
+
+    def get_and_chain_historical_data(self, tickers, fields, end_date,
+                                      start_date=None, tolerance_in_days=4):
+        return self._add('chain_historical_data',
+                         _chain_historical_data_request(tickers, fields, end_date,
+                                                        start_date,
+                                                        tolerance_in_days),
+                         _decode_chain_historical_data)
+
+    def execute(self):
+        """Send the queries, return the list of their `BatchResult`.
+        """
+        if not self._queries:
+            return []
+        content_type, data = self.client._get_data(
+            URL_BATCH, {'queries': self._queries}, self.timeout,
+            accept=[frames_json.FRAMES_JSON_MIMETYPE])
+        for query_id, result in data['results'].iteritems():
+            # The JSON reference data of a batch are always typed.
+            result_type = content_type
+            if (not _is_columnar(content_type)
+                    and self._results[query_id].route == 'reference_data'):
+                result_type = TYPED_JSON_MIMETYPE
+            self._results[query_id]._set(result, result_type)
+        return [self._results[query['id']] for query in self._queries]
+
+
+class EzbbgClient(object):
+    """HTTP client of the ezbbg Web Service.
+
+    The queries go through a pooled `requests.Session` which keeps the
+    connections, and thus the TLS sessions, alive between the calls.
+
+    Parameters
+    ----------
+
+    host, port: str, int
+        Location of the server.
+    pool_size: int
+        Maximum number of connections kept alive.
+    max_retries: int
+        Number of retries on connection errors and 502/503/504 responses.
+        Read timeouts aren't retried.
+    backoff_factor: float
+        Sleep `backoff_factor * 2 ** (retry - 1)` seconds between retries.
+    timeout: float
+        Default timeout in seconds of the data queries.
+    wire_format: str
+        'json' or 'columnar'. The binary columnar format avoids the text
+        encoding/decoding of the historical, reference and chained data. The
+        client falls back on JSON if the server doesn't support it.
+    scheme: str
+        'https', or 'http' for a server run without TLS (e.g. benchmarks).
+    disk_cache: str or DiskCache
+        Directory of a persistent cache of the historical data, shared by the
+        clients and processes using it, see `ezbbg.ws.disk_cache`. None to
+        always query the server.
+    memoize: bool or Memoizer
+        Keep the reference data and field information in memory, see
+        `ezbbg.ws.memo`. True for a `Memoizer` with the default time-to-live
+        and memory budget.
+    """
+
+    def __init__(self, host=HOST, port=PORT, pool_size=DEFAULT_POOL_SIZE,
+                 max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_factor=DEFAULT_BACKOFF_FACTOR,
+                 timeout=DEFAULT_TIMEOUT,
+                 wire_format='json',
+                 scheme='https',
+                 disk_cache=None,
+                 memoize=None):
+        if wire_format not in WIRE_FORMATS:
+            raise ValueError("Unknown wire format '{}'".format(wire_format))
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.wire_format = wire_format
+        self.scheme = scheme
+        if isinstance(disk_cache, basestring):
+            from ezbbg.ws.disk_cache import DiskCache
+            disk_cache = DiskCache(disk_cache)
+        self.disk_cache = disk_cache
+        if memoize is True:
+            from ezbbg.ws.memo import Memoizer
+            memoize = Memoizer()
+        elif memoize is False:
+            memoize = None
+        self.memo = memoize
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        self.session.verify = False
+        # A read timeout isn't retried: the server may still be querying
+        # Bloomberg for the first request.
+        retry = Retry(total=max_retries,
+                      read=0,
+                      backoff_factor=backoff_factor,
+                      status_forcelist=RETRY_STATUS,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size,
+                              max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def __repr__(self):
+        return "<EzbbgClient {0}:{1}>".format(self.host, self.port)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def _get(self, url, request=None, timeout=None, headers=None,
+             stream=False):
+        data = json.dumps(request) if request is not None else None
+        headers = dict(headers or {})
+        headers.setdefault('Accept-Encoding', compression.accept_encoding(stream))
+        url = url.format(self.host, self.port)
+        if self.scheme != 'https':
+            url = url.replace('https://', self.scheme + '://', 1)
+        response = self.session.get(url,
+                                    data=data,
+                                    timeout=timeout,
+                                    headers=headers,
+                                    stream=stream)
+        response.raise_for_status()
+        encoding = response.headers.get('Content-Encoding')
+        if not stream and encoding == compression.ZSTD:
+            # requests only decodes gzip and deflate.
+            response._content = compression.decompress(response.content, encoding)
+        return response
+
+    def _get_data(self, url, request, timeout, accept=None):
+        """Query data in the wire format of the client.
+
+        `accept` lists the JSON variants understood for this query, by order
+        of preference.
+
+        Return the content type of the response and the decoded payload, i.e.
+        the JSON object or the columnar data.
+        """
+        response = self._get(url, request, timeout, self._accept_headers(accept))
+        return _payload(response)
+
+    def _accept_headers(self, accept=None):
+        accept = list(accept or [])
+        if self.wire_format == 'columnar':
+            accept.insert(0, wire.COLUMNAR_MIMETYPE)
+        if not accept:
+            return {}
+        return {'Accept': ', '.join(accept + ['application/json;q=0.5'])}
+
+    def batch(self, timeout=None):
+        """Return a `Batch` to send several queries in one round trip.
+        """
+        return Batch(self, timeout if timeout is not None else self.timeout)
+
+    def ezbbg_server_version(self):
+        """Get the version of ezbbg which runs on the server.
+        """
+        return self._get(URL_BBG_VERSION, timeout=self.timeout).content
+
+    def service_version(self):
+        """Get the version of Web Service on server side.
+        """
+        return self._get(URL_WS_VERSION, timeout=self.timeout).content
+
+    def get_reference_data(self, ticker_list, field_list, **kwargs):
+        timeout = kwargs.pop('timeout', self.timeout)
+        if self.memo is not None:
+            return self.memo.get_reference_data(
+                partial(self._get_reference_data, timeout=timeout),
+                ticker_list, field_list, **kwargs)
+        return self._get_reference_data(ticker_list, field_list, timeout,
+                                        **kwargs)
+
+    def _get_reference_data(self, ticker_list, field_list, timeout=None,
+                            **kwargs):
+        reference_data_request = _reference_data_request(ticker_list, field_list,
+                                                         **kwargs)
+        content_type, data = self._get_data(URL_REFERENCE_DATA,
+                                            reference_data_request, timeout,
+                                            accept=[TYPED_JSON_MIMETYPE])
+        return _decode_reference_data(data, content_type)
+
+    def get_historical_data(self, ticker_list, field_list, start_date, end_date,
+                            **kwargs):
+        timeout = kwargs.pop('timeout', self.timeout)
+        # See `ezbbg.ws.consolidate`.
+        layout = consolidate.pop_layout(kwargs)
+        if self.disk_cache is not None:
+            # The cache holds the histories as sent by Bloomberg, the
+            # transform (see `ezbbg.ws.transforms`) is applied to them here.
+            transform = transforms.parse(kwargs.pop('transform', None))
+            data = self.disk_cache.get_historical_data(
+                partial(self._get_historical_data, timeout=timeout),
+                ticker_list, field_list, start_date, end_date, **kwargs)
+            data = transforms.apply(data, transform)
+        else:
+            # The consolidated layouts sort all the rows at once.
+            data = self._get_historical_data(ticker_list, field_list,
+                                             start_date, end_date, timeout,
+                                             sort=layout is None, **kwargs)
+        return consolidate.apply(data, layout)
+
+    def _get_historical_data(self, ticker_list, field_list, start_date,
+                             end_date, timeout=None, sort=True, **kwargs):
+        historical_data_request = _historical_data_request(
+            ticker_list, field_list, start_date, end_date, **kwargs)
+        content_type, data = self._get_data(URL_HISTORICAL_DATA,
+                                            historical_data_request, timeout,
+                                            accept=[frames_json.FRAMES_JSON_MIMETYPE])
+        if data is None:
+            return None
+        return _decode_historical_data(data, content_type, sort)
+
+    def update_historical_data(self, ticker_list, field_list, start_date,
+                               end_date, data, **kwargs):
+        """Bring `data`, the {ticker: DataFrame} of a previous historical
+        data query, up to `end_date` in place.
+
+        The server only sends the rows after those held for each ticker, or
+        its whole history if the rows held were revised (see `delta`).
+
+        Return the {ticker: DataFrame} of the tickers which changed.
+        """
+        timeout = kwargs.pop('timeout', self.timeout)
+        request = _historical_data_request(ticker_list, field_list, start_date,
+                                           end_date, **kwargs)
+        held = delta.held_state({ticker: data[ticker] for ticker in ticker_list
+                                 if ticker in data}, start_date, end_date)
+        request['held'] = held
+        headers = self._accept_headers([frames_json.FRAMES_JSON_MIMETYPE])
+        headers['If-None-Match'] = '"{}"'.format(
+            delta.etag({ticker: state['hash'] for ticker, state in held.iteritems()}))
+        response = self._get(URL_HISTORICAL_DATA, request, timeout, headers)
+        if response.status_code == 304:
+            return {}
+        content_type, payload = _payload(response)
+        if payload is None:
+            return None
+        rows = _decode_historical_data(payload['data'], content_type)
+        changed = delta.merge(data, rows, payload['replaced'])
+        return {ticker: data[ticker] for ticker in changed}
+
+    def iter_historical_data(self, ticker_list, field_list, start_date,
+                             end_date, stream_chunk_size=None, **kwargs):
+        """Stream the historical data: yield the pairs (ticker, DataFrame) as
+        soon as the server sends them.
+
+        The server queries Bloomberg by chunks of `stream_chunk_size` tickers.
+        The timeout applies between two received records. The frames are
+        yielded one by one, so the consolidated layouts aren't supported.
+        """
+        timeout = kwargs.pop('timeout', self.timeout)
+        layout = consolidate.pop_layout(kwargs)
+        if layout is not None:
+            raise ValueError("The layout '{}' isn't supported by the stream, "
+                             "use get_historical_data".format(layout.kind))
+        historical_data_request = _historical_data_request(
+            ticker_list, field_list, start_date, end_date, **kwargs)
+        if stream_chunk_size is not None:
+            historical_data_request['stream_chunk_size'] = stream_chunk_size
+        # The frames of the records are sent as frames_json objects.
+        accept = ', '.join([NDJSON_MIMETYPE,
+                            frames_json.FRAMES_JSON_MIMETYPE + ';q=0.9'])
+        response = self._get(URL_HISTORICAL_DATA, historical_data_request,
+                             timeout, headers={'Accept': accept}, stream=True)
+        try:
+            content_type = response.headers.get('Content-Type', '')
+            if not content_type.startswith(NDJSON_MIMETYPE):
+                # The server doesn't stream.
+                content_type, data = _payload(response)
+                if data is None:
+                    return
+                data = _decode_historical_data(data, content_type)
+                for ticker, frame in data.iteritems():
+                    yield ticker, frame
+                return
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                record = json.loads(line, object_hook=frames_json.object_hook)
+                if 'error' in record:
+                    raise requests.HTTPError(
+                        "Historical data stream failed: {}".format(record['error']),
+                        response=response)
+                frame = record['data']
+                if isinstance(frame, basestring):
+                    # Server sending the frames as JSON strings.
+                    frame = pd.read_json(frame)
+                yield record['ticker'], _historical_frame(frame)
+        finally:
+            response.close()
+
+    def get_fields_info(self, field_list, return_field_documentation=True,
+                        **kwargs):
+        timeout = kwargs.pop('timeout', self.timeout)
+        if self.memo is not None:
+            return self.memo.get_fields_info(
+                partial(self._get_fields_info, timeout=timeout),
+                field_list, return_field_documentation, **kwargs)
+        return self._get_fields_info(field_list, return_field_documentation,
+                                     timeout, **kwargs)
+
+    def _get_fields_info(self, field_list, return_field_documentation=True,
+                         timeout=None, **kwargs):
+        fields_info_request = _fields_info_request(field_list,
+                                                   return_field_documentation,
+                                                   **kwargs)
+        return self._get(URL_FIELDS_INFO, fields_info_request, timeout).json()
+
+    def search_fields(self, search_string, *args, **kwargs):
+        """See `_search_fields_request` for the search options.
+        """
+        timeout = kwargs.pop('timeout', self.timeout)
+        fields_request = _search_fields_request(search_string, *args, **kwargs)
+        return self._get(URL_FIELDS, fields_request, timeout).json()
+
+    def search_fields_by_category(self, search_string, *args, **kwargs):
+        """See `_search_fields_by_category_request` for the search options.
+        """
+        timeout = kwargs.pop('timeout', self.timeout)
+        fields_by_category_request = _search_fields_by_category_request(
+            search_string, *args, **kwargs)
+        return self._get(URL_FIELDS_BY_CATEGORY, fields_by_category_request,
+                         timeout).json()
+
+    def get_and_chain_historical_data(self, tickers, fields, end_date,
+                                      start_date=None, tolerance_in_days=4,
+                                      timeout=None, layout=None, dtype=None,
+                                      categorical=True):
+        """`layout`, `dtype` and `categorical` give the container of the
+        chained data, see `ezbbg.ws.consolidate`.
+        """
+        layout = consolidate.pop_layout({'layout': layout, 'dtype': dtype,
+                                         'categorical': categorical})
+        body = _chain_historical_data_request(tickers, fields, end_date,
+                                              start_date, tolerance_in_days)
+        content_type, data_json = self._get_data(
+            URL_CHAIN_HIST, body, timeout,
+            accept=[frames_json.FRAMES_JSON_MIMETYPE])
+        result = _decode_chain_historical_data(data_json, content_type)
+        result['data'] = consolidate.apply(result['data'], layout)
+        return result
+
+
+_default_client = EzbbgClient(HOST, PORT)
+# Clients of the (host, port) given as keyword arguments to the module-level
+# functions.
+_clients = {}
+
+
+def default_client():
+    """Return the `EzbbgClient` used by the module-level functions.
+    """
+    return _default_client
+
+
+def _client(host=None, port=None):
+    if host is None and port is None:
+        return _default_client
+    default = (getattr(_default_client, 'host', HOST),
+               getattr(_default_client, 'port', PORT))
+    key = (host or default[0], port or default[1])
+    if key == default and isinstance(_default_client, EzbbgClient):
+        return _default_client
+    if key not in _clients:
+        _clients[key] = EzbbgClient(*key)
+    return _clients[key]
+
+
+def update_host(host, port=PORT, **kwargs):
     """Update the (host, port) parameters for all HTTP client functions.
+
+    `host` may be a list of hosts (or of (host, port) pairs) to spread the
+    queries over several servers with a `ShardedClient`.
+
+    Extra keyword arguments are passed to `EzbbgClient`, or `ShardedClient`.
+    """
+    global _default_client
+    _default_client.close()
+    if isinstance(host, (list, tuple)):
+        from ezbbg.ws.sharding import ShardedClient
+        _default_client = ShardedClient(host, port, **kwargs)
+    else:
+        _default_client = EzbbgClient(host, port, **kwargs)
+
+
+def _default_method(name):
+    """Module-level function calling the method `name` of the default client.
+
+    The keyword arguments `host` and `port` are still accepted to query
+    another server.
     """
-    frame = inspect.currentframe()
-    try:
-        frame.f_globals["get_reference_data"] = partial(_get_reference_data,
-                                                        host=host, port=port)
-        frame.f_globals["get_historical_data"] = partial(_get_historical_data,
-                                                         host=host, port=port)
-        frame.f_globals["ezbbg_server_version"] = partial(_ezbbg_server_version,
-                                                          host=host, port=port)
-        frame.f_globals["service_version"] = partial(_service_version,
-                                                     host=host, port=port)
-        frame.f_globals["get_fields_info"] = partial(_get_fields_info,
-                                                     host=host, port=port)
-        frame.f_globals["search_fields"] = partial(_search_fields,
-                                                   host=host, port=port)
-        frame.f_globals["search_fields_by_category"] = partial(_search_fields_by_category,
-                                                               host=host, port=port)
-        frame.f_globals["get_and_chain_historical_data"] = partial(_chain_historical_data,
-                                                                   host=host, port=port)
-    finally:
-        del frame
-
-
-get_reference_data = partial(_get_reference_data, host=HOST, port=PORT)
-get_historical_data = partial(_get_historical_data, host=HOST, port=PORT)
-ezbbg_server_version = partial(_ezbbg_server_version, host=HOST, port=PORT)
-service_version = partial(_service_version, host=HOST, port=PORT)
-get_fields_info = partial(_get_fields_info, host=HOST, port=PORT)
-search_fields = partial(_search_fields, host=HOST, port=PORT)
-search_fields_by_category = partial(_search_fields_by_category, host=HOST, port=PORT)
-get_and_chain_historical_data = partial(_chain_historical_data, host=HOST, port=PORT)
+    def method(*args, **kwargs):
+        client = _client(kwargs.pop('host', None), kwargs.pop('port', None))
+        return getattr(client, name)(*args, **kwargs)
+    method.__name__ = name
+    method.__doc__ = getattr(EzbbgClient, name).__doc__
+    return method
+
+
+get_reference_data = _default_method('get_reference_data')
+get_historical_data = _default_method('get_historical_data')
+iter_historical_data = _default_method('iter_historical_data')
+update_historical_data = _default_method('update_historical_data')
+ezbbg_server_version = _default_method('ezbbg_server_version')
+service_version = _default_method('service_version')
+get_fields_info = _default_method('get_fields_info')
+search_fields = _default_method('search_fields')
+search_fields_by_category = _default_method('search_fields_by_category')
+get_and_chain_historical_data = _default_method('get_and_chain_historical_data')
+batch = _default_method('batch')
 
 
 def check_versions():
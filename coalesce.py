@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+"""Coalescing of concurrent Bloomberg queries.
+
+When a batch of jobs starts, many clients send the same query at the same
+time. Queries which only differ by their tickers are merged into a single
+Bloomberg query over the union of the tickers, the result being split back
+per caller.
+"""
+
+import json
+import time
+import threading
+from collections import OrderedDict
+
+
+__author__ = ('eruiz070210', 'dgaraud111714')
+
+# Time in seconds during which the queries are collected before being sent,
+# when an identical query is already in flight.
+DEFAULT_WINDOW = 0.01
+
+
+class _Batch(object):
+    def __init__(self):
+        self.tickers = OrderedDict()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Coalescer(object):
+    """Wrap a Bloomberg query function `fetch(ticker_list, *args, **kwargs)`
+    which returns a dict {ticker: data}.
+
+    A query is sent at once unless a query with the same arguments apart from
+    the tickers is in flight. The queries arriving meanwhile are then
+    collected for `window` seconds and sent as a single query. A query whose
+    tickers are all part of a query in flight waits for its result instead of
+    querying Bloomberg again (single-flight).
+    """
+
+    def __init__(self, fetch, window=DEFAULT_WINDOW):
+        self.fetch = fetch
+        self.window = window
+        self.queries = 0
+        self.fetches = 0
+        self._lock = threading.Lock()
+        # key -> batch still collecting tickers
+        self._pending = {}
+        # key -> batches sent to Bloomberg
+        self._running = {}
+
+    def stats(self):
+        with self._lock:
+            return {'queries': self.queries,
+                    'fetches': self.fetches,
+                    'in_flight': sum(len(b) for b in self._running.itervalues())}
+
+    def __call__(self, ticker_list, *args, **kwargs):
+        key = json.dumps([args, kwargs], sort_keys=True, default=str)
+        leader = False
+        with self._lock:
+            self.queries += 1
+            for batch in self._running.get(key, ()):
+                if all(ticker in batch.tickers for ticker in ticker_list):
+                    break
+            else:
+                batch = self._pending.get(key)
+                if batch is None:
+                    leader = True
+                    # Collect the other queries of a burst, if any.
+                    wait = bool(self._running.get(key))
+                    batch = self._pending[key] = _Batch()
+                batch.tickers.update((ticker, None) for ticker in ticker_list)
+        if leader:
+            self._run(key, batch, args, kwargs, wait)
+        else:
+            batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        return OrderedDict((ticker, batch.result[ticker]) for ticker in ticker_list
+                           if ticker in batch.result)
+
+    def _run(self, key, batch, args, kwargs, wait):
+        if wait and self.window > 0:
+            time.sleep(self.window)
+        with self._lock:
+            del self._pending[key]
+            self._running.setdefault(key, []).append(batch)
+            self.fetches += 1
+        try:
+            batch.result = self.fetch(list(batch.tickers), *args, **kwargs) or {}
+        except Exception as exc:
+            batch.error = exc
+        finally:
+            with self._lock:
+                running = self._running[key]
+                running.remove(batch)
+                if not running:
+                    del self._running[key]
+            batch.done.set()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+"""HTTP content encoding of the responses.
+
+The historical and chained data are large and repetitive (the same dates and
+column names for every ticker), they shrink a lot once compressed, which
+matters for the users querying the service from other sites.
+
+gzip is always available, zstd (faster for the same ratio) when the
+`zstandard` package is installed.
+"""
+
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+__author__ = ('eruiz070210', 'dgaraud111714')
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+# Default compression level of each encoding.
+DEFAULT_LEVELS = {GZIP: 6, ZSTD: 3}
+# Responses smaller than this size in bytes are not worth compressing.
+DEFAULT_MIN_SIZE = 1024
+
+
+def available_encodings():
+    """Supported encodings, by order of preference.
+    """
+    if zstandard is not None:
+        return [ZSTD, GZIP]
+    return [GZIP]
+
+
+def accept_encoding(stream=False):
+    """Value of the Accept-Encoding header of the client.
+
+    Streamed responses are decoded on the fly by urllib3, which only knows
+    gzip and deflate.
+    """
+    if stream:
+        return 'gzip, deflate'
+    return ', '.join(available_encodings() + ['deflate'])
+
+
+def choose_encoding(accept_encoding_header, encodings=None):
+    """Preferred encoding of `encodings` (the available ones if None)
+    accepted by the Accept-Encoding header, None if no one is.
+    """
+    if not accept_encoding_header:
+        return None
+    accepted = {}
+    for item in accept_encoding_header.split(','):
+        parts = item.strip().split(';')
+        quality = 1.
+        for param in parts[1:]:
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.
+        accepted[parts[0].strip().lower()] = quality
+    best = None
+    for encoding in encodings or available_encodings():
+        quality = accepted.get(encoding, accepted.get('*', 0.))
+        if quality > 0 and (best is None or quality > best[1]):
+            best = (encoding, quality)
+    return best[0] if best is not None else None
+
+
+def _gzip_compressor(level):
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def compress(data, encoding, level=None):
+    if level is None:
+        level = DEFAULT_LEVELS[encoding]
+    if encoding == ZSTD:
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    compressor = _gzip_compressor(level)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks, encoding, level=None):
+    """Compress an iterable of chunks on the fly.
+
+    Each chunk is flushed, so that the client gets the records as soon as
+    they are produced.
+    """
+    if level is None:
+        level = DEFAULT_LEVELS[encoding]
+    if encoding == ZSTD:
+        compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        flush_mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        finish = compressor.flush
+    else:
+        compressor = _gzip_compressor(level)
+        flush_mode = zlib.Z_SYNC_FLUSH
+        finish = lambda: compressor.flush(zlib.Z_FINISH)
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk) + compressor.flush(flush_mode)
+        if data:
+            yield data
+    yield finish()
+
+
+def decompress(data, encoding):
+    if encoding == ZSTD:
+        if zstandard is None:
+            raise ValueError("zstd encoded response, the zstandard package "
+                             "isn't installed")
+        # The frames written by compressobj don't hold the content size.
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
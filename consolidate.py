@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+"""Consolidated containers of the historical data.
+
+The historical data queries return one DataFrame per ticker. With thousands
+of tickers, the per-object overhead adds up and the vectorized computations
+need a concat first. The 'layout' option of the client queries returns
+instead a single structure:
+
+- 'panel': a DataFrame indexed by (date, ticker), sorted, with one column per
+  field;
+- 'cube': a `Cube` of the dates, tickers and fields axes and of the values
+  array of shape (dates, tickers, fields), NaN where there is no data. The
+  fields must be numeric.
+
+>>> get_historical_data(tickers, ['PX_LAST', 'PX_VOLUME'], start, end,
+...                     layout='cube', dtype='float32')
+
+The columns are concatenated once from the decoded frames, which are views on
+the response with the columnar wire format. `dtype` downcasts the float
+columns (e.g. 'float32') and, unless `categorical` is False, the tickers of
+the panel index are categorical.
+"""
+
+from collections import namedtuple, OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+__author__ = ('eruiz070210', 'dgaraud111714')
+
+LAYOUTS = ('frames', 'panel', 'cube')
+
+Layout = namedtuple('Layout', ['kind', 'dtype', 'categorical'])
+Cube = namedtuple('Cube', ['dates', 'tickers', 'fields', 'values'])
+
+
+def pop_layout(kwargs):
+    """Pop the 'layout', 'dtype' and 'categorical' options of the query
+    `kwargs`, return their `Layout` or None for the usual {ticker: DataFrame}.
+    """
+    kind = kwargs.pop('layout', None)
+    dtype = kwargs.pop('dtype', None)
+    categorical = kwargs.pop('categorical', True)
+    if kind not in LAYOUTS + (None,):
+        raise ValueError("Unknown layout '{}', expected one of {}".format(
+            kind, ', '.join(LAYOUTS)))
+    if kind in (None, 'frames'):
+        return None
+    if dtype is not None:
+        dtype = np.dtype(dtype)
+        if dtype.kind != 'f':
+            raise ValueError("dtype must be a float type, not {}".format(dtype))
+    return Layout(kind, dtype, categorical)
+
+
+def _missing(dtype, length):
+    if dtype.kind == 'M':
+        return np.full(length, np.datetime64('NaT'), dtype='M8[ns]')
+    if dtype.kind == 'O':
+        return np.full(length, np.nan, dtype=object)
+    return np.full(length, np.nan)
+
+
+def _concat_field(frames, field, dtype=None):
+    """Values of `field` of the frames end to end, missing values where a
+    frame doesn't have it.
+    """
+    first = next(frame[field].dtype for frame in frames if field in frame.columns)
+    parts = []
+    for frame in frames:
+        if field in frame.columns:
+            values = frame[field].values
+        else:
+            values = _missing(first, len(frame.index))
+        if dtype is not None and values.dtype.kind == 'f':
+            values = values.astype(dtype, copy=False)
+        parts.append(values)
+    values = np.concatenate(parts)
+    if dtype is not None and values.dtype.kind == 'f':
+        # e.g. int columns with missing values
+        values = values.astype(dtype, copy=False)
+    return values
+
+
+def _axes(data):
+    """Sorted tickers with data, their frames, the union of their fields
+    and the codes of the rows on the sorted dates and tickers.
+    """
+    tickers = sorted(ticker for ticker, frame in data.iteritems()
+                     if frame is not None and len(frame.index))
+    frames = [data[ticker] for ticker in tickers]
+    fields = OrderedDict()
+    for frame in frames:
+        for field in frame.columns:
+            fields[field] = None
+    if not frames:
+        empty = np.array([], dtype=int)
+        return tickers, frames, list(fields), pd.DatetimeIndex([]), empty, empty
+    lengths = [len(frame.index) for frame in frames]
+    dates, date_codes = np.unique(
+        np.concatenate([frame.index.values for frame in frames]),
+        return_inverse=True)
+    ticker_codes = np.repeat(np.arange(len(tickers)), lengths)
+    return (tickers, frames, list(fields), pd.DatetimeIndex(dates),
+            date_codes, ticker_codes)
+
+
+def panel(data, dtype=None, categorical=True):
+    """DataFrame of the {ticker: DataFrame} `data` indexed by (date, ticker).
+    """
+    tickers, frames, fields, dates, date_codes, ticker_codes = _axes(data)
+    order = np.lexsort((ticker_codes, date_codes))
+    if categorical:
+        ticker_level = pd.CategoricalIndex(tickers, categories=tickers)
+    else:
+        ticker_level = pd.Index(tickers, dtype=object)
+    index = pd.MultiIndex(levels=[dates, ticker_level],
+                          codes=[date_codes[order], ticker_codes[order]],
+                          names=['date', 'ticker'], verify_integrity=False)
+    columns = OrderedDict((field, _concat_field(frames, field, dtype)[order])
+                          for field in fields)
+    return pd.DataFrame(columns, index=index, columns=fields)
+
+
+def cube(data, dtype=None):
+    """`Cube` of the {ticker: DataFrame} `data`.
+    """
+    tickers, frames, fields, dates, date_codes, ticker_codes = _axes(data)
+    values = np.full((len(dates), len(tickers), len(fields)), np.nan,
+                     dtype=dtype if dtype is not None else np.float64)
+    for i, field in enumerate(fields):
+        column = _concat_field(frames, field, dtype)
+        if column.dtype.kind not in 'fiub':
+            raise ValueError("The field {} isn't numeric".format(field))
+        values[date_codes, ticker_codes, i] = column
+    return Cube(dates.rename('date'), pd.Index(tickers, name='ticker'),
+                pd.Index(fields, name='field'), values)
+
+
+def apply(data, layout):
+    """`data`, a {ticker: DataFrame}, in `layout`.
+    """
+    if layout is None or data is None:
+        return data
+    if layout.kind == 'panel':
+        return panel(data, layout.dtype, layout.categorical)
+    return cube(data, layout.dtype)
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""Incremental updates of the historical data.
+
+A client which already holds the histories of a query only needs their new
+rows. It sends, per ticker, the last date it holds and a digest of its rows
+(`held_state`). The server computes the same digest over its own rows up to
+that date: if they match, only the later rows are sent, otherwise the ticker
+is sent in full as 'replaced' (`diff`). The client joins the answer into its
+frames with `merge`.
+
+The digests are computed on a canonical text form of the frames, with the
+numbers rounded to 8 significant digits, so that they don't depend on the
+wire format (JSON only keeps 10 digits) or on the dtypes (an integer column
+of the JSON decoding is a float column on the server). A whole query is
+identified by the `etag` of its digests, which lets the server answer
+`304 Not Modified` when nothing changed.
+"""
+
+import json
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+
+__author__ = ('eruiz070210', 'dgaraud111714')
+
+NUMBER_FORMAT = '%.8g'
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+def _column_text(values):
+    if values.dtype.kind in 'biuf':
+        return np.char.mod(NUMBER_FORMAT, values.astype(float))
+    return [u'' if pd.isnull(v) else unicode(v) for v in values]
+
+
+def frame_digest(frame):
+    """Digest of the dates, columns and values of a historical DataFrame.
+    """
+    digest = hashlib.md5()
+    index = pd.DatetimeIndex(frame.index)
+    digest.update('\x1e'.join(index.strftime(DATE_FORMAT)))
+    for name in sorted(frame.columns):
+        digest.update('\x1d' + unicode(name).encode('utf-8') + '\x1f')
+        digest.update(u'\x1e'.join(_column_text(frame[name].values))
+                      .encode('utf-8'))
+    return digest.hexdigest()
+
+
+def etag(digests):
+    """Entity tag of a query from the {ticker: digest} of its frames.
+    """
+    return hashlib.md5(json.dumps(sorted(digests.iteritems()))).hexdigest()
+
+
+def held_state(data, start_date, end_date):
+    """{ticker: {'last_date': ..., 'hash': ...}} describing the non-empty
+    frames of `data` over [`start_date`, `end_date`], as sent to the server.
+    """
+    held = {}
+    for ticker, frame in data.iteritems():
+        frame = frame[(frame.index >= pd.Timestamp(start_date))
+                      & (frame.index <= pd.Timestamp(end_date))]
+        if frame.empty:
+            continue
+        held[ticker] = {'last_date': frame.index.max().isoformat(),
+                        'hash': frame_digest(frame)}
+    return held
+
+
+def diff(data, held):
+    """Rows of `data`, the answer of the query on the server, not held by
+    the client.
+
+    Return the {ticker: DataFrame} of the rows after the last date held,
+    only for the tickers with new rows, and the list of the tickers sent in
+    full because the client holds none or different rows.
+    """
+    rows, replaced = {}, []
+    for ticker, frame in data.iteritems():
+        state = held.get(ticker)
+        if state is not None:
+            last_date = pd.Timestamp(state['last_date'])
+            after = frame.index > last_date
+            if frame_digest(frame[~after]) == state['hash']:
+                if after.any():
+                    rows[ticker] = frame[after]
+                continue
+        rows[ticker] = frame
+        replaced.append(ticker)
+    return rows, replaced
+
+
+def merge(data, rows, replaced=()):
+    """Join the answer of `diff` into `data`, {ticker: DataFrame}, in place.
+    Return the tickers whose frame changed.
+
+    The new rows are added to the held frames themselves, so that the other
+    references to them see the update. The frame of a replaced ticker, sent
+    in full, replaces the held one in `data`.
+    """
+    replaced = set(replaced)
+    for ticker, new in rows.iteritems():
+        old = data.get(ticker)
+        if ticker in replaced or old is None:
+            data[ticker] = new
+            continue
+        # Rows held after the end of the query, sent again.
+        old.drop(old.index.intersection(new.index), inplace=True)
+        for column in new.columns:
+            if column not in old.columns:
+                old[column] = np.nan
+        for date, row in new.iterrows():
+            old.loc[date] = row
+        if not old.index.is_monotonic_increasing:
+            old.sort_index(inplace=True)
+    return sorted(rows)
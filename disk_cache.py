@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+
+"""Persistent client-side cache of the historical data.
+
+Each (ticker, field, options) series is stored in `path` as two NumPy files,
+its dates and its values, with a JSON file of metadata: the date range it
+covers and when it was written. The files are memory-mapped when read, so a
+query covered by the cache is answered without a request to the server nor
+any decoding. As in the server cache, only the missing head and tail of a
+series are fetched, then joined into it.
+
+Several processes (e.g. notebooks) can share a cache directory:
+
+  - the metadata are read and written under a lock file,
+  - the data files are never modified: a series update writes a new version
+    of them, so that the series memory-mapped by the other processes stay
+    valid.
+
+The cache is bounded by `max_bytes`, the least recently used series being
+removed first, and the series written more than `max_age` seconds ago are
+fetched again. The size, version and last use of the series are kept in an
+index file, so that the directory is only scanned when the cache is full. A
+process records the series it reads in the index when it next writes it.
+"""
+
+import os
+import json
+import glob
+import time
+import uuid
+import hashlib
+import threading
+import datetime as dt
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+from ezbbg.ws.cache import (missing_ranges, merge_series, options_key,
+                            to_request_date, ONE_DAY)
+
+
+__author__ = ('eruiz070210', 'dgaraud111714')
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+# Series older than this (in seconds) are fetched again, None to keep them.
+DEFAULT_MAX_AGE = 7 * 24 * 3600
+LOCK_FILE = 'cache.lock'
+INDEX_FILE = 'cache.index'
+_LOCK_RETRY_DELAY = 0.05
+
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on the file `path`, shared with the other
+    processes.
+    """
+    with open(path, 'a+') as fobj:
+        if fcntl is not None:
+            fcntl.flock(fobj.fileno(), fcntl.LOCK_EX)
+        else:
+            fobj.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(fobj.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except IOError:
+                    time.sleep(_LOCK_RETRY_DELAY)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fobj.fileno(), fcntl.LOCK_UN)
+            else:
+                fobj.seek(0)
+                msvcrt.locking(fobj.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        # Still memory-mapped on Windows: removed by a later eviction.
+        pass
+
+
+def _replace(source, dest):
+    """Rename `source` to `dest`, overwriting it (os.rename doesn't on
+    Windows).
+    """
+    if os.name == 'nt' and os.path.exists(dest):
+        os.remove(dest)
+    os.rename(source, dest)
+
+
+class DiskCache(object):
+    """Historical series stored in the directory `path`, see the module
+    documentation.
+
+    Parameters
+    ----------
+
+    path: str
+        Directory of the cache, created if needed.
+    max_bytes: int
+        Maximum size of the data files.
+    max_age: float
+        Age in seconds after which a series is fetched again, None to keep the
+        series until they are evicted.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES,
+                 max_age=DEFAULT_MAX_AGE):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._thread_lock = threading.RLock()
+        # Index of the series and its file stamp when read.
+        self._index = None
+        self._index_stamp = None
+        # Last use of the series read since the index was written.
+        self._used = {}
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError:
+                # Created by another process meanwhile.
+                if not os.path.isdir(self.path):
+                    raise
+
+    def __repr__(self):
+        return "<DiskCache {}>".format(self.path)
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            with file_lock(os.path.join(self.path, LOCK_FILE)):
+                yield
+
+    def _name(self, key):
+        return hashlib.md5(json.dumps(key)).hexdigest()
+
+    def _meta_path(self, name):
+        return os.path.join(self.path, name + '.json')
+
+    def _data_paths(self, name, version):
+        prefix = os.path.join(self.path, '{}.{}'.format(name, version))
+        return prefix + '.dates.npy', prefix + '.values.npy'
+
+    def _read_meta(self, name):
+        try:
+            with open(self._meta_path(name)) as fobj:
+                return json.load(fobj)
+        except (IOError, ValueError):
+            return None
+
+    def _metas(self):
+        metas = {}
+        for meta_path in glob.glob(os.path.join(self.path, '*.json')):
+            name = os.path.basename(meta_path)[:-len('.json')]
+            meta = self._read_meta(name)
+            if meta is not None:
+                metas[name] = meta
+        return metas
+
+    def _index_path(self):
+        return os.path.join(self.path, INDEX_FILE)
+
+    def _read_index(self):
+        """Size, version and last use of the series by name. The index file is
+        only read again when another process wrote it, and rebuilt from the
+        metadata files if missing.
+        """
+        try:
+            stat = os.stat(self._index_path())
+            stamp = stat.st_ino, stat.st_mtime, stat.st_size
+        except OSError:
+            stamp = None
+        if self._index is None or stamp != self._index_stamp:
+            index = None
+            if stamp is not None:
+                try:
+                    with open(self._index_path()) as fobj:
+                        index = json.load(fobj)
+                except (IOError, ValueError):
+                    pass
+            if index is None:
+                index = {name: {'bytes': meta['bytes'], 'version': meta['version'],
+                                'used': meta['written']}
+                         for name, meta in self._metas().iteritems()}
+            self._index, self._index_stamp = index, stamp
+        for name, used in self._used.iteritems():
+            if name in self._index:
+                self._index[name]['used'] = max(self._index[name]['used'], used)
+        return self._index
+
+    def _write_index(self, index):
+        tmp_path = self._index_path() + '.tmp'
+        with open(tmp_path, 'w') as fobj:
+            json.dump(index, fobj)
+        _replace(tmp_path, self._index_path())
+        stat = os.stat(self._index_path())
+        self._index = index
+        self._index_stamp = stat.st_ino, stat.st_mtime, stat.st_size
+        self._used.clear()
+
+    def stats(self):
+        with self._locked():
+            index = self._read_index()
+        return {'path': self.path,
+                'series': len(index),
+                'bytes': sum(entry['bytes'] for entry in index.itervalues()),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses}
+
+    def clear(self):
+        with self._locked():
+            for name in self._metas():
+                _remove(self._meta_path(name))
+            for data_path in glob.glob(os.path.join(self.path, '*.npy')):
+                _remove(data_path)
+            self._used.clear()
+            self._write_index({})
+
+    def _covered(self, meta):
+        if meta is None:
+            return None
+        if self.max_age is not None and time.time() - meta['written'] > self.max_age:
+            return None
+        return pd.Timestamp(meta['start']), pd.Timestamp(meta['end'])
+
+    def _load(self, name, meta):
+        """Memory-mapped series of the metadata `meta`.
+        """
+        dates_path, values_path = self._data_paths(name, meta['version'])
+        dates = np.load(dates_path, mmap_mode='r')
+        if meta['numeric']:
+            values = np.load(values_path, mmap_mode='r')
+        else:
+            values = np.load(values_path, allow_pickle=True)
+        index = pd.DatetimeIndex(dates, name='date')
+        return pd.Series(values, index=index, copy=False)
+
+    def get_historical_data(self, fetch, ticker_list, field_list,
+                            start_date, end_date, **kwargs):
+        """Same as `HistoricalDataCache.get_historical_data`: `fetch` is only
+        called for the date ranges not in the cache.
+        """
+        start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+        opts = options_key(kwargs)
+        names = {(ticker, field): self._name([ticker, field, opts])
+                 for ticker in ticker_list for field in field_list}
+        to_fetch = OrderedDict()
+        with self._locked():
+            for ticker in ticker_list:
+                for field in field_list:
+                    covered = self._covered(self._read_meta(names[ticker, field]))
+                    ranges = missing_ranges(covered, start, end)
+                    if ranges:
+                        self.misses += 1
+                    else:
+                        self.hits += 1
+                    for rng in ranges:
+                        tickers, fields = to_fetch.setdefault(rng, (OrderedDict(), OrderedDict()))
+                        tickers[ticker] = None
+                        fields[field] = None
+        for (rstart, rend), (tickers, fields) in to_fetch.iteritems():
+            data = fetch(list(tickers), list(fields),
+                         to_request_date(rstart, start_date),
+                         to_request_date(rend, end_date),
+                         **kwargs)
+            self._store(data or {}, list(tickers), list(fields), names,
+                        rstart, rend, opts)
+        result = self._lookup(ticker_list, field_list, names, start, end)
+        if to_fetch:
+            with self._locked():
+                self._evict()
+        return result
+
+    def _store(self, data, ticker_list, field_list, names, start, end, opts):
+        today = pd.Timestamp(dt.date.today())
+        covered_end = min(end, today - ONE_DAY)
+        with self._locked():
+            index = self._read_index()
+            for ticker in ticker_list:
+                frame = data.get(ticker)
+                for field in field_list:
+                    if frame is not None and field in frame:
+                        new = frame[field].dropna()
+                    else:
+                        new = pd.Series([], index=pd.DatetimeIndex([], name='date'),
+                                        dtype=float)
+                    self._update(index, names[ticker, field], [ticker, field, opts],
+                                 new, start, covered_end)
+            self._write_index(index)
+
+    def _update(self, index, name, key, new, start, end):
+        meta = self._read_meta(name)
+        covered = self._covered(meta)
+        if (covered is None or end < covered[0] - ONE_DAY
+                or start > covered[1] + ONE_DAY):
+            series = new.sort_index()
+        else:
+            series = merge_series(self._load(name, meta), new)
+            start, end = min(covered[0], start), max(covered[1], end)
+        if end < start:
+            # Only today's data was fetched. It's returned but not cached.
+            end = start - ONE_DAY
+        values = series.values
+        numeric = values.dtype.kind in 'biuf'
+        if numeric:
+            values = values.astype(float)
+        else:
+            values = values.astype(object)
+        version = uuid.uuid4().hex
+        dates_path, values_path = self._data_paths(name, version)
+        np.save(dates_path, series.index.values.astype('datetime64[ns]'))
+        np.save(values_path, values)
+        new_meta = {'key': key, 'start': start.isoformat(), 'end': end.isoformat(),
+                    'version': version, 'numeric': numeric, 'rows': len(series),
+                    'bytes': os.path.getsize(dates_path) + os.path.getsize(values_path),
+                    'written': time.time()}
+        tmp_path = self._meta_path(name) + '.tmp'
+        with open(tmp_path, 'w') as fobj:
+            json.dump(new_meta, fobj)
+        _replace(tmp_path, self._meta_path(name))
+        index[name] = {'bytes': new_meta['bytes'], 'version': version,
+                       'used': new_meta['written']}
+        if meta is not None:
+            for old_path in self._data_paths(name, meta['version']):
+                _remove(old_path)
+
+    def _evict(self):
+        """Remove the least recently used series above `max_bytes`, and the
+        data files of no series.
+        """
+        index = self._read_index()
+        total = sum(entry['bytes'] for entry in index.itervalues())
+        if total <= self.max_bytes:
+            return
+        for name, entry in sorted(index.items(), key=lambda item: item[1]['used']):
+            if total <= self.max_bytes:
+                break
+            _remove(self._meta_path(name))
+            for data_path in self._data_paths(name, entry['version']):
+                _remove(data_path)
+            del index[name]
+            total -= entry['bytes']
+        self._write_index(index)
+        # Left by the removals which failed.
+        current = set()
+        for name, entry in index.iteritems():
+            current.update(self._data_paths(name, entry['version']))
+        for data_path in glob.glob(os.path.join(self.path, '*.npy')):
+            if data_path not in current:
+                _remove(data_path)
+
+    def _lookup(self, ticker_list, field_list, names, start, end):
+        result = OrderedDict()
+        with self._locked():
+            for ticker in ticker_list:
+                columns = OrderedDict()
+                for field in field_list:
+                    name = names[ticker, field]
+                    meta = self._read_meta(name)
+                    if meta is None:
+                        continue
+                    series = self._load(name, meta)
+                    columns[field] = series.loc[start:end]
+                    self._used[name] = time.time()
+                # As Bloomberg, no frame for a ticker without data.
+                if any(len(series.index) for series in columns.itervalues()):
+                    frame = pd.DataFrame(columns, columns=list(columns))
+                    frame.index.name = 'date'
+                    result[ticker] = frame
+        return result
@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+
+"""Local catalog of the Bloomberg fields.
+
+The field dictionary barely changes, yet every field search is a Bloomberg
+query taking seconds. `FieldCatalog` keeps the field records (mnemonic ->
+field info, as returned by ezbbg) with an inverted index over their
+mnemonic, description, categories, product type and field type, so that the
+searches are answered locally.
+
+The catalog is persisted to disk and rebuilt in the background from a list
+of seed searches. Until a rebuild has run every seed search, the catalog may
+miss fields and the searches are still sent to Bloomberg, their fields being
+added to it.
+"""
+
+import os
+import re
+import json
+import time
+import bisect
+import logging
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+
+__author__ = ('eruiz070210', 'dgaraud111714')
+
+logger = logging.getLogger(__name__)
+
+# Time in seconds between two rebuilds of the catalog.
+DEFAULT_REFRESH_INTERVAL = 24 * 3600
+# Searches run to build the catalog.
+DEFAULT_SEEDS = tuple('abcdefghijklmnopqrstuvwxyz0123456789')
+
+# Keys of the indexed attributes in the field records, by order of preference.
+ATTRIBUTE_KEYS = OrderedDict([
+    ('description', ('description',)),
+    ('category', ('categoryName', 'category')),
+    ('product_type', ('productType', 'product_type')),
+    ('field_type', ('ftype', 'fieldType', 'field_type')),
+])
+DOCUMENTATION_KEY = 'documentation'
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def tokens(text):
+    """Lower-case words of `text`.
+    """
+    return _TOKEN_RE.findall(text.lower())
+
+
+def attribute(record, name):
+    """Values of the attribute `name` of a field record, as a list.
+    """
+    for key in ATTRIBUTE_KEYS[name]:
+        value = record.get(key)
+        if value is not None:
+            break
+    else:
+        return []
+    if isinstance(value, basestring):
+        return [value]
+    return [v for v in value if isinstance(v, basestring)]
+
+
+def field_records(result):
+    """{mnemonic: record} of a result of ezbbg's field queries.
+    """
+    if isinstance(result, pd.DataFrame):
+        result = result.to_dict('index')
+    if isinstance(result, dict):
+        return {mnemonic: record for mnemonic, record in result.iteritems()
+                if isinstance(record, dict)}
+    if isinstance(result, list):
+        return {record['mnemonic']: record for record in result
+                if isinstance(record, dict) and 'mnemonic' in record}
+    return {}
+
+
+def _matches(record, name, values):
+    """Whether an attribute of `record` is one of `values`, or one of their
+    sub-categories.
+    """
+    wanted = set(value.lower() for value in values)
+    for value in attribute(record, name):
+        value = value.lower()
+        if value in wanted or any(value.startswith(w + '/') for w in wanted):
+            return True
+    return False
+
+
+def _record_tokens(mnemonic, record):
+    words = set(tokens(mnemonic))
+    words.add(mnemonic.lower())
+    for name in ATTRIBUTE_KEYS:
+        for value in attribute(record, name):
+            words.update(tokens(value))
+    return words
+
+
+class FieldCatalog(object):
+    """Field records indexed for the field searches.
+
+    `search_fields`, `search_fields_by_category` and `get_fields_info` are
+    the Bloomberg queries, with the signatures of the ezbbg functions. The
+    methods of the same names answer from the catalog when it can, and fall
+    back on these queries otherwise.
+
+    The searches are answered locally once the catalog is complete, i.e. a
+    refresh ran all the seed searches, possibly in another process (loaded
+    from `path`). A search word matches the words starting with it, as for an
+    autocompletion. The local results have the type of the Bloomberg ones: a
+    DataFrame indexed by mnemonic if Bloomberg returns DataFrames.
+
+    The refresh waits while `is_blocked`, i.e. the Bloomberg session can't be
+    used.
+    """
+
+    def __init__(self, search_fields, search_fields_by_category,
+                 get_fields_info, path=None, seeds=DEFAULT_SEEDS,
+                 refresh_interval=DEFAULT_REFRESH_INTERVAL, is_blocked=None):
+        self._search_fields = search_fields
+        self._search_fields_by_category = search_fields_by_category
+        self._get_fields_info = get_fields_info
+        self.path = path
+        self.seeds = seeds
+        self.refresh_interval = refresh_interval
+        self.is_blocked = is_blocked or (lambda: False)
+        self.records = {}
+        # Time of the last complete build, None until built.
+        self.built = None
+        # Columns of the DataFrames returned by Bloomberg, None if it
+        # returns dicts.
+        self.columns = None
+        self.local_hits = 0
+        self.bloomberg_queries = 0
+        self._lock = threading.RLock()
+        # token -> mnemonics
+        self._index = {}
+        self._sorted_tokens = []
+        self._tokens_of = {}
+        self._thread = None
+        if path and os.path.exists(path):
+            try:
+                self.load()
+            except (IOError, ValueError):
+                logger.exception("Can't load the field catalog %s", path)
+
+    def stats(self):
+        with self._lock:
+            built = None
+            if self.built is not None:
+                built = time.strftime("%Y-%m-%dT%H:%M:%S",
+                                      time.localtime(self.built))
+            return {'fields': len(self.records),
+                    'built': built,
+                    'complete': self.complete,
+                    'local_hits': self.local_hits,
+                    'bloomberg_queries': self.bloomberg_queries}
+
+    @property
+    def complete(self):
+        return self.built is not None
+
+    # region Index
+    def _reset(self):
+        self.records = {}
+        self._index = {}
+        self._sorted_tokens = []
+        self._tokens_of = {}
+
+    def add(self, records):
+        """Add or update field records {mnemonic: record}.
+        """
+        with self._lock:
+            new_tokens = False
+            for mnemonic, record in records.iteritems():
+                old = self.records.get(mnemonic)
+                if old is not None:
+                    record = dict(old, **record)
+                self.records[mnemonic] = record
+                words = _record_tokens(mnemonic, record)
+                for word in self._tokens_of.get(mnemonic, set()) - words:
+                    self._index[word].discard(mnemonic)
+                for word in words:
+                    postings = self._index.get(word)
+                    if postings is None:
+                        postings = self._index[word] = set()
+                        new_tokens = True
+                    postings.add(mnemonic)
+                self._tokens_of[mnemonic] = words
+            if new_tokens:
+                self._sorted_tokens = sorted(self._index)
+
+    def _lookup(self, search_string):
+        """Mnemonics matching every word of `search_string`.
+        """
+        found = None
+        for word in tokens(search_string):
+            matches = set()
+            i = bisect.bisect_left(self._sorted_tokens, word)
+            while (i < len(self._sorted_tokens)
+                   and self._sorted_tokens[i].startswith(word)):
+                matches.update(self._index[self._sorted_tokens[i]])
+                i += 1
+            found = matches if found is None else found & matches
+            if not found:
+                break
+        if found is None:
+            return set(self.records)
+        return found
+
+    def _output(self, record, return_field_documentation):
+        if return_field_documentation or DOCUMENTATION_KEY not in record:
+            return record
+        return {k: v for k, v in record.iteritems() if k != DOCUMENTATION_KEY}
+
+    def search(self, search_string, return_field_documentation=True,
+               include_categories=None, include_product_type=None,
+               include_field_type=None, exclude_categories=None,
+               exclude_product_type=None, exclude_field_type=None):
+        """Records matching the search in the catalog, {mnemonic: record}.
+
+        The mnemonics starting with the search string come first.
+        """
+        filters = [('category', include_categories, exclude_categories),
+                   ('product_type', include_product_type, exclude_product_type),
+                   ('field_type', include_field_type, exclude_field_type)]
+        prefix = search_string.strip().lower()
+        with self._lock:
+            found = []
+            for mnemonic in self._lookup(search_string):
+                record = self.records[mnemonic]
+                if all((not include or _matches(record, name, include))
+                       and not (exclude and _matches(record, name, exclude))
+                       for name, include, exclude in filters):
+                    found.append(mnemonic)
+            found.sort(key=lambda m: (not m.lower().startswith(prefix), m))
+            return OrderedDict((mnemonic, self._output(self.records[mnemonic],
+                                                       return_field_documentation))
+                               for mnemonic in found)
+    # endregion
+
+    def _result(self, found):
+        """`found` {mnemonic: record} as the results of Bloomberg.
+        """
+        if self.columns is None:
+            return found
+        frame = pd.DataFrame.from_dict(found, orient='index')
+        columns = list(self.columns) + [c for c in frame.columns
+                                        if c not in self.columns]
+        return frame.reindex(index=list(found), columns=columns)
+    # endregion
+
+    # region Queries
+    def _fetch(self, query, *args):
+        with self._lock:
+            self.bloomberg_queries += 1
+        result = query(*args)
+        if isinstance(result, pd.DataFrame):
+            self.columns = list(result.columns)
+        return result
+
+    def search_fields(self, search_string, return_field_documentation=True,
+                      include_categories=None, include_product_type=None,
+                      include_field_type=None, exclude_categories=None,
+                      exclude_product_type=None, exclude_field_type=None):
+        args = (search_string, return_field_documentation,
+                include_categories, include_product_type, include_field_type,
+                exclude_categories, exclude_product_type, exclude_field_type)
+        if self.complete:
+            found = self.search(*args)
+            with self._lock:
+                self.local_hits += 1
+            return self._result(found)
+        result = self._fetch(self._search_fields, *args)
+        self.add(field_records(result))
+        return result
+
+    def search_fields_by_category(self, search_string,
+                                  return_field_documentation=True,
+                                  exclude_categories=None,
+                                  exclude_product_type=None,
+                                  exclude_field_type=None):
+        """Matching records by category, {category: {mnemonic: record}}.
+        """
+        if self.complete:
+            found = self.search(search_string, return_field_documentation,
+                                exclude_categories=exclude_categories,
+                                exclude_product_type=exclude_product_type,
+                                exclude_field_type=exclude_field_type)
+            by_category = OrderedDict()
+            for mnemonic, record in found.iteritems():
+                for category in attribute(record, 'category'):
+                    by_category.setdefault(category, OrderedDict())[mnemonic] = record
+            with self._lock:
+                self.local_hits += 1
+            return OrderedDict((category, self._result(records))
+                               for category, records in by_category.iteritems())
+        result = self._fetch(self._search_fields_by_category,
+                             search_string, return_field_documentation,
+                             exclude_categories, exclude_product_type,
+                             exclude_field_type)
+        if isinstance(result, dict):
+            for records in result.itervalues():
+                if isinstance(records, pd.DataFrame):
+                    self.columns = list(records.columns)
+                self.add(field_records(records))
+        return result
+
+    def get_fields_info(self, field_list, return_field_documentation=True):
+        with self._lock:
+            missing = [field for field in field_list
+                       if field not in self.records
+                       or (return_field_documentation
+                           and DOCUMENTATION_KEY not in self.records[field])]
+        fetched = {}
+        if missing:
+            fetched = self._fetch(self._get_fields_info, missing,
+                                  return_field_documentation) or {}
+            self.add(field_records(fetched))
+        else:
+            with self._lock:
+                self.local_hits += 1
+        with self._lock:
+            info = OrderedDict()
+            for field in field_list:
+                if field in self.records:
+                    info[field] = self._output(self.records[field],
+                                               return_field_documentation)
+                elif field in fetched:
+                    info[field] = fetched[field]
+            return info
+    # endregion
+
+    # region Persistence and refresh
+    def load(self):
+        with open(self.path) as f:
+            data = json.load(f)
+        with self._lock:
+            self._reset()
+            self.add(data['records'])
+            self.columns = data.get('columns')
+            self.built = data['built']
+
+    def save(self):
+        with self._lock:
+            data = json.dumps({'built': self.built, 'columns': self.columns,
+                               'records': self.records},
+                              default=str)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(tmp_path, self.path)
+
+    def refresh(self):
+        """Rebuild the catalog from the seed searches. The fields which are no
+        longer returned are dropped. Raise `RuntimeError` if the Bloomberg
+        session is blocked in the meantime, leaving the catalog as it was.
+        """
+        records = {}
+        for seed in self.seeds:
+            if self.is_blocked():
+                raise RuntimeError("Bloomberg session locked")
+            result = self._fetch(self._search_fields, seed, True,
+                                 None, None, None, None, None, None)
+            records.update(field_records(result))
+        with self._lock:
+            self._reset()
+            self.add(records)
+            self.built = time.time()
+        logger.info("Field catalog refreshed: %s fields", len(self.records))
+        if self.path:
+            self.save()
+
+    def _refresh_loop(self):
+        while True:
+            built = self.built
+            if built is None or time.time() - built >= self.refresh_interval:
+                if self.is_blocked():
+                    time.sleep(min(self.refresh_interval, 60))
+                    continue
+                try:
+                    self.refresh()
+                except Exception:
+                    logger.exception("Field catalog refresh failed")
+                    time.sleep(min(self.refresh_interval, 600))
+                    continue
+            time.sleep(max(1, self.built + self.refresh_interval - time.time()))
+
+    def start(self):
+        """Refresh the catalog in a background thread.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._refresh_loop,
+                                            name="ezbbg-field-catalog")
+            self._thread.daemon = True
+            self._thread.start()
+    # endregion
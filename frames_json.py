@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+"""Column-oriented JSON encoding of the DataFrames.
+
+`DataFrame.to_json` formats every date of the index as a string and the
+frame is then embedded as a string in the JSON response, parsed a second time
+by `pd.read_json` on the client. In the 'application/vnd.ezbbg.frames+json'
+format, a DataFrame is a plain JSON object:
+
+    {"__frame__": {"index": {"kind": "datetime", "name": "date",
+                             "values": [1577836800000, ...]},
+                   "columns": ["PX_LAST", ...],
+                   "kinds": ["float", ...],
+                   "data": [[12.5, null, ...], ...]}}
+
+with one array per column and the dates as milliseconds since the epoch.
+The columns are written straight from their NumPy arrays by the C JSON
+encoder of pandas, by `dumps`, and `object_hook`, given to `json.loads`,
+rebuilds the float columns of a frame as a single block.
+"""
+
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+from pandas.io.json import dumps as ujson_dumps
+
+
+__author__ = ('eruiz070210', 'dgaraud111714')
+
+FRAMES_JSON_MIMETYPE = 'application/vnd.ezbbg.frames+json'
+FRAME_KEY = '__frame__'
+_NS_PER_MS = 10 ** 6
+# Decimals of the floats, the maximum of the encoder.
+DOUBLE_PRECISION = 15
+
+
+def _epoch_ms(values):
+    """datetime64[ns] array as a list of milliseconds, None for NaT.
+    """
+    ms = values.view(np.int64) // _NS_PER_MS
+    mask = np.isnat(values)
+    if mask.any():
+        ms = ms.astype(object)
+        ms[mask] = None
+    return ms.tolist()
+
+
+def _column(values):
+    """Kind and JSON values of a column. The numeric arrays are encoded as
+    they are, NaN as null.
+    """
+    kind = values.dtype.kind
+    if kind == 'f':
+        return 'float', values
+    if kind in 'iu':
+        return 'int', values
+    if kind == 'M':
+        return 'datetime', _epoch_ms(values)
+    return 'values', [None if missing else _walk(x)
+                      for x, missing in zip(values, pd.isnull(values))]
+
+
+def encode_frame(frame):
+    """JSON object of `frame`, see the module documentation.
+    """
+    index = frame.index
+    if isinstance(index, pd.DatetimeIndex) and index.tz is None and not index.hasnans:
+        index = {'kind': 'datetime', 'name': index.name,
+                 'values': index.asi8 // _NS_PER_MS}
+    else:
+        index = {'kind': 'values', 'name': index.name,
+                 'values': [_walk(x) for x in index]}
+    kinds, data = [], []
+    for i in range(frame.shape[1]):
+        kind, values = _column(frame.iloc[:, i].values)
+        kinds.append(kind)
+        data.append(values)
+    return {FRAME_KEY: {'index': index,
+                        'columns': [_walk(c) for c in frame.columns],
+                        'kinds': kinds,
+                        'data': data}}
+
+
+def _walk(obj):
+    """Replace the DataFrames by their JSON object and the dates by their
+    ISO format, as `server.JSONEncoder`.
+    """
+    if isinstance(obj, pd.DataFrame):
+        return encode_frame(obj)
+    if isinstance(obj, dict):
+        return {k: _walk(v) for k, v in obj.iteritems()}
+    if isinstance(obj, (list, tuple)):
+        return [_walk(x) for x in obj]
+    if isinstance(obj, np.datetime64):
+        obj = pd.Timestamp(obj)
+    if obj is pd.NaT:
+        return None
+    if isinstance(obj, (dt.date, dt.datetime)):
+        return obj.isoformat()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, pd.Series):
+        return _walk(obj.to_dict())
+    return obj
+
+
+def dumps(data):
+    """JSON text of `data`, i.e. nested dicts and lists of DataFrames,
+    scalars and dates.
+    """
+    return ujson_dumps(_walk(data), double_precision=DOUBLE_PRECISION)
+
+
+def decode_frame(desc):
+    """DataFrame of the JSON object `desc`, i.e. the value of '__frame__'.
+    """
+    index_desc = desc['index']
+    if index_desc['kind'] == 'datetime':
+        index = pd.DatetimeIndex(np.array(index_desc['values'], dtype=np.int64)
+                                 * _NS_PER_MS)
+    else:
+        index = pd.Index(index_desc['values'])
+    index.name = index_desc['name']
+    columns, kinds, data = desc['columns'], desc['kinds'], desc['data']
+    floats = [i for i, kind in enumerate(kinds) if kind == 'float']
+    if floats:
+        block = np.array([data[i] for i in floats], dtype=float)
+        frame = pd.DataFrame(block.reshape(len(floats), len(index)).T,
+                             index=index, columns=[columns[i] for i in floats],
+                             copy=False)
+    else:
+        frame = pd.DataFrame(index=index)
+    for i, kind in enumerate(kinds):
+        if kind == 'datetime':
+            values = np.array(data[i], dtype=float)
+            mask = np.isnan(values)
+            values[mask] = 0
+            values = (values.astype(np.int64) * _NS_PER_MS).view('M8[ns]')
+            values[mask] = np.datetime64('NaT')
+            frame[columns[i]] = values
+        elif kind == 'int':
+            frame[columns[i]] = np.array(data[i], dtype=np.int64)
+        elif kind != 'float':
+            frame[columns[i]] = data[i]
+    if len(floats) != len(columns):
+        frame = frame[columns]
+    return frame
+
+
+def object_hook(obj):
+    """`json.loads` hook decoding the DataFrames.
+    """
+    if FRAME_KEY in obj:
+        return decode_frame(obj[FRAME_KEY])
+    return obj
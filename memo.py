@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+"""In-memory memoization of the client queries.
+
+Loops which price many instruments often send the same reference data or
+field information queries again and again. `Memoizer` keeps the answers per
+(ticker, field) for the reference data and per field for the field
+information, so that a query only sends the cells it doesn't hold, even when
+its ticker list merely overlaps the previous ones:
+
+>>> client = EzbbgClient(host, memoize=True)
+>>> client.get_reference_data(['SX5E Index', 'SPX Index'], ['PX_LAST'])
+>>> client.get_reference_data(['SX5E Index'], ['PX_LAST'])  # no request
+
+The cells expire after the time-to-live of their endpoint and the least
+recently used ones are evicted beyond `max_bytes`, as estimated by
+`sys.getsizeof`.
+"""
+
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from ezbbg.ws.cache import options_key
+
+
+__author__ = ('eruiz070210', 'dgaraud111714')
+
+# Time-to-live in seconds of the cells of each endpoint.
+DEFAULT_TTLS = {'reference_data': 5 * 60,
+                'fields_info': 24 * 3600}
+DEFAULT_MAX_BYTES = 100 * 1024 ** 2
+# Cell of a (ticker, field) the server doesn't return, e.g. an unknown field.
+_ABSENT = object()
+_MISS = object()
+
+
+def size_of(value):
+    """Approximate memory used by `value`, in bytes.
+    """
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(size_of(k) + size_of(v) for k, v in value.iteritems())
+    elif isinstance(value, (list, tuple)):
+        size += sum(size_of(x) for x in value)
+    return size
+
+
+def _copy(value):
+    # The bulk data are DataFrames which the caller may modify.
+    if isinstance(value, pd.DataFrame):
+        return value.copy()
+    return value
+
+
+class _Counter(object):
+    __slots__ = ('hits', 'misses')
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+
+class Memoizer(object):
+    """TTL/LRU cache of the reference data and field information, see the
+    module documentation.
+
+    Parameters
+    ----------
+
+    ttls: dict
+        Time-to-live in seconds per endpoint, overriding `DEFAULT_TTLS`.
+    max_bytes: int
+        Memory budget of the cells.
+    """
+
+    def __init__(self, ttls=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.max_bytes = max_bytes
+        self.counters = {endpoint: _Counter() for endpoint in self.ttls}
+        self._cells = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cells)
+
+    def clear(self):
+        with self._lock:
+            self._cells.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            stats = {'cells': len(self._cells),
+                     'bytes': self._bytes,
+                     'max_bytes': self.max_bytes}
+            for endpoint, counter in self.counters.iteritems():
+                stats[endpoint] = {'hits': counter.hits,
+                                   'misses': counter.misses,
+                                   'ttl': self.ttls[endpoint]}
+            return stats
+
+    def _get(self, key, now):
+        """Value of the cell `key`, `_MISS` if missing or expired.
+        """
+        cell = self._cells.pop(key, None)
+        if cell is None:
+            return _MISS
+        expiry, _, value = cell
+        if expiry < now:
+            self._bytes -= cell[1]
+            return _MISS
+        # Most recently used at the end.
+        self._cells[key] = cell
+        return value
+
+    def _set(self, key, value, now, ttl):
+        old = self._cells.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        size = size_of(value)
+        self._cells[key] = (now + ttl, size, value)
+        self._bytes += size
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._cells:
+            _, cell = self._cells.popitem(last=False)
+            self._bytes -= cell[1]
+
+    def get_reference_data(self, fetch, ticker_list, field_list, **kwargs):
+        """`fetch(ticker_list, field_list, **kwargs)`, i.e. the reference data
+        query, only called for the tickers with missing fields.
+        """
+        opts = options_key(kwargs)
+        now = time.time()
+        counter = self.counters['reference_data']
+        result = OrderedDict()
+        # Missing fields per ticker
+        missing = OrderedDict()
+        with self._lock:
+            for ticker in ticker_list:
+                values = {}
+                for field in field_list:
+                    value = self._get(('reference_data', opts, ticker, field), now)
+                    if value is _MISS:
+                        missing.setdefault(ticker, []).append(field)
+                    else:
+                        values[field] = value
+                result[ticker] = values
+            counter.misses += len(missing)
+            counter.hits += len(ticker_list) - len(missing)
+        if missing:
+            fields = OrderedDict((field, None) for fields in missing.itervalues()
+                                 for field in fields)
+            data = fetch(list(missing), list(fields), **kwargs) or {}
+            ttl = self.ttls['reference_data']
+            with self._lock:
+                for ticker, fields in missing.iteritems():
+                    values = data.get(ticker) or {}
+                    for field in fields:
+                        value = values.get(field, _ABSENT)
+                        self._set(('reference_data', opts, ticker, field),
+                                  value, now, ttl)
+                        result[ticker][field] = value
+                self._evict()
+        data = OrderedDict()
+        for ticker, values in result.iteritems():
+            values = {field: _copy(value) for field, value in values.iteritems()
+                      if value is not _ABSENT}
+            if values:
+                data[ticker] = values
+        return data
+
+    def get_fields_info(self, fetch, field_list, return_field_documentation=True,
+                        **kwargs):
+        """`fetch(field_list, return_field_documentation, **kwargs)`, i.e. the
+        field information query, only called for the missing fields.
+        """
+        opts = options_key(dict(kwargs, documentation=return_field_documentation))
+        now = time.time()
+        counter = self.counters['fields_info']
+        result = OrderedDict()
+        missing = []
+        with self._lock:
+            for field in field_list:
+                value = self._get(('fields_info', opts, field), now)
+                if value is _MISS:
+                    missing.append(field)
+                else:
+                    result[field] = value
+            counter.misses += len(missing)
+            counter.hits += len(field_list) - len(missing)
+        if missing:
+            data = fetch(missing, return_field_documentation, **kwargs) or {}
+            ttl = self.ttls['fields_info']
+            with self._lock:
+                for field in missing:
+                    value = data.get(field, _ABSENT)
+                    self._set(('fields_info', opts, field), value, now, ttl)
+                    result[field] = value
+                self._evict()
+        return OrderedDict((field, result[field]) for field in field_list
+                           if result[field] is not _ABSENT)
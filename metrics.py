@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+
+"""Performance metrics of the requests.
+
+`MetricsMiddleware` wraps the WSGI application and records, for each route,
+the number of requests and errors, the requests in flight, the latency and
+the payload sizes. Within a request, the time spent in each phase is
+measured with `phase` (or the `timed` decorator):
+
+  - parse: decoding of the JSON body,
+  - lock_check: check of the Bloomberg session,
+  - bloomberg: data queries, cache and coalescing included,
+  - serialize: encoding of the response,
+  - compress: compression of the response,
+  - write: sending of the response to the client.
+
+The phases are attributed to the request handled by the current thread, the
+queries run on other threads (e.g. by '/batch') are counted in the phase of
+the request which waits for them.
+"""
+
+import time
+import bisect
+import threading
+from functools import wraps
+from contextlib import contextmanager
+
+
+__author__ = ('eruiz070210', 'dgaraud111714')
+
+# Upper bounds of the histogram buckets.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = tuple(256 * 4 ** i for i in range(11))
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+UNMATCHED_ROUTE = '<unmatched>'
+
+_local = threading.local()
+
+
+class Histogram(object):
+    """Counts of the observed values per bucket.
+    """
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.
+        self.max = 0.
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bound of the bucket of the quantile `q`.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulated = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulated += count
+            if cumulated >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {'count': self.count,
+                'sum': self.sum,
+                'mean': self.sum / self.count if self.count else None,
+                'p50': self.quantile(0.5),
+                'p99': self.quantile(0.99),
+                'max': self.max,
+                'buckets': [[bound, count] for bound, count
+                            in zip(self.bounds + ('+Inf',), self.counts)]}
+
+
+class RouteMetrics(object):
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.phases = {}
+        self.request_bytes = Histogram(SIZE_BUCKETS)
+        self.response_bytes = Histogram(SIZE_BUCKETS)
+        self.tickers = Histogram(COUNT_BUCKETS)
+        self.fields = Histogram(COUNT_BUCKETS)
+
+    def snapshot(self):
+        return {'requests': self.requests,
+                'errors': self.errors,
+                'in_flight': self.in_flight,
+                'latency': self.latency.snapshot(),
+                'phases': {name: histogram.snapshot()
+                           for name, histogram in self.phases.iteritems()},
+                'request_bytes': self.request_bytes.snapshot(),
+                'response_bytes': self.response_bytes.snapshot(),
+                'tickers': self.tickers.snapshot(),
+                'fields': self.fields.snapshot()}
+
+
+class Recorder(object):
+    """Measures of a request in progress.
+    """
+
+    def __init__(self, route, request_bytes):
+        self.route = route
+        self.request_bytes = request_bytes
+        self.start = time.time()
+        self.phases = {}
+        self.tickers = None
+        self.fields = None
+        self._active = set()
+
+    def phase_time(self):
+        return sum(self.phases.itervalues())
+
+
+class Metrics(object):
+    """Metrics of the requests, per route.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.in_flight = 0
+        self.routes = {}
+        self._lock = threading.Lock()
+
+    def _route(self, route):
+        metrics = self.routes.get(route)
+        if metrics is None:
+            metrics = self.routes[route] = RouteMetrics()
+        return metrics
+
+    def begin(self, route, request_bytes=0):
+        with self._lock:
+            self.in_flight += 1
+            self._route(route).in_flight += 1
+        return Recorder(route, request_bytes)
+
+    def end(self, recorder, status, response_bytes):
+        latency = time.time() - recorder.start
+        with self._lock:
+            self.in_flight -= 1
+            self._route(recorder.route).in_flight -= 1
+            route = recorder.route if status != 404 else UNMATCHED_ROUTE
+            metrics = self._route(route)
+            metrics.requests += 1
+            if status >= 400:
+                metrics.errors += 1
+            metrics.latency.observe(latency)
+            for name, elapsed in recorder.phases.iteritems():
+                histogram = metrics.phases.get(name)
+                if histogram is None:
+                    histogram = metrics.phases[name] = Histogram(LATENCY_BUCKETS)
+                histogram.observe(elapsed)
+            metrics.request_bytes.observe(recorder.request_bytes)
+            metrics.response_bytes.observe(response_bytes)
+            if recorder.tickers is not None:
+                metrics.tickers.observe(recorder.tickers)
+            if recorder.fields is not None:
+                metrics.fields.observe(recorder.fields)
+            # Don't keep the paths which aren't routes.
+            unmatched = self.routes[recorder.route]
+            if not unmatched.requests and not unmatched.in_flight:
+                del self.routes[recorder.route]
+
+    def snapshot(self):
+        with self._lock:
+            return {'uptime': time.time() - self.started,
+                    'in_flight': self.in_flight,
+                    'routes': {route: metrics.snapshot()
+                               for route, metrics in self.routes.iteritems()}}
+
+
+def _current():
+    return getattr(_local, 'recorder', None)
+
+
+@contextmanager
+def phase(name):
+    """Add the time spent in the block to the phase `name` of the current
+    request. Nested blocks of the same phase are counted once.
+    """
+    recorder = _current()
+    if recorder is None or name in recorder._active:
+        yield
+        return
+    recorder._active.add(name)
+    start = time.time()
+    try:
+        yield
+    finally:
+        recorder._active.discard(name)
+        recorder.phases[name] = recorder.phases.get(name, 0.) + time.time() - start
+
+
+def timed(name):
+    """Decorator counting the calls in the phase `name`.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_query(tickers=None, fields=None):
+    """Record the number of tickers and fields of the current request.
+    """
+    recorder = _current()
+    if recorder is None:
+        return
+    if tickers is not None:
+        recorder.tickers = len(tickers)
+    if fields is not None:
+        recorder.fields = len(fields)
+
+
+class _MeteredBody(object):
+    """Response body which measures its writing and ends the request's
+    recording when closed.
+    """
+
+    def __init__(self, body, metrics, recorder, status):
+        self.body = body
+        self.metrics = metrics
+        self.recorder = recorder
+        self.status = status
+        self.size = 0
+
+    def __iter__(self):
+        _local.recorder = self.recorder
+        start = time.time()
+        inner = self.recorder.phase_time()
+        try:
+            for chunk in self.body:
+                self.size += len(chunk)
+                yield chunk
+        finally:
+            elapsed = time.time() - start - (self.recorder.phase_time() - inner)
+            self.recorder.phases['write'] = (self.recorder.phases.get('write', 0.)
+                                             + elapsed)
+            _local.recorder = None
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            _local.recorder = None
+            self.metrics.end(self.recorder, self.status[0] if self.status else 500,
+                             self.size)
+
+
+class MetricsMiddleware(object):
+    """WSGI middleware recording the requests of `app` in `metrics`.
+    """
+
+    def __init__(self, app, metrics):
+        self.app = app
+        self.metrics = metrics
+
+    def __call__(self, environ, start_response):
+        recorder = self.metrics.begin(environ.get('PATH_INFO', ''),
+                                      int(environ.get('CONTENT_LENGTH') or 0))
+        status = []
+
+        def _start_response(status_line, headers, exc_info=None):
+            status[:] = [int(status_line.split(None, 1)[0])]
+            return start_response(status_line, headers, exc_info)
+        _local.recorder = recorder
+        try:
+            body = self.app(environ, _start_response)
+        except Exception:
+            _local.recorder = None
+            self.metrics.end(recorder, 500, 0)
+            raise
+        _local.recorder = None
+        return _MeteredBody(body, self.metrics, recorder, status)
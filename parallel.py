@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+"""Concurrent fan-out of client queries.
+
+The queries of an `EzbbgClient` are run on a thread pool, so that many
+independent queries, possibly to several servers, are in flight at the same
+time instead of waiting for each other:
+
+>>> aclient = AsyncClient(max_in_flight=8)
+>>> pending = [aclient.get_historical_data([t], fields, start, end) for t in tickers]
+>>> data = [p.get() for p in pending]
+
+or, for one large universe split in chunks of tickers:
+
+>>> data = gather_historical(tickers, fields, start, end, chunk_size=50)
+
+or split in chunks of tickers and date windows sized by their number of data
+points, the failed chunks being retried:
+
+>>> data = planned_historical(tickers, fields, start, end, max_cells=200000)
+
+The request building and the response decoding are those of the
+`EzbbgClient`, the calls are just run in the background. The service is
+Python 2, so the results are `multiprocessing.pool.AsyncResult` rather than
+asyncio coroutines.
+"""
+
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+import requests
+
+from ezbbg.ws import client as ws_client
+from ezbbg.ws import planning
+from ezbbg.ws import consolidate
+
+
+__author__ = ('eruiz070210', 'dgaraud111714')
+
+# Default number of queries in flight. Keep it lower or equal to the
+# connection pool size of the client (10 by default).
+DEFAULT_MAX_IN_FLIGHT = 8
+DEFAULT_CHUNK_SIZE = 50
+
+
+def is_retryable(exc):
+    """Whether a failed query may succeed if sent again, i.e. unless the
+    server rejected it.
+    """
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        return exc.response.status_code >= 500
+    return isinstance(exc, requests.RequestException)
+
+
+def _async_method(name):
+    def method(self, *args, **kwargs):
+        return self.submit(name, *args, **kwargs)
+    method.__name__ = name
+    method.__doc__ = getattr(ws_client.EzbbgClient, name).__doc__
+    return method
+
+
+class AsyncClient(object):
+    """Run the queries of `client` (the default client if None) on
+    `max_in_flight` threads.
+
+    Each query method has the signature of the `EzbbgClient` one and returns
+    an `AsyncResult` whose `get()` returns the data or raises the error.
+    """
+
+    def __init__(self, client=None, max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        self.client = client or ws_client.default_client()
+        self.max_in_flight = max_in_flight
+        self._pool = ThreadPool(max_in_flight)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def submit(self, name, *args, **kwargs):
+        """Run the method `name` of the client in the background.
+        """
+        return self._pool.apply_async(getattr(self.client, name), args, kwargs)
+
+    get_reference_data = _async_method('get_reference_data')
+    get_historical_data = _async_method('get_historical_data')
+    get_fields_info = _async_method('get_fields_info')
+    search_fields = _async_method('search_fields')
+    search_fields_by_category = _async_method('search_fields_by_category')
+    get_and_chain_historical_data = _async_method('get_and_chain_historical_data')
+
+    def gather(self, name, ticker_list, *args, **kwargs):
+        """Split `ticker_list` in chunks of `chunk_size` tickers, run the
+        query `name` for each chunk concurrently and merge the results,
+        i.e. dicts {ticker: data}, in the order of `ticker_list`.
+        """
+        chunk_size = kwargs.pop('chunk_size', DEFAULT_CHUNK_SIZE)
+        ticker_list = list(ticker_list)
+        pending = [self.submit(name, ticker_list[i:i + chunk_size], *args, **kwargs)
+                   for i in range(0, len(ticker_list), chunk_size)]
+        merged = {}
+        for result in pending:
+            merged.update(result.get() or {})
+        return OrderedDict((ticker, merged[ticker]) for ticker in ticker_list
+                           if ticker in merged)
+
+    def gather_historical(self, ticker_list, field_list, start_date, end_date,
+                          chunk_size=DEFAULT_CHUNK_SIZE, **kwargs):
+        # The frames of the chunks are consolidated once merged.
+        layout = consolidate.pop_layout(kwargs)
+        data = self.gather('get_historical_data', ticker_list, field_list,
+                           start_date, end_date, chunk_size=chunk_size, **kwargs)
+        return consolidate.apply(data, layout)
+
+    def planned_historical(self, ticker_list, field_list, start_date, end_date,
+                           max_cells=planning.DEFAULT_MAX_CELLS,
+                           max_tickers=planning.DEFAULT_MAX_TICKERS,
+                           retries=planning.DEFAULT_RETRIES, **kwargs):
+        """Historical data of `ticker_list`, queried by chunks of at most
+        `max_cells` data points (see `planning.plan`), a failed chunk being
+        sent again up to `retries` times.
+
+        The chunks run on their own `max_in_flight` threads: waiting for them
+        on the pool of the client would deadlock when called from one of its
+        threads.
+        """
+        layout = consolidate.pop_layout(kwargs)
+        data = planning.run(self.client.get_historical_data, ticker_list,
+                            field_list, start_date, end_date, max_cells,
+                            max_tickers, workers=self.max_in_flight,
+                            retries=retries, should_retry=is_retryable,
+                            **kwargs)
+        return consolidate.apply(data, layout)
+
+    def gather_reference(self, ticker_list, field_list,
+                         chunk_size=DEFAULT_CHUNK_SIZE, **kwargs):
+        return self.gather('get_reference_data', ticker_list, field_list,
+                           chunk_size=chunk_size, **kwargs)
+
+
+def gather_historical(ticker_list, field_list, start_date, end_date,
+                      chunk_size=DEFAULT_CHUNK_SIZE,
+                      max_in_flight=DEFAULT_MAX_IN_FLIGHT, client=None,
+                      **kwargs):
+    """Historical data of `ticker_list`, queried by chunks of `chunk_size`
+    tickers with at most `max_in_flight` queries at the same time.
+    """
+    with AsyncClient(client, max_in_flight) as aclient:
+        return aclient.gather_historical(ticker_list, field_list, start_date,
+                                         end_date, chunk_size, **kwargs)
+
+
+def gather_reference(ticker_list, field_list, chunk_size=DEFAULT_CHUNK_SIZE,
+                     max_in_flight=DEFAULT_MAX_IN_FLIGHT, client=None,
+                     **kwargs):
+    """Reference data of `ticker_list`, queried by chunks of `chunk_size`
+    tickers with at most `max_in_flight` queries at the same time.
+    """
+    with AsyncClient(client, max_in_flight) as aclient:
+        return aclient.gather_reference(ticker_list, field_list, chunk_size,
+                                        **kwargs)
+
+
+def planned_historical(ticker_list, field_list, start_date, end_date,
+                       max_cells=planning.DEFAULT_MAX_CELLS,
+                       max_in_flight=DEFAULT_MAX_IN_FLIGHT, client=None,
+                       retries=planning.DEFAULT_RETRIES, **kwargs):
+    """Historical data of `ticker_list`, queried by chunks of at most
+    `max_cells` data points with at most `max_in_flight` queries at the same
+    time.
+    """
+    with AsyncClient(client, max_in_flight) as aclient:
+        return aclient.planned_historical(ticker_list, field_list, start_date,
+                                          end_date, max_cells, retries=retries,
+                                          **kwargs)
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+"""Splitting of oversized historical data queries.
+
+A query of thousands of tickers or decades of daily data times out or holds
+a Bloomberg session for minutes. `plan` splits it in chunks of tickers and,
+when the history of a single ticker is too large, in date windows, so that
+each chunk holds at most `max_cells` data points (estimated from the number
+of business days and the periodicity). `execute` runs the chunks on a thread
+pool, retrying the failed ones only, and `stitch` joins the per-ticker
+DataFrames back in the order of the query:
+
+>>> data = run(get_historical_data, tickers, fields, start_date, end_date)
+
+The same planner is used by the server for the queries it receives and by
+`ezbbg.ws.parallel` on the client side.
+"""
+
+import math
+import time
+import logging
+from collections import OrderedDict, namedtuple
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+import pandas as pd
+
+from ezbbg.ws.cache import to_request_date
+
+
+__author__ = ('eruiz070210', 'dgaraud111714')
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of data points (dates x tickers x fields) of a chunk.
+DEFAULT_MAX_CELLS = 200000
+# Maximum number of tickers of a chunk, whatever its size.
+DEFAULT_MAX_TICKERS = 100
+DEFAULT_WORKERS = 4
+DEFAULT_RETRIES = 2
+DEFAULT_RETRY_DELAY = 1.
+# Data points per business day of each periodicity.
+PERIODICITY_FACTORS = {
+    'DAILY': 1.,
+    'WEEKLY': 1. / 5,
+    'MONTHLY': 1. / 21,
+    'QUARTERLY': 1. / 63,
+    'SEMI_ANNUALLY': 1. / 126,
+    'YEARLY': 1. / 252,
+}
+
+# Words of the error messages of Bloomberg worth a retry.
+TRANSIENT_ERROR_WORDS = ('timeout', 'timed out', 'session')
+
+Chunk = namedtuple('Chunk', ['tickers', 'start_date', 'end_date'])
+
+
+def business_days(start_date, end_date):
+    """Number of business days in [`start_date`, `end_date`].
+    """
+    start = pd.Timestamp(start_date).date()
+    end = pd.Timestamp(end_date).date() + pd.Timedelta(days=1)
+    return max(int(np.busday_count(start, end)), 0)
+
+
+def estimate_cells(ticker_count, field_count, start_date, end_date,
+                   periodicity=None):
+    """Estimated number of data points of a historical data query.
+    """
+    factor = PERIODICITY_FACTORS.get(str(periodicity or 'DAILY').upper(), 1.)
+    dates = int(math.ceil(business_days(start_date, end_date) * factor))
+    return ticker_count * field_count * max(dates, 1)
+
+
+def date_windows(start_date, end_date, count):
+    """Split [`start_date`, `end_date`] in `count` contiguous windows of the
+    same length, with bounds of the type of `start_date`.
+    """
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    step = pd.Timedelta(days=int(math.ceil(((end - start).days + 1.) / count)))
+    windows = []
+    while start <= end:
+        last = min(start + step - pd.Timedelta(days=1), end)
+        windows.append((to_request_date(start, start_date),
+                        to_request_date(last, end_date)))
+        start = last + pd.Timedelta(days=1)
+    return windows
+
+
+def plan(ticker_list, field_list, start_date, end_date,
+         max_cells=DEFAULT_MAX_CELLS, max_tickers=DEFAULT_MAX_TICKERS,
+         periodicity=None):
+    """Chunks of the query, each of at most `max_cells` estimated data points
+    and `max_tickers` tickers. A single chunk if the query is small enough.
+    """
+    ticker_list = list(ticker_list)
+    per_ticker = estimate_cells(1, len(field_list), start_date, end_date,
+                                periodicity)
+    window_count = int(math.ceil(float(per_ticker) / max_cells))
+    if window_count > 1:
+        windows = date_windows(start_date, end_date, window_count)
+        chunk_size = 1
+    else:
+        windows = [(start_date, end_date)]
+        chunk_size = max(1, min(max_tickers, max_cells // per_ticker))
+    return [Chunk(ticker_list[i:i + chunk_size], start, end)
+            for start, end in windows
+            for i in range(0, len(ticker_list), chunk_size)]
+
+
+def is_transient(exc):
+    """Whether a failed chunk may succeed if sent again: a timeout or a lost
+    session, unlike an invalid query.
+    """
+    # Including the socket errors.
+    if isinstance(exc, EnvironmentError):
+        return True
+    message = str(exc).lower()
+    return any(word in message for word in TRANSIENT_ERROR_WORDS)
+
+
+def _run_chunk(fetch, chunk, field_list, kwargs, retries, retry_delay,
+               should_retry):
+    attempt = 0
+    while True:
+        try:
+            return fetch(chunk.tickers, field_list, chunk.start_date,
+                         chunk.end_date, **kwargs)
+        except Exception as exc:
+            if attempt >= retries or not should_retry(exc):
+                raise
+            attempt += 1
+            logger.warning("Chunk of %d tickers from %s to %s failed (%s), "
+                           "retry %d/%d", len(chunk.tickers), chunk.start_date,
+                           chunk.end_date, exc, attempt, retries)
+            time.sleep(retry_delay * attempt)
+
+
+def execute(fetch, chunks, field_list, workers=DEFAULT_WORKERS,
+            retries=DEFAULT_RETRIES, retry_delay=DEFAULT_RETRY_DELAY,
+            should_retry=is_transient, pool=None, **kwargs):
+    """Run `fetch(tickers, field_list, start_date, end_date, **kwargs)` for
+    each chunk, `workers` at a time (or on `pool`), and return the list of
+    the results.
+
+    A failed chunk is run again up to `retries` times, after `retry_delay`
+    seconds times the attempt number, if `should_retry(exc)`, by default if
+    the error is transient. The error of a chunk failing for good is raised.
+    """
+    if len(chunks) == 1:
+        return [_run_chunk(fetch, chunks[0], field_list, kwargs, retries,
+                           retry_delay, should_retry)]
+    own_pool = pool is None
+    if own_pool:
+        pool = ThreadPool(min(workers, len(chunks)))
+    try:
+        pending = [pool.apply_async(_run_chunk,
+                                    (fetch, chunk, field_list, kwargs, retries,
+                                     retry_delay, should_retry))
+                   for chunk in chunks]
+        return [result.get() for result in pending]
+    finally:
+        if own_pool:
+            pool.close()
+            pool.join()
+
+
+def stitch(ticker_list, results):
+    """Join the {ticker: DataFrame} results of the chunks in a dict ordered
+    as `ticker_list`, the frames of the date windows of a ticker being
+    concatenated in date order.
+    """
+    frames = {}
+    for result in results:
+        for ticker, frame in (result or {}).iteritems():
+            frames.setdefault(ticker, []).append(frame)
+    stitched = OrderedDict()
+    for ticker in ticker_list:
+        if ticker not in frames:
+            continue
+        parts = frames[ticker]
+        if len(parts) == 1:
+            stitched[ticker] = parts[0]
+            continue
+        frame = pd.concat(parts)
+        frame = frame[~frame.index.duplicated(keep='last')].sort_index()
+        stitched[ticker] = frame
+    return stitched
+
+
+def run(fetch, ticker_list, field_list, start_date, end_date,
+        max_cells=DEFAULT_MAX_CELLS, max_tickers=DEFAULT_MAX_TICKERS,
+        workers=DEFAULT_WORKERS, retries=DEFAULT_RETRIES,
+        retry_delay=DEFAULT_RETRY_DELAY, should_retry=is_transient,
+        pool=None, **kwargs):
+    """Historical data of the query, fetched by chunks with
+    `fetch(tickers, field_list, start_date, end_date, **kwargs)`.
+    """
+    chunks = plan(ticker_list, field_list, start_date, end_date, max_cells,
+                  max_tickers, kwargs.get('periodicity'))
+    if len(chunks) > 1:
+        logger.info("Historical data query of %d tickers from %s to %s split "
+                    "in %d chunks", len(ticker_list), start_date, end_date,
+                    len(chunks))
+    results = execute(fetch, chunks, field_list, workers, retries, retry_delay,
+                      should_retry, pool, **kwargs)
+    return stitch(ticker_list, results)
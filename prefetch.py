@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+
+"""Scheduled prefetch of historical data into the server cache.
+
+The same universes are queried every morning, each time from Bloomberg. The
+server can load them off-peak instead, from a JSON config of named jobs:
+
+{
+    "morning": {
+        "tickers": ["SX5E Index", "SPX Index"],
+        "fields": ["PX_LAST", "PX_VOLUME"],
+        "days": 7300,
+        "at": ["06:30"],
+        "options": {"periodicity": "DAILY"}
+    },
+    "intraday_fx": {
+        "tickers": ["EURUSD Curncy"],
+        "fields": ["PX_LAST"],
+        "days": 30,
+        "every": 3600
+    }
+}
+
+Each job queries its `days` of history up to today through the server cache,
+by chunks of tickers, at the local times `at` and/or every `every` seconds.
+The queries of the day then only fetch the rows of the day. `options` are
+the query options, e.g. periodicity or overrides, which must be those of the
+queries to serve from the cache.
+
+While `is_blocked` is true, i.e. the Bloomberg session can't be used, the
+jobs wait, with a growing delay between two checks.
+"""
+
+import json
+import time
+import logging
+import threading
+import datetime as dt
+
+
+__author__ = ('eruiz070210', 'dgaraud111714')
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 50
+DEFAULT_DAYS = 365
+# Delays in seconds between two checks while blocked.
+DEFAULT_BACKOFF = 60
+MAX_BACKOFF = 15 * 60
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+IDLE = 'idle'
+WAITING = 'waiting'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def _parse_time(value):
+    try:
+        return dt.datetime.strptime(value, "%H:%M").time()
+    except (TypeError, ValueError):
+        raise ValueError("Invalid time '{}', expected HH:MM".format(value))
+
+
+def _format(timestamp):
+    if timestamp is None:
+        return None
+    return time.strftime(TIME_FORMAT, time.localtime(timestamp))
+
+
+class Job(object):
+    """Prefetch of a universe, see the module documentation.
+    """
+
+    def __init__(self, name, tickers, fields, days=DEFAULT_DAYS, at=(),
+                 every=None, options=None):
+        if not tickers or not fields:
+            raise ValueError("The job '{}' has no tickers or fields".format(name))
+        if isinstance(at, basestring):
+            at = [at]
+        if not at and not every:
+            raise ValueError("The job '{}' has no schedule".format(name))
+        self.name = name
+        self.tickers = list(tickers)
+        self.fields = list(fields)
+        self.days = int(days)
+        self.at = sorted(_parse_time(value) for value in at)
+        self.every = float(every) if every else None
+        self.options = dict(options or {})
+        self.state = IDLE
+        self.done = 0
+        self.failed = 0
+        self.runs = 0
+        self.started = None
+        self.ended = None
+        self.next_run = None
+        self.error = None
+
+    def schedule(self, now):
+        """Set the next run after the time `now` (epoch seconds).
+        """
+        runs = []
+        if self.every:
+            runs.append(now + self.every)
+        if self.at:
+            today = dt.datetime.fromtimestamp(now)
+            for days in (0, 1):
+                day = today.date() + dt.timedelta(days=days)
+                for at in self.at:
+                    run = time.mktime(dt.datetime.combine(day, at).timetuple())
+                    if run > now:
+                        runs.append(run)
+        self.next_run = min(runs)
+
+    def stats(self):
+        return {'state': self.state,
+                'tickers': len(self.tickers),
+                'fields': len(self.fields),
+                'done': self.done,
+                'failed': self.failed,
+                'runs': self.runs,
+                'started': _format(self.started),
+                'ended': _format(self.ended),
+                'next_run': _format(self.next_run),
+                'error': self.error}
+
+
+def load_jobs(path):
+    """List of the `Job` of the JSON config `path`.
+    """
+    with open(path) as f:
+        config = json.load(f)
+    return [Job(name, **spec) for name, spec in sorted(config.iteritems())]
+
+
+class Prefetcher(object):
+    """Run the prefetch `jobs` in a background thread.
+
+    Parameters
+    ----------
+
+    fetch: callable
+        Historical data query going through the cache, with the signature of
+        `bloomberg.get_historical_data`.
+    jobs: list of Job
+    is_blocked: callable
+        Whether Bloomberg can't be queried for now.
+    chunk_size: int
+        Number of tickers per query.
+    backoff: float
+        First delay in seconds before checking `is_blocked` again, doubled
+        up to `MAX_BACKOFF` while blocked.
+    """
+
+    def __init__(self, fetch, jobs, is_blocked=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 backoff=DEFAULT_BACKOFF):
+        self.fetch = fetch
+        self.jobs = dict((job.name, job) for job in jobs)
+        self.is_blocked = is_blocked or (lambda: False)
+        self.chunk_size = chunk_size
+        self.backoff = backoff
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def stats(self):
+        with self._lock:
+            return {name: job.stats() for name, job in self.jobs.iteritems()}
+
+    def _wait_unblocked(self, job):
+        """Wait until Bloomberg can be queried, False if stopped meanwhile.
+        """
+        delay = self.backoff
+        while self.is_blocked():
+            if job.state != WAITING:
+                logger.info("Prefetch '%s' waiting: Bloomberg session locked",
+                            job.name)
+                job.state = WAITING
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+            if self._stopped:
+                return False
+            delay = min(2 * delay, MAX_BACKOFF)
+        return True
+
+    def run(self, name):
+        """Run the job `name` now, in the calling thread.
+        """
+        job = self.jobs[name]
+        with self._lock:
+            job.state = RUNNING
+            job.done = job.failed = 0
+            job.error = None
+            job.started = time.time()
+            job.ended = None
+        end_date = dt.date.today()
+        start_date = end_date - dt.timedelta(days=job.days)
+        logger.info("Prefetch '%s' starting: %d tickers, %d fields from %s",
+                    name, len(job.tickers), len(job.fields), start_date)
+        for i in range(0, len(job.tickers), self.chunk_size):
+            if not self._wait_unblocked(job):
+                return
+            job.state = RUNNING
+            chunk = job.tickers[i:i + self.chunk_size]
+            try:
+                self.fetch(chunk, job.fields, start_date, end_date, **job.options)
+            except Exception as exc:
+                logger.exception("Prefetch '%s' failed for %s", name, chunk)
+                with self._lock:
+                    job.failed += len(chunk)
+                    job.error = str(exc)
+                continue
+            with self._lock:
+                job.done += len(chunk)
+            logger.info("Prefetch '%s': %d/%d tickers", name,
+                        job.done + job.failed, len(job.tickers))
+        with self._lock:
+            job.state = FAILED if job.failed else DONE
+            job.runs += 1
+            job.ended = time.time()
+        logger.info("Prefetch '%s' %s in %.1fs: %d tickers loaded, %d failed",
+                    name, job.state, job.ended - job.started, job.done, job.failed)
+
+    def trigger(self, name):
+        """Run the job `name` as soon as possible.
+        """
+        with self._lock:
+            self.jobs[name].next_run = time.time()
+        self._wakeup.set()
+
+    def _loop(self):
+        while not self._stopped:
+            self._wakeup.clear()
+            now = time.time()
+            due = sorted((job for job in self.jobs.itervalues()
+                          if job.next_run <= now), key=lambda job: job.next_run)
+            for job in due:
+                with self._lock:
+                    job.schedule(now)
+                try:
+                    self.run(job.name)
+                except Exception as exc:
+                    logger.exception("Prefetch '%s' failed", job.name)
+                    job.state = FAILED
+                    job.error = str(exc)
+                if self._stopped:
+                    return
+            if not due:
+                next_run = min(job.next_run for job in self.jobs.itervalues())
+                self._wakeup.wait(max(0., next_run - time.time()))
+
+    def start(self):
+        if self._thread is not None or not self.jobs:
+            return
+        now = time.time()
+        for job in self.jobs.itervalues():
+            job.schedule(now)
+        self._thread = threading.Thread(target=self._loop, name="ezbbg-prefetch")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -5,7 +5,19 @@ import shutil
 from os import path
 import subprocess
 
-FLIST = ["__init__.py", "__main__.py", "client.py", "server.py", 'version']
+FLIST = ["__init__.py", "__main__.py", "client.py", "server.py", "cache.py",
+         "wire.py", "coalesce.py", "serving.py",
+         "parallel.py", "sharding.py", "field_catalog.py",
+         "compression.py", "metrics.py", "chaining.py",
+         "planning.py", "delta.py", "disk_cache.py",
+         "frames_json.py", "memo.py",
+         "async_logging.py",
+         "transforms.py",
+         "consolidate.py",
+         "prefetch.py",
+         "backends.py",
+         "synthetic.py",
+         'version']
 DEST_DIR = r"F:\GEDS-PAR-PRI\Pricing\Protected\ezbbg_ws"
 
 def get_sha1():
@@ -2,33 +2,40 @@
 
 import os
 import json
+import random
 import tempfile
 import logging
 import logging.config
 import datetime as dt
+# Imported by the first call to strptime, which fails if several threads
+# make it at the same time.
+import _strptime
+from functools import partial
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
 import pandas as pd
 
-from flask import Flask, jsonify, request, abort, Response
+from flask import Flask, jsonify, request, abort, Response, stream_with_context
+from werkzeug.exceptions import HTTPException
 
-from ezbbg import bloomberg
-from ezbbg.helpers import get_and_chain_historical_data
 from ezbbg.ws import git_version
-
-
-# check if session is locked - Win7
-import ctypes
-user32 = ctypes.windll.User32
-OpenDesktop = user32.OpenDesktopA
-SwitchDesktop = user32.SwitchDesktop
-DESKTOP_SWITCHDESKTOP = 0x0100
-
-def is_session_locked():
-    hDesktop = OpenDesktop ("default", 0, False, DESKTOP_SWITCHDESKTOP)
-    test = SwitchDesktop (hDesktop)
-    return not test
-
+from ezbbg.ws import wire
+from ezbbg.ws.cache import HistoricalDataCache, DEFAULT_MAX_CELLS
+from ezbbg.ws.coalesce import Coalescer, DEFAULT_WINDOW
+from ezbbg.ws.field_catalog import FieldCatalog, DEFAULT_REFRESH_INTERVAL
+from ezbbg.ws.chaining import ChainCache, DEFAULT_MAX_CHAINS
+from ezbbg.ws import serving
+from ezbbg.ws import compression
+from ezbbg.ws import metrics
+from ezbbg.ws import planning
+from ezbbg.ws import delta
+from ezbbg.ws import frames_json
+from ezbbg.ws import async_logging
+from ezbbg.ws import transforms
+from ezbbg.ws import prefetch
+from ezbbg.ws import backends
 
 
 __author__ = ('eruiz070210', 'dgaraud111714')
@@ -104,6 +111,129 @@ LOGGING = {
 
 logging.config.dictConfig(LOGGING)
 
+# The handlers above write from a background thread, the requests only queue
+# their records (up to EZBBG_LOG_QUEUE_SIZE, beyond which they're dropped).
+# Set EZBBG_LOG_ASYNC to 0 to write them synchronously.
+LOG_ASYNC = os.environ.get('EZBBG_LOG_ASYNC', '1') != '0'
+LOG_QUEUE_SIZE = int(os.environ.get('EZBBG_LOG_QUEUE_SIZE',
+                                    async_logging.DEFAULT_QUEUE_SIZE))
+log_listener = None
+if LOG_ASYNC:
+    log_listener = async_logging.install(queue_size=LOG_QUEUE_SIZE)
+# The request bodies are logged with their lists of more than
+# EZBBG_LOG_MAX_ITEMS items summarized, except for a EZBBG_LOG_BODY_SAMPLING
+# fraction of the requests logged in full.
+LOG_MAX_ITEMS = int(os.environ.get('EZBBG_LOG_MAX_ITEMS',
+                                   async_logging.DEFAULT_MAX_ITEMS))
+LOG_BODY_SAMPLING = float(os.environ.get('EZBBG_LOG_BODY_SAMPLING', 0.01))
+
+# Source of the data: 'live' (the terminal), 'record' (the terminal, its
+# responses being written to EZBBG_BACKEND_STORE), 'replay' (the responses of
+# EZBBG_BACKEND_STORE) or 'synthetic', see `backends`. The replayed and
+# synthetic queries take EZBBG_BACKEND_LATENCY seconds.
+BACKEND = os.environ.get('EZBBG_BACKEND', 'live')
+BACKEND_STORE = os.environ.get('EZBBG_BACKEND_STORE',
+                               os.path.join(LOG_DIR, 'recording'))
+BACKEND_LATENCY = float(os.environ.get('EZBBG_BACKEND_LATENCY', 0))
+bloomberg = backends.create(BACKEND, BACKEND_STORE, BACKEND_LATENCY)
+
+def is_session_locked():
+    """Whether the session of the terminal is locked, never for the
+    backends other than 'live' or off Windows.
+    """
+    return bloomberg.is_session_locked()
+
+def get_and_chain_historical_data(*args, **kwargs):
+    return bloomberg.get_and_chain_historical_data(*args, **kwargs)
+
+# Maximum number of data points kept in the historical data cache. Set the
+# env var to 0 to disable the cache.
+HISTORICAL_CACHE_MAX_CELLS = int(os.environ.get('EZBBG_CACHE_MAX_CELLS',
+                                                DEFAULT_MAX_CELLS))
+historical_cache = HistoricalDataCache(HISTORICAL_CACHE_MAX_CELLS)
+
+# Number of worker threads of the server, of connections waiting for a worker
+# and of Bloomberg queries run at the same time.
+SERVER_WORKERS = int(os.environ.get('EZBBG_SERVER_WORKERS', serving.DEFAULT_WORKERS))
+SERVER_QUEUE_SIZE = int(os.environ.get('EZBBG_SERVER_QUEUE_SIZE',
+                                       serving.DEFAULT_QUEUE_SIZE))
+BLOOMBERG_SESSIONS = int(os.environ.get('EZBBG_BLOOMBERG_SESSIONS', 4))
+bloomberg_limiter = serving.ConcurrencyLimiter(BLOOMBERG_SESSIONS)
+
+def call_bloomberg(name, *args, **kwargs):
+    """Call the function `name` of the backend, waiting for a free slot
+    if `BLOOMBERG_SESSIONS` queries are already running.
+    """
+    with bloomberg_limiter:
+        return getattr(bloomberg, name)(*args, **kwargs)
+
+# Concurrent queries which only differ by their tickers are merged when they
+# arrive within this time window (in seconds) while one of them is running.
+COALESCE_WINDOW = float(os.environ.get('EZBBG_COALESCE_WINDOW', DEFAULT_WINDOW))
+reference_data_coalescer = Coalescer(
+    partial(call_bloomberg, 'get_reference_data'),
+    COALESCE_WINDOW)
+historical_data_coalescer = Coalescer(
+    partial(call_bloomberg, 'get_historical_data'),
+    COALESCE_WINDOW)
+
+# Local catalog of the Bloomberg fields answering the field searches. It is
+# rebuilt every EZBBG_FIELD_CATALOG_REFRESH seconds, 0 disables the refresh.
+FIELD_CATALOG_PATH = os.environ.get('EZBBG_FIELD_CATALOG',
+                                    os.path.join(LOG_DIR, "fields_catalog.json"))
+FIELD_CATALOG_REFRESH = float(os.environ.get('EZBBG_FIELD_CATALOG_REFRESH',
+                                             DEFAULT_REFRESH_INTERVAL))
+field_catalog = FieldCatalog(partial(call_bloomberg, 'search_fields'),
+                             partial(call_bloomberg, 'search_fields_by_category'),
+                             partial(call_bloomberg, 'get_fields_info'),
+                             FIELD_CATALOG_PATH,
+                             refresh_interval=FIELD_CATALOG_REFRESH,
+                             # Defined below.
+                             is_blocked=lambda: bloomberg_blocked())
+
+# Responses larger than EZBBG_COMPRESSION_MIN_SIZE bytes are compressed with
+# the preferred encoding accepted by the client, at EZBBG_COMPRESSION_LEVEL
+# (the default level of the encoding if not set). Streams are always
+# compressed.
+COMPRESSION_MIN_SIZE = int(os.environ.get('EZBBG_COMPRESSION_MIN_SIZE',
+                                          compression.DEFAULT_MIN_SIZE))
+COMPRESSION_LEVEL = os.environ.get('EZBBG_COMPRESSION_LEVEL', None)
+if COMPRESSION_LEVEL is not None:
+    COMPRESSION_LEVEL = int(COMPRESSION_LEVEL)
+
+def _chain_bloomberg(tickers, fields, end_date, start_date, tolerance_in_days):
+    with bloomberg_limiter:
+        return get_and_chain_historical_data(tickers, fields, end_date, start_date,
+                                             tolerance_in_days=tolerance_in_days)
+
+# Maximum number of chained histories kept, 0 disables the cache.
+CHAIN_CACHE_MAX_CHAINS = int(os.environ.get('EZBBG_CHAIN_CACHE_SIZE',
+                                            DEFAULT_MAX_CHAINS))
+chain_cache = ChainCache(_chain_bloomberg, CHAIN_CACHE_MAX_CHAINS)
+
+# Historical data queries of more than EZBBG_PLAN_MAX_CELLS data points are
+# split in chunks of tickers and date windows run in parallel, a failed chunk
+# being retried EZBBG_PLAN_RETRIES times. Set the env var to 0 to disable it.
+PLAN_MAX_CELLS = int(os.environ.get('EZBBG_PLAN_MAX_CELLS',
+                                    planning.DEFAULT_MAX_CELLS))
+PLAN_RETRIES = int(os.environ.get('EZBBG_PLAN_RETRIES', planning.DEFAULT_RETRIES))
+# The chunks of all the queries share the pool, as many threads as Bloomberg
+# sessions.
+planning_pool = ThreadPool(BLOOMBERG_SESSIONS)
+
+# Per-route metrics of the requests, see '/metrics'.
+request_metrics = metrics.Metrics()
+app.wsgi_app = metrics.MetricsMiddleware(app.wsgi_app, request_metrics)
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+# Number of tickers per Bloomberg query when the historical data are streamed.
+STREAM_CHUNK_SIZE = 10
+TYPED_JSON_MIMETYPE = "application/vnd.ezbbg.typed+json"
+REFDATA_SCALAR = 'scalar'
+REFDATA_DATE = 'date'
+REFDATA_DATETIME = 'datetime'
+REFDATA_BULK = 'bulk'
+
 def isoformat_date_converter(data):
     """Convert a string in ISO format into a date or a datetime.
 
@@ -145,182 +275,568 @@ class JSONEncoder(json.JSONEncoder):
             return pd.to_datetime(obj).isoformat()
         return json.JSONEncoder.default(self, obj)
 
-# region Flask routes
-@app.route('/reference_data', methods=['GET'])
-def _server_get_reference_data():
-    app.logger.info("Reference data query starting...")
+def refdata_type(value):
+    """Type tag of a reference data value: 'scalar', 'date', 'datetime' or
+    'bulk'.
+    """
+    if isinstance(value, pd.DataFrame):
+        return REFDATA_BULK
+    if isinstance(value, (dt.datetime, np.datetime64)):
+        return REFDATA_DATETIME
+    if isinstance(value, dt.date):
+        return REFDATA_DATE
+    return REFDATA_SCALAR
+
+def bulk_columns(frame):
+    """Column-oriented representation of a bulk field.
+
+    The dates are sent as ISO strings, the name of the date columns being
+    listed in 'dates'.
+    """
+    data = []
+    dates = []
+    for name in frame.columns:
+        column = frame[name]
+        # Positional access: the frame may be shared by coalesced queries and
+        # the lazy build of the index lookup isn't thread-safe.
+        valid = column.dropna()
+        if column.dtype.kind == 'M' or (
+                len(valid)
+                and refdata_type(valid.iloc[0]) in (REFDATA_DATE, REFDATA_DATETIME)):
+            dates.append(name)
+            data.append([None if pd.isnull(x) else pd.Timestamp(x).isoformat()
+                         for x in column])
+        else:
+            data.append(column.tolist())
+    return {'columns': list(frame.columns), 'data': data, 'dates': dates}
+
+def typed_reference_data(reference_data):
+    """Reference data along with the type of each field, so the client
+    decodes the values in a single pass.
+
+    Return {'types': {field: type}, 'data': {ticker: {field: value}}} where
+    the bulk fields are column-oriented.
+    """
+    types = {}
+    data = {}
+    for ticker, fields in reference_data.iteritems():
+        encoded = data[ticker] = {}
+        for field, value in fields.iteritems():
+            kind = refdata_type(value)
+            if kind != REFDATA_SCALAR or field not in types:
+                types[field] = kind
+            if kind == REFDATA_BULK:
+                value = bulk_columns(value)
+            encoded[field] = value
+    return {'types': types, 'data': data}
+
+@metrics.timed('bloomberg')
+def get_historical_data(ticker_list, field_list, start_date, end_date, **kwargs):
+    """`bloomberg.get_historical_data` through the server cache and the
+    coalescing of concurrent queries.
+    """
+    if HISTORICAL_CACHE_MAX_CELLS > 0:
+        return historical_cache.get_historical_data(historical_data_coalescer,
+                                                    ticker_list, field_list,
+                                                    start_date, end_date,
+                                                    **kwargs)
+    return historical_data_coalescer(ticker_list, field_list,
+                                     start_date, end_date,
+                                     **kwargs)
+
+def bloomberg_blocked():
+    """Whether the Bloomberg session can't be used for now.
+    """
+    return is_session_locked() and not is_server_run_as_a_service()
+
+# JSON config of the universes loaded into the historical data cache on a
+# schedule, see `prefetch`. None to disable the prefetch.
+PREFETCH_CONFIG = os.environ.get('EZBBG_PREFETCH_CONFIG', None)
+PREFETCH_CHUNK_SIZE = int(os.environ.get('EZBBG_PREFETCH_CHUNK_SIZE',
+                                         prefetch.DEFAULT_CHUNK_SIZE))
+prefetcher = prefetch.Prefetcher(
+    get_historical_data,
+    prefetch.load_jobs(PREFETCH_CONFIG) if PREFETCH_CONFIG else [],
+    is_blocked=bloomberg_blocked,
+    chunk_size=PREFETCH_CHUNK_SIZE)
+
+def best_mimetype(*mimetypes):
+    """Mimetype preferred by the client among JSON and the given ones.
+    """
+    return request.accept_mimetypes.best_match(["application/json"]
+                                               + list(mimetypes))
 
-    json_data = request.get_json()
+def accepts_ndjson():
+    """Whether the client asks for a stream of JSON lines.
+    """
+    return best_mimetype(NDJSON_MIMETYPE) == NDJSON_MIMETYPE
 
-    app.logger.info("Reference data query: %s", json_data)
+def accepts_frames_json():
+    """Whether the client decodes the frames_json objects, see
+    `frames_json`.
+    """
+    return request.accept_mimetypes[frames_json.FRAMES_JSON_MIMETYPE] > 0
 
-    if is_session_locked() and not is_server_run_as_a_service():
-        abort(500)
+def accepts_columnar():
+    """Whether the client prefers the binary columnar format to JSON.
+    """
+    return best_mimetype(wire.COLUMNAR_MIMETYPE) == wire.COLUMNAR_MIMETYPE
 
-    if json_data is None:
-        abort(400)
+@metrics.timed('serialize')
+def json_response(data, mimetype="application/json"):
+    return Response(response=json.dumps(data, cls=JSONEncoder),
+                    status=200,
+                    mimetype=mimetype)
 
+@metrics.timed('serialize')
+def data_response(data):
+    """Response of a data query, in the format negotiated with the client.
+    """
+    mimetype = best_mimetype(wire.COLUMNAR_MIMETYPE,
+                             frames_json.FRAMES_JSON_MIMETYPE)
+    if mimetype == wire.COLUMNAR_MIMETYPE:
+        return Response(response=wire.encode(data),
+                        status=200,
+                        mimetype=wire.COLUMNAR_MIMETYPE)
+    if mimetype == frames_json.FRAMES_JSON_MIMETYPE:
+        return Response(response=frames_json.dumps(data),
+                        status=200,
+                        mimetype=frames_json.FRAMES_JSON_MIMETYPE)
+    return json_response(data)
+
+def log_request(name, json_data):
+    """Log the body of the query `name`, summarized unless it's sampled.
+    """
+    if not app.logger.isEnabledFor(logging.INFO):
+        return
+    if random.random() >= LOG_BODY_SAMPLING:
+        json_data = async_logging.summarize(json_data, LOG_MAX_ITEMS)
+    app.logger.info("%s query: %s", name, json_data)
+
+def request_json():
+    """JSON body of the request. Its numbers of tickers and fields are
+    recorded in the metrics.
+    """
+    with metrics.phase('parse'):
+        json_data = request.get_json()
+    if isinstance(json_data, dict):
+        metrics.record_query(json_data.get('ticker_list', json_data.get('tickers')),
+                             json_data.get('field_list', json_data.get('fields')))
+    return json_data
+
+# region Queries
+# Each query takes the JSON body of the request and returns the data to send.
+# They are shared by the routes and the '/batch' endpoint.
+@metrics.timed('bloomberg')
+def reference_data_query(json_data):
     ticker_list = json_data.pop('ticker_list')
     field_list = json_data.pop('field_list')
+    return reference_data_coalescer(ticker_list, field_list, **json_data)
 
-    reference_data = bloomberg.get_reference_data(ticker_list, field_list, **json_data)
+def _historical_data_args(json_data):
+    ticker_list = json_data.pop('ticker_list')
+    field_list = json_data.pop('field_list')
+    start_date = json_data.pop('start_date')
+    end_date = json_data.pop('end_date')
+    start_date = isoformat_date_converter(start_date)
+    end_date = isoformat_date_converter(end_date)
+    return ticker_list, field_list, start_date, end_date
 
-    app.logger.info("Reference data query ending")
+def transform_arg(json_data):
+    """Pop and parse the 'transform' option of a historical data query,
+    abort if it's invalid.
+    """
+    try:
+        return transforms.parse(json_data.pop('transform', None))
+    except ValueError as exc:
+        abort(400, str(exc))
 
-    return Response(response=json.dumps(reference_data, cls=JSONEncoder),
-                    status=200,
-                    mimetype="application/json")
+def stream_chunk_size_arg(json_data):
+    """Pop the 'stream_chunk_size' option of a historical data query, abort
+    if it's not a positive integer.
+    """
+    chunk_size = json_data.pop('stream_chunk_size', STREAM_CHUNK_SIZE)
+    if (not isinstance(chunk_size, (int, long)) or isinstance(chunk_size, bool)
+            or chunk_size < 1):
+        abort(400, "Invalid stream_chunk_size {!r}, expected a positive "
+                   "integer".format(chunk_size))
+    return chunk_size
+
+def historical_data_query(json_data):
+    json_data.pop('stream_chunk_size', None)
+    transform = transform_arg(json_data)
+    data = _fetch_historical_data(json_data)
+    with metrics.phase('transform'):
+        return transforms.apply(data, transform)
+
+@metrics.timed('bloomberg')
+def _fetch_historical_data(json_data):
+    ticker_list, field_list, start_date, end_date = _historical_data_args(json_data)
+    if (PLAN_MAX_CELLS > 0
+            and planning.estimate_cells(len(ticker_list), len(field_list),
+                                        start_date, end_date,
+                                        json_data.get('periodicity')) > PLAN_MAX_CELLS):
+        return planning.run(get_historical_data, ticker_list, field_list,
+                            start_date, end_date, max_cells=PLAN_MAX_CELLS,
+                            retries=PLAN_RETRIES, pool=planning_pool,
+                            **json_data)
+    return get_historical_data(ticker_list, field_list, start_date, end_date,
+                               **json_data)
+
+@metrics.timed('bloomberg')
+def fields_info_query(json_data):
+    field_list = json_data.pop('field_list')
+    return_field_documentation = json_data.pop('return_field_documentation', True)
+    return field_catalog.get_fields_info(field_list, return_field_documentation)
 
-@app.route('/historical_data', methods=['GET'])
-def _server_get_historical_data():
-    app.logger.info("Historical data query starting...")
-    json_data = request.get_json()
-    app.logger.info("Historical data query: %s", json_data)
+@metrics.timed('bloomberg')
+def search_fields_query(json_data):
+    search_string = json_data.pop('search_string')
+    return_field_documentation = json_data.pop('return_field_documentation', True)
+    include_categories = json_data.pop('include_categories', None)
+    include_product_type = json_data.pop('include_product_type', None)
+    include_field_type = json_data.pop('include_field_type', None)
+    exclude_categories = json_data.pop('exclude_categories', None)
+    exclude_product_type = json_data.pop('exclude_product_type', None)
+    exclude_field_type = json_data.pop('exclude_field_type', None)
 
-    if is_session_locked() and not is_server_run_as_a_service():
-        abort(500)
+    return field_catalog.search_fields(search_string,
+                                       return_field_documentation,
+                                       include_categories,
+                                       include_product_type,
+                                       include_field_type,
+                                       exclude_categories,
+                                       exclude_product_type,
+                                       exclude_field_type)
+
+@metrics.timed('bloomberg')
+def search_fields_by_category_query(json_data):
+    search_string = json_data.pop('search_string')
+    return_field_documentation = json_data.pop('return_field_documentation', True)
+    exclude_categories = json_data.pop('exclude_categories', None)
+    exclude_product_type = json_data.pop('exclude_product_type', None)
+    exclude_field_type = json_data.pop('exclude_field_type', None)
 
-    if json_data is None:
-        abort(400)
+    return field_catalog.search_fields_by_category(search_string,
+                                                   return_field_documentation,
+                                                   exclude_categories,
+                                                   exclude_product_type,
+                                                   exclude_field_type)
 
-    ticker_list = json_data.pop('ticker_list')
-    field_list = json_data.pop('field_list')
+@metrics.timed('bloomberg')
+def chain_historical_data_query(json_data):
+    tickers = json_data.pop('tickers')
+    fields = json_data.pop('fields')
     start_date = json_data.pop('start_date')
     end_date = json_data.pop('end_date')
+    tolerance_days = json_data.pop('tolerance_days')
     start_date = isoformat_date_converter(start_date)
     end_date = isoformat_date_converter(end_date)
+    return chain_cache.get_and_chain_historical_data(tickers, fields, end_date,
+                                                     start_date, tolerance_days)
+
+# Queries available through '/batch': route -> (query, run in parallel). The
+# data queries go through the cache and the coalescing layer and are run
+# concurrently, the field searches are run one after the other.
+BATCH_QUERIES = {
+    'reference_data': (reference_data_query, True),
+    'historical_data': (historical_data_query, True),
+    'chain_historical_data': (chain_historical_data_query, True),
+    'fields_info': (fields_info_query, False),
+    'fields': (search_fields_query, False),
+    'fields_by_category': (search_fields_by_category_query, False),
+}
+# Maximum number of queries of a batch run at the same time.
+BATCH_WORKERS = int(os.environ.get('EZBBG_BATCH_WORKERS', 4))
+# Shared by the batches, so that they don't each start their threads.
+batch_pool = ThreadPool(BATCH_WORKERS)
+
+def check_query(json_data):
+    """Abort if the Bloomberg session can't be used or if the body is empty.
+    """
+    with metrics.phase('lock_check'):
+        locked = is_session_locked()
+    if locked and not is_server_run_as_a_service():
+        abort(500)
+
+    if json_data is None:
+        abort(400)
 
-    data = bloomberg.get_historical_data(ticker_list, field_list,
-                                         start_date, end_date,
-                                         **json_data)
+# region Flask routes
+@app.after_request
+def _compress_response(response):
+    """Compress the response with the encoding negotiated through the
+    Accept-Encoding header.
+    """
+    if (response.status_code != 200
+            or 'Content-Encoding' in response.headers
+            or response.direct_passthrough and not response.is_streamed):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = compression.choose_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = compression.compress_stream(response.response,
+                                                        encoding,
+                                                        COMPRESSION_LEVEL)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESSION_MIN_SIZE:
+            return response
+        with metrics.phase('compress'):
+            data = compression.compress(data, encoding, COMPRESSION_LEVEL)
+        response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+@app.route('/reference_data', methods=['GET'])
+def _server_get_reference_data():
+    app.logger.info("Reference data query starting...")
+
+    json_data = request_json()
+
+    log_request("Reference data", json_data)
+
+    check_query(json_data)
+
+    reference_data = reference_data_query(json_data)
+
+    app.logger.info("Reference data query ending")
+
+    mimetype = best_mimetype(TYPED_JSON_MIMETYPE, wire.COLUMNAR_MIMETYPE)
+    if mimetype == TYPED_JSON_MIMETYPE:
+        return json_response(typed_reference_data(reference_data),
+                             TYPED_JSON_MIMETYPE)
+    return data_response(reference_data)
+
+@app.route('/historical_data', methods=['GET'])
+def _server_get_historical_data():
+    app.logger.info("Historical data query starting...")
+    json_data = request_json()
+    log_request("Historical data", json_data)
+
+    check_query(json_data)
+
+    held = json_data.pop('held', None)
+    if held is not None:
+        return _historical_delta_response(json_data, held)
+
+    if accepts_ndjson():
+        chunk_size = stream_chunk_size_arg(json_data)
+        transform = transform_arg(json_data)
+        ticker_list, field_list, start_date, end_date = _historical_data_args(json_data)
+        records = _stream_historical_data(ticker_list, field_list,
+                                          start_date, end_date,
+                                          chunk_size, transform,
+                                          accepts_frames_json(), **json_data)
+        return Response(response=stream_with_context(records),
+                        status=200,
+                        mimetype=NDJSON_MIMETYPE)
+
+    data = historical_data_query(json_data)
     app.logger.info("Historical data query ending")
-    return Response(response=json.dumps(data, cls=JSONEncoder),
-                    status=200,
-                    mimetype="application/json")
+    return data_response(data)
+
+def _historical_delta_response(json_data, held):
+    """Rows of the query which the client doesn't hold, see `delta`, or
+    304 Not Modified if its data are those of the server.
+    """
+    data = historical_data_query(json_data)
+    with metrics.phase('delta'):
+        if request.if_none_match:
+            etag = delta.etag({ticker: delta.frame_digest(frame)
+                               for ticker, frame in data.iteritems()})
+            if request.if_none_match.contains(etag):
+                app.logger.info("Historical data not modified")
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+        rows, replaced = delta.diff(data, held)
+    app.logger.info("Historical data delta: %d tickers updated, %d replaced",
+                    len(rows) - len(replaced), len(replaced))
+    return data_response({'data': rows, 'replaced': replaced})
+
+def _stream_historical_data(ticker_list, field_list, start_date, end_date,
+                            chunk_size, transform=None, framed=False,
+                            **kwargs):
+    """Generate one JSON line {"ticker": ..., "data": ...} per ticker, the
+    DataFrame being a frames_json object if `framed`, else its `to_json`.
+
+    Bloomberg is queried by chunks of `chunk_size` tickers, `transform` being
+    applied to each chunk. If a query fails, a last line {"error": ...} is
+    sent since the HTTP status is already gone.
+    """
+    for i in range(0, len(ticker_list), chunk_size):
+        chunk = ticker_list[i:i + chunk_size]
+        try:
+            data = get_historical_data(chunk, field_list, start_date, end_date,
+                                       **kwargs)
+            data = transforms.apply(data, transform)
+        except Exception as exc:
+            app.logger.exception("Historical data stream failed")
+            yield json.dumps({'error': str(exc)}) + '\n'
+            return
+        for ticker in chunk:
+            if ticker in data:
+                record = {'ticker': ticker, 'data': data.pop(ticker)}
+                if framed:
+                    yield frames_json.dumps(record) + '\n'
+                else:
+                    yield json.dumps(record, cls=JSONEncoder) + '\n'
+    app.logger.info("Historical data stream ending")
 
 @app.route('/version/bbg', methods=['GET'])
 def _bbg_version():
-    from ezbbg import __version__
-    return __version__
+    return bloomberg.version
 
 @app.route('/version/ws', methods=['GET'])
 def _webs_version():
     return git_version()
 
+@app.route('/status', methods=['GET'])
+def _server_status():
+    """Load of the server: worker pool, Bloomberg queries, caches.
+    """
+    status = {'server': serving.server_stats(),
+              'backend': bloomberg.name,
+              'bloomberg': bloomberg_limiter.stats(),
+              'coalescing': {'reference_data': reference_data_coalescer.stats(),
+                             'historical_data': historical_data_coalescer.stats()},
+              'historical_cache': historical_cache.stats(),
+              'chain_cache': chain_cache.stats(),
+              'field_catalog': field_catalog.stats(),
+              'prefetch': prefetcher.stats(),
+              'logging': log_listener.stats() if log_listener else None}
+    return Response(response=json.dumps(status),
+                    status=200,
+                    mimetype="application/json")
+
+@app.route('/metrics', methods=['GET'])
+def _server_metrics():
+    """Per-route counters, latency and phase histograms, payload sizes and
+    requests in flight.
+    """
+    return Response(response=json.dumps(request_metrics.snapshot()),
+                    status=200,
+                    mimetype="application/json")
+
 @app.route('/fields_info', methods=['GET'])
 def _server_get_fields_info():
     app.logger.info("Fields info query starting...")
-    json_data = request.get_json()
-    app.logger.info("Fields info query: %s", json_data)
-
-    if is_session_locked() and not is_server_run_as_a_service():
-        abort(500)
+    json_data = request_json()
+    log_request("Fields info", json_data)
 
-    if json_data is None:
-        abort(400)
-
-    field_list = json_data.pop('field_list')
-    return_field_documentation = json_data.pop('return_field_documentation', True)
+    check_query(json_data)
 
-    fields_info = bloomberg.get_fields_info(field_list, return_field_documentation)
+    fields_info = fields_info_query(json_data)
 
     app.logger.info("Fields info query ending")
 
-    return Response(response=json.dumps(fields_info, cls=JSONEncoder),
-                    status=200,
-                    mimetype="application/json")
+    return json_response(fields_info)
 
 
 @app.route('/fields', methods=['GET'])
 def _server_search_fields():
     app.logger.info("Fields query starting...")
-    json_data = request.get_json()
-    app.logger.info("Fields query: %s", json_data)
-
-    if is_session_locked() and not is_server_run_as_a_service():
-        abort(500)
-
-    if json_data is None:
-        abort(400)
+    json_data = request_json()
+    log_request("Fields", json_data)
 
-    search_string = json_data.pop('search_string')
-    return_field_documentation = json_data.pop('return_field_documentation', True)
-    include_categories = json_data.pop('include_categories', None)
-    include_product_type = json_data.pop('include_product_type', None)
-    include_field_type = json_data.pop('include_field_type', None)
-    exclude_categories = json_data.pop('exclude_categories', None)
-    exclude_product_type = json_data.pop('exclude_product_type', None)
-    exclude_field_type = json_data.pop('exclude_field_type', None)
+    check_query(json_data)
 
-    fields = bloomberg.search_fields(search_string,
-                                     return_field_documentation,
-                                     include_categories,
-                                     include_product_type,
-                                     include_field_type,
-                                     exclude_categories,
-                                     exclude_product_type,
-                                     exclude_field_type)
+    fields = search_fields_query(json_data)
 
     app.logger.info("Fields query ending")
 
-    return Response(response=json.dumps(fields, cls=JSONEncoder),
-                    status=200,
-                    mimetype="application/json")
+    return json_response(fields)
 
 
 @app.route('/fields_by_category', methods=['GET'])
 def _server_search_fields_by_category():
     app.logger.info("Fields by category query starting...")
-    json_data = request.get_json()
-    app.logger.info("Fields by category query: %s", json_data)
-
-    if is_session_locked() and not is_server_run_as_a_service():
-        abort(500)
-
-    if json_data is None:
-        abort(400)
+    json_data = request_json()
+    log_request("Fields by category", json_data)
 
-    search_string = json_data.pop('search_string')
-    return_field_documentation = json_data.pop('return_field_documentation', True)
-    exclude_categories = json_data.pop('exclude_categories', None)
-    exclude_product_type = json_data.pop('exclude_product_type', None)
-    exclude_field_type = json_data.pop('exclude_field_type', None)
+    check_query(json_data)
 
-    fields = bloomberg.search_fields_by_category(search_string,
-                                                 return_field_documentation,
-                                                 exclude_categories,
-                                                 exclude_product_type,
-                                                 exclude_field_type)
+    fields = search_fields_by_category_query(json_data)
 
     app.logger.info("Fields by category query ending")
 
-    return Response(response=json.dumps(fields, cls=JSONEncoder),
-                    status=200,
-                    mimetype="application/json")
+    return json_response(fields)
 
 @app.route('/chain_historical_data', methods=['GET'])
 def _chain_historical_data():
     app.logger.info("Historical chained data query starting...")
-    json_data = request.get_json()
-    app.logger.info("Historical chained data query: %s", json_data)
+    json_data = request_json()
+    log_request("Historical chained data", json_data)
 
-    if is_session_locked() and not is_server_run_as_a_service():
-        abort(500)
+    check_query(json_data)
 
-    if json_data is None:
+    data = chain_historical_data_query(json_data)
+    return data_response(data)
+
+@app.route('/batch', methods=['GET'])
+def _server_batch():
+    """Run several queries in a single round trip.
+
+    The body is {"queries": [{"id": ..., "route": ..., "args": {...}}, ...]}
+    where 'route' is one of `BATCH_QUERIES` and 'args' the body of this route.
+    The response is {"results": {id: {"status": ..., "data"|"error": ...}}}.
+    In JSON, the reference data are typed as with the
+    'application/vnd.ezbbg.typed+json' format.
+    """
+    app.logger.info("Batch query starting...")
+    json_data = request_json()
+    log_request("Batch", json_data)
+
+    check_query(json_data)
+
+    queries = json_data.get('queries')
+    if not isinstance(queries, list) or not all(
+            isinstance(query, dict) and query.get('route') in BATCH_QUERIES
+            and isinstance(query.get('args', {}), dict) for query in queries):
         abort(400)
 
-    tickers = json_data.pop('tickers')
-    fields = json_data.pop('fields')
-    start_date = json_data.pop('start_date')
-    end_date = json_data.pop('end_date')
-    tolerance_days = json_data.pop('tolerance_days')
-    start_date = isoformat_date_converter(start_date)
-    end_date = isoformat_date_converter(end_date)
-    data = get_and_chain_historical_data(tickers, fields, end_date, start_date,
-                                         tolerance_in_days=tolerance_days)
-    json_data = json.dumps(data, cls=JSONEncoder)
-    return Response(response=json_data, status=200, mimetype="application/json")
+    columnar = accepts_columnar()
+    metrics.record_query([ticker for query in queries
+                          for ticker in query.get('args', {}).get('ticker_list', [])])
+    with metrics.phase('bloomberg'):
+        results = _run_batch_queries(queries)
+    for query, result in zip(queries, results):
+        if (not columnar and query['route'] == 'reference_data'
+                and 'data' in result):
+            result['data'] = typed_reference_data(result['data'])
+    # By default, a query is identified by its position in the batch.
+    results = OrderedDict((query.get('id', i), result)
+                          for i, (query, result) in enumerate(zip(queries, results)))
+    app.logger.info("Batch query ending")
+    return data_response({'results': results})
+
+def _run_batch_queries(queries):
+    """Results of the `queries`, in the same order. The parallel ones run in
+    `batch_pool` while the others run one after the other.
+    """
+    parallel = [query for query in queries if BATCH_QUERIES[query['route']][1]]
+    async_results = batch_pool.map_async(_run_batch_query, parallel)
+    sequential = iter([_run_batch_query(query) for query in queries
+                       if not BATCH_QUERIES[query['route']][1]])
+    parallel = iter(async_results.get())
+    return [next(parallel) if BATCH_QUERIES[query['route']][1] else next(sequential)
+            for query in queries]
+
+def _run_batch_query(query):
+    query_func = BATCH_QUERIES[query['route']][0]
+    try:
+        return {'status': 200, 'data': query_func(dict(query.get('args', {})))}
+    except HTTPException as exc:
+        return {'status': exc.code, 'error': str(exc)}
+    except KeyError as exc:
+        return {'status': 400, 'error': "Missing argument {}".format(exc)}
+    except Exception as exc:
+        app.logger.exception("Batch query '%s' failed", query['route'])
+        return {'status': 500, 'error': str(exc)}
 
 
 def _test_get_reference_data():
@@ -379,7 +895,17 @@ def _test_search_fields_by_category():
 
 
 def main(debug=False):
+    if FIELD_CATALOG_REFRESH > 0:
+        field_catalog.start()
+    if prefetcher.jobs and HISTORICAL_CACHE_MAX_CELLS <= 0:
+        app.logger.warning("The historical data cache is disabled, "
+                           "the prefetch jobs won't be run")
+    elif prefetcher.jobs:
+        prefetcher.start()
     if debug:
         app.run(host=HOST_DEBUG, port=PORT, ssl_context='adhoc')
     else:
-        app.run(host=HOST, port=PORT, ssl_context='adhoc')
+        serving.serve(app, HOST, PORT,
+                      workers=SERVER_WORKERS,
+                      queue_size=SERVER_QUEUE_SIZE,
+                      ssl_context='adhoc')
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+"""Production serving mode.
+
+The requests are handled by a fixed pool of worker threads fed by a bounded
+queue of connections: a slow query only holds one worker, and when every
+worker is busy and the queue is full, the new requests get a 503 right away
+(which the client retries with a backoff) instead of piling up. Connections
+are kept alive between two requests without holding a worker.
+
+The Bloomberg queries themselves go through a `ConcurrencyLimiter` so that
+the number of queries sent at the same time to the terminal stays bounded.
+"""
+
+import time
+import select
+import socket
+import threading
+import Queue
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+
+__author__ = ('eruiz070210', 'dgaraud111714')
+
+DEFAULT_WORKERS = 16
+DEFAULT_QUEUE_SIZE = 64
+# Idle time in seconds after which a kept-alive connection is closed.
+KEEP_ALIVE_TIMEOUT = 15
+# Timeout in seconds of the socket operations while handling a request.
+REQUEST_TIMEOUT = 30
+# Time in seconds between two checks of the idle connections' timeout. The
+# poller is woken up as soon as a connection becomes idle or readable.
+POLL_INTERVAL = 0.5
+
+_REJECT_RESPONSE = (b"HTTP/1.1 503 Service Unavailable\r\n"
+                    b"Content-Length: 0\r\n"
+                    b"Retry-After: 1\r\n"
+                    b"Connection: close\r\n\r\n")
+
+
+class ConcurrencyLimiter(object):
+    """Context manager which lets at most `limit` threads in at once and
+    counts the waiting and running ones.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.waiting = 0
+        self.in_flight = 0
+        self._semaphore = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with self._lock:
+            self.waiting += 1
+        self._semaphore.acquire()
+        with self._lock:
+            self.waiting -= 1
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        with self._lock:
+            self.in_flight -= 1
+        self._semaphore.release()
+
+    def stats(self):
+        return {'limit': self.limit,
+                'waiting': self.waiting,
+                'in_flight': self.in_flight}
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    """HTTP/1.1 request handler which handles a single request.
+
+    When the connection is to be kept alive, `kept_alive` is set and the
+    server waits for the next request of the connection without holding a
+    worker. Responses without a Content-Length (streams) still close the
+    connection.
+    """
+    protocol_version = "HTTP/1.1"
+    timeout = REQUEST_TIMEOUT
+    kept_alive = False
+
+    def handle_one_request(self):
+        WSGIRequestHandler.handle_one_request(self)
+        if not self.close_connection:
+            self.kept_alive = True
+            self.close_connection = 1
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """WSGI server handling the requests with `workers` threads.
+
+    Up to `queue_size` connections with a pending request wait for a free
+    worker, the next ones are answered with a 503. Idle kept-alive
+    connections are watched by a single thread and queued again as soon as a
+    new request comes in.
+    """
+    multithread = True
+
+    def __init__(self, host, port, app, workers=DEFAULT_WORKERS,
+                 queue_size=DEFAULT_QUEUE_SIZE, handler=KeepAliveRequestHandler,
+                 **kwargs):
+        BaseWSGIServer.__init__(self, host, port, app, handler=handler, **kwargs)
+        self.workers = workers
+        self.served = 0
+        self.rejected = 0
+        self.busy = 0
+        self._queue = Queue.Queue(queue_size)
+        self._lock = threading.Lock()
+        # socket -> (client address, idle since)
+        self._idle = {}
+        # Written to wake the poller up when a connection becomes idle.
+        self._wakeup_reader, self._wakeup_writer = _socket_pair()
+        self._threads = []
+        for i in range(workers):
+            self._start_thread(self._work, "ezbbg-worker-{}".format(i))
+        self._start_thread(self._poll_idle, "ezbbg-keep-alive")
+
+    def _start_thread(self, target, name):
+        thread = threading.Thread(target=target, name=name)
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+
+    def stats(self):
+        return {'workers': self.workers,
+                'busy_workers': self.busy,
+                'queue_depth': self._queue.qsize(),
+                'queue_size': self._queue.maxsize,
+                'idle_connections': len(self._idle),
+                'served': self.served,
+                'rejected': self.rejected}
+
+    def get_request(self):
+        request, client_address = BaseWSGIServer.get_request(self)
+        try:
+            # The status line and the headers are written separately: don't
+            # wait for the ACK of the first one before sending the next.
+            request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (socket.error, AttributeError):
+            pass
+        return request, client_address
+
+    def process_request(self, request, client_address):
+        try:
+            self._queue.put_nowait((request, client_address))
+        except Queue.Full:
+            with self._lock:
+                self.rejected += 1
+            try:
+                request.sendall(_REJECT_RESPONSE)
+            except Exception:
+                pass
+            self.shutdown_request(request)
+
+    def finish_request(self, request, client_address):
+        """Handle one request, return whether the connection is kept alive.
+        """
+        handler = self.RequestHandlerClass(request, client_address, self)
+        return handler.kept_alive
+
+    def _work(self):
+        while True:
+            request, client_address = self._queue.get()
+            with self._lock:
+                self.busy += 1
+            kept_alive = False
+            try:
+                kept_alive = self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                with self._lock:
+                    self.busy -= 1
+                    self.served += 1
+                    if kept_alive:
+                        self._idle[request] = (client_address, time.time())
+                if kept_alive:
+                    self._wake_poller()
+                else:
+                    self.shutdown_request(request)
+
+    def _wake_poller(self):
+        try:
+            self._wakeup_writer.send(b'x')
+        except socket.error:
+            # The buffer is full: the poller has already been woken up.
+            pass
+
+    def server_close(self):
+        BaseWSGIServer.server_close(self)
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
+
+    def _poll_idle(self):
+        while True:
+            with self._lock:
+                idle = list(self._idle)
+            try:
+                readable, _, _ = select.select(idle + [self._wakeup_reader],
+                                               [], [], POLL_INTERVAL)
+            except (select.error, socket.error, ValueError):
+                if _is_closed(self._wakeup_reader):
+                    # The server is closed.
+                    return
+                # A socket has been closed in the meantime.
+                readable = [sock for sock in idle if _is_closed(sock)]
+            if self._wakeup_reader in readable:
+                readable.remove(self._wakeup_reader)
+                try:
+                    self._wakeup_reader.recv(4096)
+                except socket.error:
+                    pass
+            now = time.time()
+            with self._lock:
+                ready = [(sock, self._idle.pop(sock)[0]) for sock in readable]
+                expired = [sock for sock, (_, since) in self._idle.items()
+                           if now - since > KEEP_ALIVE_TIMEOUT]
+                for sock in expired:
+                    del self._idle[sock]
+            for sock, client_address in ready:
+                self.process_request(sock, client_address)
+            for sock in expired:
+                self.shutdown_request(sock)
+
+
+def _socket_pair():
+    """Pair of connected non-blocking sockets. Python 2 has no
+    `socket.socketpair` on Windows.
+    """
+    if hasattr(socket, 'socketpair'):
+        pair = socket.socketpair()
+    else:
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            listener.bind(('127.0.0.1', 0))
+            listener.listen(1)
+            writer = socket.create_connection(listener.getsockname())
+            reader, _ = listener.accept()
+        finally:
+            listener.close()
+        pair = reader, writer
+    for sock in pair:
+        sock.setblocking(False)
+    return pair
+
+
+def _is_closed(sock):
+    try:
+        select.select([sock], [], [], 0)
+    except (select.error, socket.error, ValueError):
+        return True
+    return False
+
+
+_server = None
+
+
+def server_stats():
+    """Stats of the running `PooledWSGIServer`, None in the debug mode.
+    """
+    if _server is None:
+        return None
+    return _server.stats()
+
+
+def serve(app, host, port, workers=DEFAULT_WORKERS,
+          queue_size=DEFAULT_QUEUE_SIZE, ssl_context=None):
+    """Serve `app` with a `PooledWSGIServer` until interrupted.
+    """
+    global _server
+    _server = PooledWSGIServer(host, port, app, workers=workers,
+                               queue_size=queue_size, ssl_context=ssl_context)
+    app.logger.info("Serving on %s:%s with %s workers (queue of %s)",
+                    host, _server.port, workers, queue_size)
+    start = time.time()
+    try:
+        _server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        _server.server_close()
+        app.logger.info("Server stopped after %.0fs", time.time() - start)
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+
+"""Client of several ezbbg servers.
+
+The service runs on several terminal PCs. `ShardedClient` spreads the
+queries across them:
+
+  - 'hash' strategy: each ticker always goes to the same host (consistent
+    hashing), so that the server-side caches stay warm. Losing a host only
+    moves its own tickers.
+  - 'least_outstanding' strategy: the tickers are split evenly and each part
+    goes to the hosts with the fewest queries in flight.
+
+The ticker lists are split per host and the parts are queried in parallel.
+Hosts which can't be reached are dropped from the rotation and probed
+through '/version/ws' until they recover.
+"""
+
+import time
+import bisect
+import hashlib
+import threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+import requests
+
+from ezbbg.ws import client as ws_client
+from ezbbg.ws import consolidate
+
+
+__author__ = ('eruiz070210', 'dgaraud111714')
+
+STRATEGIES = ('hash', 'least_outstanding')
+# Number of points of each host on the hash ring.
+VIRTUAL_NODES = 64
+# Seconds between two probes of a host which is down.
+DEFAULT_PROBE_INTERVAL = 30
+PROBE_TIMEOUT = 2
+# Errors for which a host is considered down. A read timeout isn't one: the
+# server may still be querying Bloomberg, the query isn't sent elsewhere.
+HOST_ERRORS = (requests.ConnectionError, requests.ConnectTimeout)
+# Errors of a stream cut in the middle, whose remaining tickers are streamed
+# from another host.
+STREAM_ERRORS = (requests.exceptions.ChunkedEncodingError,)
+
+
+def _hash(key):
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    return int(hashlib.md5(key).hexdigest()[:8], 16)
+
+
+class NoHostAvailable(requests.ConnectionError):
+    """Every host of the pool is down.
+    """
+
+
+class ShardedClient(object):
+    """Client of a pool of servers with the methods of `EzbbgClient`.
+
+    Parameters
+    ----------
+
+    hosts: list
+        Host names, or (host, port) pairs.
+    port: int
+        Port of the hosts given without one.
+    strategy: str
+        'hash' or 'least_outstanding'.
+    probe_interval: float
+        Seconds between two health checks of a host which is down.
+    client_kwargs:
+        Passed to the `EzbbgClient` of each host.
+    """
+
+    def __init__(self, hosts, port=ws_client.PORT, strategy='hash',
+                 probe_interval=DEFAULT_PROBE_INTERVAL, **client_kwargs):
+        if strategy not in STRATEGIES:
+            raise ValueError("Unknown strategy '{}'".format(strategy))
+        keys = [tuple(h) if isinstance(h, (list, tuple)) else (h, port)
+                for h in hosts]
+        if not keys:
+            raise ValueError("No host given")
+        self.strategy = strategy
+        self.probe_interval = probe_interval
+        self.clients = OrderedDict(
+            (key, ws_client.EzbbgClient(key[0], key[1], **client_kwargs))
+            for key in keys)
+        self.outstanding = dict.fromkeys(keys, 0)
+        # host -> time of the next probe
+        self.down = {}
+        ring = sorted((_hash("{0}:{1}#{2}".format(key[0], key[1], i)), key)
+                      for key in keys for i in range(VIRTUAL_NODES))
+        self._ring_hashes = [h for h, _ in ring]
+        self._ring_hosts = [key for _, key in ring]
+        self._lock = threading.Lock()
+        self._pool = ThreadPool(len(keys))
+
+    def __repr__(self):
+        return "<ShardedClient {}>".format(
+            ', '.join("{0}:{1}".format(*key) for key in self.clients))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._pool.close()
+        for client in self.clients.itervalues():
+            client.close()
+
+    def stats(self):
+        with self._lock:
+            return {"{0}:{1}".format(*key): {'outstanding': self.outstanding[key],
+                                             'down': key in self.down}
+                    for key in self.clients}
+
+    # region Host selection
+    def _probe(self, key):
+        try:
+            self.clients[key]._get(ws_client.URL_WS_VERSION, timeout=PROBE_TIMEOUT)
+        except (requests.RequestException, ValueError):
+            return False
+        return True
+
+    def healthy_hosts(self):
+        """Hosts in the rotation. The down hosts due for a probe are checked.
+        """
+        now = time.time()
+        with self._lock:
+            to_probe = [key for key, next_probe in self.down.iteritems()
+                        if next_probe <= now]
+            for key in to_probe:
+                self.down[key] = now + self.probe_interval
+        for key in to_probe:
+            if self._probe(key):
+                with self._lock:
+                    self.down.pop(key, None)
+        with self._lock:
+            healthy = [key for key in self.clients if key not in self.down]
+        if not healthy:
+            raise NoHostAvailable("No ezbbg server available among {}".format(self))
+        return healthy
+
+    def mark_down(self, key):
+        with self._lock:
+            self.down[key] = time.time() + self.probe_interval
+
+    def _least_outstanding(self, healthy):
+        with self._lock:
+            return min(healthy, key=lambda key: self.outstanding[key])
+
+    def _owner(self, ticker, healthy):
+        """Host of `ticker` on the hash ring, skipping the unhealthy ones.
+        """
+        start = bisect.bisect(self._ring_hashes, _hash(ticker))
+        size = len(self._ring_hosts)
+        for i in range(size):
+            key = self._ring_hosts[(start + i) % size]
+            if key in healthy:
+                return key
+
+    def _split(self, ticker_list, healthy):
+        """Split the tickers per host: {host: [tickers]}.
+        """
+        parts = OrderedDict()
+        if self.strategy == 'hash':
+            for ticker in ticker_list:
+                parts.setdefault(self._owner(ticker, healthy), []).append(ticker)
+            return parts
+        with self._lock:
+            hosts = sorted(healthy, key=lambda key: self.outstanding[key])
+        size = -(-len(ticker_list) // len(hosts))
+        for key, i in zip(hosts, range(0, len(ticker_list), size)):
+            parts[key] = ticker_list[i:i + size]
+        return parts
+    # endregion
+
+    def _call_host(self, key, name, *args, **kwargs):
+        with self._lock:
+            self.outstanding[key] += 1
+        try:
+            return getattr(self.clients[key], name)(*args, **kwargs)
+        except HOST_ERRORS:
+            self.mark_down(key)
+            raise
+        finally:
+            with self._lock:
+                self.outstanding[key] -= 1
+
+    def _call(self, name, *args, **kwargs):
+        """Call `name` on one host, trying the next ones if it's down.
+        """
+        while True:
+            healthy = self.healthy_hosts()
+            key = self._least_outstanding(healthy)
+            try:
+                return self._call_host(key, name, *args, **kwargs)
+            except HOST_ERRORS:
+                if len(healthy) == 1:
+                    raise
+
+    def _call_sharded(self, name, ticker_list, *args, **kwargs):
+        """Split `ticker_list` across the hosts, query them in parallel and
+        merge the results {ticker: data}.
+        """
+        ticker_list = list(ticker_list)
+        merged = {}
+        remaining = ticker_list
+        while remaining:
+            healthy = self.healthy_hosts()
+            parts = self._split(remaining, healthy)
+            pending = [(tickers, self._pool.apply_async(self._call_host,
+                                                        (key, name, tickers) + args,
+                                                        kwargs))
+                       for key, tickers in parts.iteritems()]
+            remaining = []
+            for tickers, result in pending:
+                try:
+                    merged.update(result.get() or {})
+                except HOST_ERRORS:
+                    if len(healthy) == 1:
+                        raise
+                    # Its host is now down: query these tickers elsewhere.
+                    remaining.extend(tickers)
+        return OrderedDict((ticker, merged[ticker]) for ticker in ticker_list
+                           if ticker in merged)
+
+    def get_reference_data(self, ticker_list, field_list, **kwargs):
+        return self._call_sharded('get_reference_data', ticker_list, field_list,
+                                  **kwargs)
+
+    def get_historical_data(self, ticker_list, field_list, start_date, end_date,
+                            **kwargs):
+        # The frames of the hosts are consolidated once merged.
+        layout = consolidate.pop_layout(kwargs)
+        data = self._call_sharded('get_historical_data', ticker_list, field_list,
+                                  start_date, end_date, **kwargs)
+        return consolidate.apply(data, layout)
+
+    def update_historical_data(self, ticker_list, field_list, start_date,
+                               end_date, data, **kwargs):
+        return self._call_sharded('update_historical_data', ticker_list,
+                                  field_list, start_date, end_date, data,
+                                  **kwargs)
+
+    def iter_historical_data(self, ticker_list, field_list, start_date, end_date,
+                             **kwargs):
+        """Stream the historical data from the host with the fewest queries
+        in flight, the stream counting as in flight until it's exhausted or
+        closed. If the host fails or the stream is cut, the tickers not
+        received yet are streamed from another one.
+        """
+        remaining = list(ticker_list)
+        # Hosts whose stream was cut.
+        cut = set()
+        while remaining:
+            healthy = [key for key in self.healthy_hosts() if key not in cut]
+            if not healthy:
+                raise NoHostAvailable("Stream cut by every ezbbg server")
+            key = self._least_outstanding(healthy)
+            with self._lock:
+                self.outstanding[key] += 1
+            try:
+                for ticker, frame in self.clients[key].iter_historical_data(
+                        list(remaining), field_list, start_date, end_date,
+                        **kwargs):
+                    remaining.remove(ticker)
+                    yield ticker, frame
+                return
+            except HOST_ERRORS:
+                self.mark_down(key)
+                if len(healthy) == 1:
+                    raise
+            except STREAM_ERRORS:
+                cut.add(key)
+                if len(healthy) == 1:
+                    raise
+            finally:
+                with self._lock:
+                    self.outstanding[key] -= 1
+
+    def ezbbg_server_version(self):
+        return self._call('ezbbg_server_version')
+
+    def service_version(self):
+        return self._call('service_version')
+
+    def get_fields_info(self, *args, **kwargs):
+        return self._call('get_fields_info', *args, **kwargs)
+
+    def search_fields(self, *args, **kwargs):
+        return self._call('search_fields', *args, **kwargs)
+
+    def search_fields_by_category(self, *args, **kwargs):
+        return self._call('search_fields_by_category', *args, **kwargs)
+
+    def get_and_chain_historical_data(self, *args, **kwargs):
+        return self._call('get_and_chain_historical_data', *args, **kwargs)
+
+    def batch(self, *args, **kwargs):
+        """`Batch` of the host with the fewest queries in flight.
+        """
+        key = self._least_outstanding(self.healthy_hosts())
+        return self.clients[key].batch(*args, **kwargs)
+
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+"""Synthetic Bloomberg backend.
+
+`StubBloomberg` has the query functions of `ezbbg.bloomberg` and returns
+deterministic data, after an artificial latency. It is the 'synthetic'
+backend of the server (see `backends`) and the data of the benchmarks.
+"""
+
+import time
+import zlib
+import threading
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+
+__author__ = ('eruiz070210', 'dgaraud111714')
+
+BULK_FIELDS = ('INDX_MEMBERS', 'DVD_HIST_ALL', 'BULK')
+CATEGORIES = ('Market Activity/Last', 'Market Activity/Open', 'Fundamentals',
+              'Descriptive', 'Ratings')
+FIELD_TYPES = ('Price', 'Real', 'Character', 'Date')
+
+
+def _seed(*keys):
+    # The same for str and unicode keys, as sent by the client or decoded
+    # from JSON by the server.
+    text = u'\x1f'.join(unicode(key) for key in keys)
+    return zlib.crc32(text.encode('utf-8')) & 0xffffffff
+
+
+class StubBloomberg(object):
+    """Deterministic stand-in of `ezbbg.bloomberg`.
+
+    Parameters
+    ----------
+
+    latency: float
+        Time in seconds taken by each query.
+    bulk_rows: int
+        Number of rows of the bulk fields.
+    fields_count: int
+        Size of the field dictionary.
+    roll_frequency: str
+        Frequency of the contracts of the chained histories.
+    """
+
+    name = 'synthetic'
+    version = 'synthetic'
+
+    def __init__(self, latency=0., bulk_rows=10, fields_count=2000,
+                 roll_frequency='Q'):
+        self.latency = latency
+        self.bulk_rows = bulk_rows
+        self.roll_frequency = roll_frequency
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.fields = {}
+        for i in range(fields_count):
+            mnemonic = 'FIELD_{:04d}'.format(i)
+            self.fields[mnemonic] = {
+                'id': 'ST{:04d}'.format(i),
+                'mnemonic': mnemonic,
+                'description': 'Synthetic field {} {}'.format(
+                    i, FIELD_TYPES[i % len(FIELD_TYPES)]),
+                'categoryName': [CATEGORIES[i % len(CATEGORIES)]],
+                'ftype': FIELD_TYPES[i % len(FIELD_TYPES)],
+                'documentation': 'Documentation of the synthetic field {}.'.format(i)}
+
+    def is_session_locked(self):
+        return False
+
+    def _query(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def _series(self, ticker, field, index):
+        """Values of (ticker, field) on the dates `index`, which don't depend
+        on the queried period.
+        """
+        rng = np.random.RandomState(_seed(ticker, field))
+        level = rng.uniform(10, 1000)
+        amplitude = rng.uniform(0.01, 0.2)
+        period = rng.uniform(20, 200)
+        days = index.asi8 // (86400 * 10 ** 9)
+        return level * (1 + amplitude * np.sin(days * 2 * np.pi / period))
+
+    def get_historical_data(self, ticker_list, field_list, start_date, end_date,
+                            **kwargs):
+        self._query()
+        index = pd.bdate_range(start_date, end_date, name='date')
+        return {ticker: pd.DataFrame({field: self._series(ticker, field, index)
+                                      for field in field_list},
+                                     index=index, columns=field_list)
+                for ticker in ticker_list}
+
+    def _bulk(self, ticker, field):
+        rng = np.random.RandomState(_seed(ticker, field))
+        rows = self.bulk_rows
+        return pd.DataFrame(
+            {'Member Ticker': ['MBR{} Equity'.format(i) for i in range(rows)],
+             'Weight': rng.uniform(0, 5, rows),
+             'Since': [dt.date(2000, 1, 1) + dt.timedelta(days=30 * i)
+                       for i in range(rows)]},
+            columns=['Member Ticker', 'Weight', 'Since'])
+
+    def _reference_value(self, ticker, field):
+        if field in BULK_FIELDS:
+            return self._bulk(ticker, field)
+        if field.endswith('NAME'):
+            return '{} {}'.format(ticker, field.lower())
+        if field.endswith('_DT') or field.endswith('DATE'):
+            return dt.date(2000, 1, 1) + dt.timedelta(days=_seed(ticker, field) % 7000)
+        return float(_seed(ticker, field) % 100000) / 100
+
+    def get_reference_data(self, ticker_list, field_list, **kwargs):
+        self._query()
+        return {ticker: {field: self._reference_value(ticker, field)
+                         for field in field_list}
+                for ticker in ticker_list}
+
+    def get_fields_info(self, field_list, return_field_documentation=True):
+        self._query()
+        return {field: self.fields[field] for field in field_list
+                if field in self.fields}
+
+    def search_fields(self, search_string, return_field_documentation=True,
+                      *filters):
+        self._query()
+        search_string = search_string.lower()
+        return {mnemonic: record for mnemonic, record in self.fields.iteritems()
+                if search_string in record['description'].lower()
+                or search_string in mnemonic.lower()}
+
+    def search_fields_by_category(self, search_string,
+                                  return_field_documentation=True, *filters):
+        by_category = {}
+        for mnemonic, record in self.search_fields(search_string).iteritems():
+            for category in record['categoryName']:
+                by_category.setdefault(category, {})[mnemonic] = record
+        return by_category
+
+    def get_and_chain_historical_data(self, tickers, fields, end_date,
+                                      start_date=None, tolerance_in_days=4):
+        """Histories of the generic `tickers`, chaining a contract per
+        period of `roll_frequency`.
+        """
+        self._query()
+        if start_date is None:
+            start_date = (end_date - pd.DateOffset(years=5)).date()
+        index = pd.bdate_range(start_date, end_date, name='date')
+        periods = pd.period_range(start_date, end_date, freq=self.roll_frequency)
+        info, data = {}, {}
+        for ticker in tickers:
+            info[ticker] = [{'ticker': '{} {}'.format(ticker, period),
+                             'chaining_start_date': max(period.start_time.date(),
+                                                        start_date)}
+                            for period in periods]
+            data[ticker] = pd.DataFrame({field: self._series(ticker, field, index)
+                                         for field in fields},
+                                        index=index, columns=fields)
+        return {'info': info, 'data': data}
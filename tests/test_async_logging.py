@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import unittest
+import Queue
+
+from ezbbg.ws import async_logging
+
+
+class ListHandler(logging.Handler):
+    def __init__(self, block=None):
+        logging.Handler.__init__(self)
+        self.block = block
+        self.messages = []
+
+    def emit(self, record):
+        if self.block is not None:
+            self.block.wait()
+        self.messages.append(self.format(record))
+
+
+class AsyncLoggingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('ezbbg.ws.tests.async_logging')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+
+    def test_written_by_listener(self):
+        handler = ListHandler()
+        handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+        self.logger.addHandler(handler)
+        listener = async_logging.install(self.logger)
+        body = {'ticker_list': ['A']}
+        self.logger.info("query: %s", body)
+        # Modified after the call, as the queries do.
+        body.pop('ticker_list')
+        try:
+            raise ValueError("bad field")
+        except ValueError:
+            self.logger.exception("failed")
+        listener.stop()
+        self.assertEqual(handler.messages[0], "INFO query: {'ticker_list': ['A']}")
+        self.assertIn("ValueError: bad field", handler.messages[1])
+        self.assertEqual(listener.stats()['written'], 2)
+
+    def test_full_queue(self):
+        block = threading.Event()
+        handler = ListHandler(block)
+        self.logger.addHandler(handler)
+        listener = async_logging.install(self.logger, queue_size=1)
+        for i in range(10):
+            self.logger.info("record %d", i)
+        block.set()
+        listener.stop()
+        self.assertGreater(listener.stats()['dropped'], 0)
+        self.assertEqual(len(handler.messages) + listener.stats()['dropped'], 10)
+
+    def test_summarize(self):
+        tickers = ['T{} Equity'.format(i) for i in range(1000)]
+        summary = async_logging.summarize({'ticker_list': tickers,
+                                           'field_list': ['PX_LAST']})
+        self.assertEqual(summary['field_list'], ['PX_LAST'])
+        self.assertEqual(summary['ticker_list'],
+                         u'<1000 items: T0 Equity, T1 Equity, T2 Equity, ...>')
+
+
+if __name__ == '__main__':
+    unittest.main()
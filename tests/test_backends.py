@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+import datetime as dt
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from ezbbg.ws import backends
+from ezbbg.ws.benchmarks.stub import StubBloomberg, installed
+from ezbbg.ws.benchmarks.runner import InProcessClient
+
+
+class RecordReplayTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.stub = StubBloomberg()
+        self.recorder = backends.Recorder(self.stub,
+                                          backends.RecordingStore(self.tmpdir))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def replay(self, latency=0.):
+        # A new store, as another process would read it.
+        return backends.Replay(backends.RecordingStore(self.tmpdir), latency)
+
+    def test_historical_data(self):
+        self.recorder.get_historical_data(['A', 'B'], ['PX_LAST'],
+                                          dt.date(2020, 1, 1), dt.date(2020, 6, 30))
+        self.recorder.get_historical_data(['A'], ['PX_OPEN'],
+                                          dt.date(2020, 1, 1), dt.date(2020, 3, 31))
+        replay = self.replay()
+        data = replay.get_historical_data(['A'], ['PX_LAST', 'PX_OPEN'],
+                                          dt.date(2020, 2, 1), dt.date(2020, 3, 31))
+        expected = self.stub.get_historical_data(['A'], ['PX_LAST', 'PX_OPEN'],
+                                                 dt.date(2020, 2, 1),
+                                                 dt.date(2020, 3, 31))
+        self.assertTrue(np.allclose(data['A'], expected['A']))
+        self.assertEqual(list(data['A'].index), list(expected['A'].index))
+        self.assertRaises(backends.ReplayMiss, replay.get_historical_data,
+                          ['B'], ['PX_OPEN'], dt.date(2020, 1, 1), dt.date(2020, 3, 31))
+        self.assertRaises(backends.ReplayMiss, replay.get_historical_data,
+                          ['A'], ['PX_LAST'], dt.date(2020, 1, 1),
+                          dt.date(2020, 3, 31), periodicity='WEEKLY')
+
+    def test_recorded_periods(self):
+        self.recorder.get_historical_data(['A'], ['PX_LAST', 'PX_OPEN'],
+                                          dt.date(2020, 1, 1), dt.date(2020, 3, 31))
+        replay = self.replay()
+        self.assertRaises(backends.ReplayMiss, replay.get_historical_data,
+                          ['A'], ['PX_LAST'], dt.date(2020, 7, 1), dt.date(2020, 7, 31))
+        self.assertRaises(backends.ReplayMiss, replay.get_historical_data,
+                          ['A'], ['PX_LAST'], dt.date(2020, 3, 1), dt.date(2020, 4, 30))
+        self.recorder.get_historical_data(['A'], ['PX_LAST'],
+                                          dt.date(2020, 4, 1), dt.date(2020, 6, 30))
+        self.recorder.get_historical_data(['A'], ['PX_LAST'],
+                                          dt.date(2020, 9, 1), dt.date(2020, 9, 30))
+        replay = self.replay()
+        data = replay.get_historical_data(['A'], ['PX_LAST'],
+                                          dt.date(2020, 3, 1), dt.date(2020, 4, 30))
+        self.assertEqual(len(data['A'].index),
+                         len(pd.bdate_range('2020-03-01', '2020-04-30')))
+        self.assertRaises(backends.ReplayMiss, replay.get_historical_data,
+                          ['A'], ['PX_LAST'], dt.date(2020, 6, 1), dt.date(2020, 9, 30))
+        # Recorded for another period only.
+        self.assertRaises(backends.ReplayMiss, replay.get_historical_data,
+                          ['A'], ['PX_LAST', 'PX_OPEN'], dt.date(2020, 9, 1),
+                          dt.date(2020, 9, 30))
+        self.assertEqual(replay.misses, 2)
+
+    def test_reference_data(self):
+        fields = ['PX_LAST', 'NAME', 'LAST_UPDATE_DT', 'INDX_MEMBERS']
+        recorded = self.recorder.get_reference_data(['A', 'B'], fields)
+        data = self.replay().get_reference_data(['B'], fields)
+        self.assertEqual(data['B']['PX_LAST'], recorded['B']['PX_LAST'])
+        self.assertEqual(data['B']['LAST_UPDATE_DT'], recorded['B']['LAST_UPDATE_DT'])
+        self.assertIsInstance(data['B']['LAST_UPDATE_DT'], dt.date)
+        self.assertTrue(data['B']['INDX_MEMBERS']['Weight'].equals(
+            recorded['B']['INDX_MEMBERS']['Weight']))
+
+    def test_other_queries(self):
+        recorded = self.recorder.search_fields('last')
+        self.recorder.get_fields_info(['FIELD_0001', 'UNKNOWN'])
+        replay = self.replay()
+        self.assertEqual(replay.search_fields('last'), recorded)
+        self.assertEqual(list(replay.get_fields_info(['FIELD_0001', 'UNKNOWN'])),
+                         ['FIELD_0001'])
+        self.assertRaises(backends.ReplayMiss, replay.search_fields, 'first')
+
+
+class BackendTestCase(unittest.TestCase):
+    def test_create(self):
+        self.assertIsInstance(backends.create('synthetic'), StubBloomberg)
+        live = backends.create('live')
+        self.assertEqual(live.name, 'live')
+        self.assertRaises(AttributeError, getattr, live, 'unknown')
+        self.assertRaises(ValueError, backends.create, 'dummy')
+
+    def test_served_by_replay(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            recorder = backends.Recorder(StubBloomberg(),
+                                         backends.RecordingStore(tmpdir))
+            args = (['A Equity', 'B Equity'], ['PX_LAST'],
+                    dt.date(2020, 1, 1), dt.date(2020, 3, 31))
+            with installed(recorder):
+                expected = InProcessClient().get_historical_data(*args)
+            with installed(backends.Replay(backends.RecordingStore(tmpdir))):
+                data = InProcessClient(wire_format='columnar').get_historical_data(*args)
+        finally:
+            shutil.rmtree(tmpdir)
+        for ticker, frame in expected.iteritems():
+            self.assertTrue(np.allclose(data[ticker], frame))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+import StringIO
+import unittest
+
+from ezbbg.ws.benchmarks import runner
+from ezbbg.ws.benchmarks.stub import StubBloomberg
+
+
+class StubBloombergTestCase(unittest.TestCase):
+    def test_deterministic(self):
+        stub = StubBloomberg()
+        full = stub.get_historical_data(['A Equity'], ['PX_LAST'],
+                                        '2020-01-01', '2020-03-31')['A Equity']
+        part = stub.get_historical_data(['A Equity'], ['PX_LAST'],
+                                        '2020-02-01', '2020-02-29')['A Equity']
+        self.assertTrue((full.loc[part.index] == part).all().all())
+        data = stub.get_reference_data(['A Equity'], ['NAME', 'INDX_MEMBERS'])
+        self.assertEqual(len(data['A Equity']['INDX_MEMBERS']), stub.bulk_rows)
+
+
+class BenchmarkRunTestCase(unittest.TestCase):
+    def test_every_scenario(self):
+        config = runner.parse_args(['--modes', 'test_client', '--tickers', '3',
+                                    '--days', '30', '--requests', '2',
+                                    '--concurrency', '2', '--codec-repeat', '1',
+                                    '--coalesce-window', '0'])
+        results = runner.run(config, out=StringIO.StringIO())
+        self.assertEqual(len(results['queries']),
+                         len(runner.SCENARIOS) * len(config.formats))
+        for result in results['queries']:
+            self.assertGreater(result['throughput'], 0)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        self.assertEqual(len(results['codecs']),
+                         len(runner.CODECS) * len(config.formats))
+
+
+if __name__ == '__main__':
+    unittest.main()
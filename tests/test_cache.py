@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+from datetime import date
+import unittest
+
+import pandas as pd
+
+from ezbbg.ws.cache import HistoricalDataCache, missing_ranges
+
+
+def fake_historical_data(calls):
+    def fetch(ticker_list, field_list, start_date, end_date, **kwargs):
+        calls.append((list(ticker_list), list(field_list), start_date, end_date))
+        index = pd.date_range(start_date, end_date, name='date')
+        return {ticker: pd.DataFrame({field: range(len(index)) for field in field_list},
+                                     index=index, dtype=float)
+                for ticker in ticker_list}
+    return fetch
+
+
+class MissingRangesTestCase(unittest.TestCase):
+    def test_nothing_covered(self):
+        start, end = pd.Timestamp('2014-01-01'), pd.Timestamp('2014-02-01')
+        self.assertEqual([(start, end)], missing_ranges(None, start, end))
+
+    def test_head_and_tail(self):
+        covered = (pd.Timestamp('2014-01-10'), pd.Timestamp('2014-01-20'))
+        ranges = missing_ranges(covered, pd.Timestamp('2014-01-01'), pd.Timestamp('2014-01-31'))
+        self.assertEqual([(pd.Timestamp('2014-01-01'), pd.Timestamp('2014-01-09')),
+                          (pd.Timestamp('2014-01-21'), pd.Timestamp('2014-01-31'))],
+                         ranges)
+
+    def test_fully_covered(self):
+        covered = (pd.Timestamp('2014-01-01'), pd.Timestamp('2014-01-31'))
+        self.assertEqual([], missing_ranges(covered, pd.Timestamp('2014-01-10'),
+                                            pd.Timestamp('2014-01-20')))
+
+
+class HistoricalDataCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.fetch = fake_historical_data(self.calls)
+
+    def test_only_gaps_are_fetched(self):
+        cache = HistoricalDataCache()
+        cache.get_historical_data(self.fetch, ['SX5E Index'], ['PX_LAST'],
+                                  date(2014, 1, 10), date(2014, 1, 20))
+        data = cache.get_historical_data(self.fetch, ['SX5E Index'], ['PX_LAST'],
+                                         date(2014, 1, 1), date(2014, 1, 31))
+        self.assertEqual(3, len(self.calls))
+        self.assertEqual((date(2014, 1, 1), date(2014, 1, 9)), self.calls[1][2:])
+        self.assertEqual((date(2014, 1, 21), date(2014, 1, 31)), self.calls[2][2:])
+        frame = data['SX5E Index']
+        self.assertEqual(31, len(frame))
+        self.assertTrue(frame.index.is_monotonic_increasing)
+        # Fully cached
+        cache.get_historical_data(self.fetch, ['SX5E Index'], ['PX_LAST'],
+                                  date(2014, 1, 5), date(2014, 1, 25))
+        self.assertEqual(3, len(self.calls))
+
+    def test_options_are_part_of_the_key(self):
+        cache = HistoricalDataCache()
+        args = (['SX5E Index'], ['PX_LAST'], date(2014, 1, 1), date(2014, 1, 31))
+        cache.get_historical_data(self.fetch, *args)
+        cache.get_historical_data(self.fetch, *args, periodicity='WEEKLY')
+        self.assertEqual(2, len(self.calls))
+
+    def test_no_data(self):
+        fetch = self.fetch
+
+        def fetch_without_spx(ticker_list, *args, **kwargs):
+            data = fetch(ticker_list, *args, **kwargs)
+            data.pop('SPX Index', None)
+            return data
+
+        cache = HistoricalDataCache()
+        args = (['SX5E Index', 'SPX Index'], ['PX_LAST'],
+                date(2014, 1, 1), date(2014, 1, 31))
+        data = cache.get_historical_data(fetch_without_spx, *args)
+        self.assertEqual(['SX5E Index'], list(data))
+        data = cache.get_historical_data(fetch_without_spx, *args)
+        self.assertEqual(['SX5E Index'], list(data))
+        self.assertEqual(1, len(self.calls))
+
+    def test_eviction(self):
+        cache = HistoricalDataCache(max_cells=40)
+        cache.get_historical_data(self.fetch, ['SX5E Index'], ['PX_LAST'],
+                                  date(2014, 1, 1), date(2014, 1, 31))
+        cache.get_historical_data(self.fetch, ['SPX Index'], ['PX_LAST'],
+                                  date(2014, 1, 1), date(2014, 1, 31))
+        self.assertEqual(1, len(cache))
+        self.assertEqual(31, cache.cells)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import datetime as dt
+import unittest
+
+from ezbbg.ws.chaining import ChainCache
+from ezbbg.ws.benchmarks.stub import StubBloomberg
+
+
+class ChainCacheTestCase(unittest.TestCase):
+    tickers = ['CL1 Comdty', 'CO1 Comdty']
+    fields = ['PX_LAST']
+
+    def setUp(self):
+        self.stub = StubBloomberg()
+        self.calls = []
+        self.adjust = 0.
+        self.cache = ChainCache(self.chain)
+
+    def chain(self, tickers, fields, end_date, start_date, tolerance_in_days):
+        self.calls.append((list(tickers), start_date, end_date))
+        result = self.stub.get_and_chain_historical_data(tickers, fields, end_date,
+                                                         start_date,
+                                                         tolerance_in_days)
+        for data in result['data'].values():
+            data += self.adjust
+        return result
+
+    def query(self, start_date, end_date, tickers=None):
+        return self.cache.get_and_chain_historical_data(tickers or self.tickers,
+                                                        self.fields, end_date,
+                                                        start_date)
+
+    def assert_chain_equal(self, result, expected):
+        self.assertEqual(result['info'], expected['info'])
+        for ticker, data in expected['data'].items():
+            self.assertTrue(result['data'][ticker].equals(data))
+
+    def test_hit(self):
+        first = self.query(dt.date(2015, 1, 1), dt.date(2020, 6, 30))
+        second = self.query(dt.date(2015, 1, 1), dt.date(2020, 3, 31))
+        self.assertEqual(len(self.calls), 1)
+        expected = self.stub.get_and_chain_historical_data(
+            self.tickers, self.fields, dt.date(2020, 3, 31), dt.date(2015, 1, 1))
+        self.assert_chain_equal(second, expected)
+        self.assertEqual(len(first['info']['CL1 Comdty']), 22)
+
+    def test_extension(self):
+        self.query(dt.date(2015, 1, 1), dt.date(2020, 5, 29))
+        result = self.query(dt.date(2015, 1, 1), dt.date(2020, 8, 31))
+        # Only the tail is computed again, from the last roll point.
+        self.assertEqual(self.calls[1], (self.tickers, dt.date(2020, 4, 1),
+                                         dt.date(2020, 8, 31)))
+        expected = self.stub.get_and_chain_historical_data(
+            self.tickers, self.fields, dt.date(2020, 8, 31), dt.date(2015, 1, 1))
+        self.assert_chain_equal(result, expected)
+        self.assertEqual(self.cache.stats()['extensions'], 2)
+
+    def test_moving_window(self):
+        self.query(dt.date(2015, 5, 15), dt.date(2020, 5, 15))
+        result = self.query(dt.date(2015, 5, 18), dt.date(2020, 5, 18))
+        self.assertEqual(len(self.calls), 2)
+        expected = self.stub.get_and_chain_historical_data(
+            self.tickers, self.fields, dt.date(2020, 5, 18), dt.date(2015, 5, 18))
+        self.assert_chain_equal(result, expected)
+
+    def test_adjusted_history(self):
+        self.query(dt.date(2015, 1, 1), dt.date(2020, 5, 29))
+        # The tail doesn't match the cached history any more.
+        self.adjust = 1.
+        result = self.query(dt.date(2015, 1, 1), dt.date(2020, 8, 31))
+        self.assertEqual([call[1] for call in self.calls],
+                         [dt.date(2015, 1, 1), dt.date(2020, 4, 1),
+                          dt.date(2015, 1, 1)])
+        self.assertEqual(result['data']['CL1 Comdty'].index[0], dt.datetime(2015, 1, 1))
+        self.assertEqual(self.cache.stats()['misses'], 4)
+
+    def test_earlier_start(self):
+        self.query(dt.date(2018, 1, 1), dt.date(2020, 5, 29))
+        self.query(dt.date(2017, 1, 1), dt.date(2020, 5, 29), ['CL1 Comdty'])
+        self.assertEqual(self.calls[1], (['CL1 Comdty'], dt.date(2017, 1, 1),
+                                         dt.date(2020, 5, 29)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import datetime as dt
+import unittest
+
+import numpy as np
+
+from ezbbg.ws import client as ws_client
+from ezbbg.ws.benchmarks.stub import StubBloomberg, installed
+from ezbbg.ws.benchmarks.runner import InProcessClient, http_server
+
+
+class LegacyServerClient(InProcessClient):
+    """Client of a server which ignores the Accept header, i.e. only
+    answers in JSON.
+    """
+
+    def _get(self, url, request=None, timeout=None, headers=None,
+             stream=False):
+        headers = {key: value for key, value in (headers or {}).iteritems()
+                   if key != 'Accept'}
+        return InProcessClient._get(self, url, request, timeout, headers, stream)
+
+
+class EzbbgClientTestCase(unittest.TestCase):
+    def test_session_reuse(self):
+        with installed(StubBloomberg()), http_server(ssl=False) as port:
+            with ws_client.EzbbgClient('localhost', port, scheme='http') as client:
+                session = client.session
+                for _ in range(3):
+                    client.get_reference_data(['A'], ['PX_LAST'])
+                    client.get_fields_info(['FIELD_0001'])
+                self.assertIs(client.session, session)
+                pool = client.session.get_adapter('http://').poolmanager \
+                    .connection_from_url('http://localhost:{}'.format(port))
+                self.assertEqual(pool.num_connections, 1)
+                self.assertEqual(pool.num_requests, 6)
+
+    def test_retry_settings(self):
+        client = ws_client.EzbbgClient(pool_size=4, max_retries=5,
+                                       backoff_factor=0.1)
+        for scheme in ('http://', 'https://'):
+            adapter = client.session.get_adapter(scheme)
+            retry = adapter.max_retries
+            self.assertEqual(retry.total, 5)
+            # Only connection errors and the forced statuses are retried.
+            self.assertEqual(retry.read, 0)
+            self.assertEqual(set(retry.status_forcelist), set(ws_client.RETRY_STATUS))
+            self.assertEqual(retry.backoff_factor, 0.1)
+            self.assertEqual(adapter._pool_maxsize, 4)
+
+    def test_timeouts(self):
+        timeouts = []
+
+        class Client(InProcessClient):
+            def _get(self, url, request=None, timeout=None, *args, **kwargs):
+                timeouts.append(timeout)
+                return InProcessClient._get(self, url, request, timeout,
+                                            *args, **kwargs)
+
+        with installed(StubBloomberg()):
+            client = Client()
+            client.get_reference_data(['A'], ['PX_LAST'])
+            client.get_reference_data(['A'], ['PX_LAST'], timeout=2)
+            Client(timeout=5).get_fields_info(['FIELD_0001'])
+        self.assertEqual(timeouts, [ws_client.DEFAULT_TIMEOUT, 2, 5])
+
+    def test_wire_format_fallback(self):
+        self.assertRaises(ValueError, ws_client.EzbbgClient, wire_format='xml')
+        args = (['A', 'B'], ['PX_LAST'], dt.date(2020, 1, 1), dt.date(2020, 3, 31))
+        fields = ['PX_LAST', 'NAME', 'LAST_UPDATE_DT']
+        with installed(StubBloomberg()):
+            expected = InProcessClient(wire_format='columnar')
+            legacy = LegacyServerClient(wire_format='columnar')
+            historical = legacy.get_historical_data(*args)
+            reference = legacy.get_reference_data(['A'], fields)
+            self.assertEqual(reference, expected.get_reference_data(['A'], fields))
+            for ticker, frame in expected.get_historical_data(*args).iteritems():
+                self.assertTrue(np.allclose(historical[ticker], frame))
+
+
+if __name__ == '__main__':
+    unittest.main()
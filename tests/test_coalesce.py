@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+import unittest
+
+from ezbbg.ws.coalesce import Coalescer
+
+
+class CoalescerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+
+    def fetch(self, ticker_list, field_list, **kwargs):
+        self.calls.append(list(ticker_list))
+        time.sleep(0.05)
+        return {ticker: {field: ticker + field for field in field_list}
+                for ticker in ticker_list}
+
+    def query_all(self, coalescer, queries):
+        results = [None] * len(queries)
+
+        def query(i, ticker_list, field_list):
+            results[i] = coalescer(ticker_list, field_list)
+        threads = [threading.Thread(target=query, args=(i,) + q)
+                   for i, q in enumerate(queries)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_merge_tickers(self):
+        coalescer = Coalescer(self.fetch, window=0.05)
+        first = threading.Thread(target=coalescer, args=(['DAX Index'], ['PX_LAST']))
+        first.start()
+        while not self.calls:
+            time.sleep(0.001)
+        # Collected while the first query is running.
+        results = self.query_all(coalescer, [(['SX5E Index'], ['PX_LAST']),
+                                             (['SPX Index'], ['PX_LAST'])])
+        first.join()
+        self.assertEqual(2, len(self.calls))
+        self.assertEqual(set(['SX5E Index', 'SPX Index']), set(self.calls[1]))
+        self.assertEqual(['SX5E Index'], list(results[0]))
+        self.assertEqual(['SPX Index'], list(results[1]))
+
+    def test_no_wait_when_idle(self):
+        coalescer = Coalescer(self.fetch, window=1)
+        start = time.time()
+        coalescer(['SX5E Index'], ['PX_LAST'])
+        self.assertLess(time.time() - start, 0.5)
+
+    def test_different_fields_are_not_merged(self):
+        coalescer = Coalescer(self.fetch, window=0.05)
+        self.query_all(coalescer, [(['SX5E Index'], ['PX_LAST']),
+                                   (['SX5E Index'], ['PX_OPEN'])])
+        self.assertEqual(2, len(self.calls))
+
+    def test_errors_are_raised_for_every_caller(self):
+        def fetch(ticker_list, field_list):
+            raise ValueError(ticker_list)
+        coalescer = Coalescer(fetch, window=0)
+        with self.assertRaises(ValueError):
+            coalescer(['SX5E Index'], ['PX_LAST'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import zlib
+import unittest
+
+from flask import Response
+
+from ezbbg.ws import compression
+from ezbbg.ws.server import app, _compress_response
+
+
+class CompressionTestCase(unittest.TestCase):
+    data = b'{"date": "2016-01-04", "PX_LAST": 1.5}\n' * 200
+
+    def test_choose_encoding(self):
+        choose = compression.choose_encoding
+        self.assertEqual(choose('gzip, deflate', ['zstd', 'gzip']), 'gzip')
+        self.assertEqual(choose('gzip, zstd', ['zstd', 'gzip']), 'zstd')
+        self.assertEqual(choose('zstd;q=0.5, gzip', ['zstd', 'gzip']), 'gzip')
+        self.assertEqual(choose('*', ['zstd', 'gzip']), 'zstd')
+        self.assertEqual(choose('gzip;q=0, identity', ['gzip']), None)
+        self.assertEqual(choose(None, ['gzip']), None)
+
+    def test_roundtrip(self):
+        for encoding in compression.available_encodings():
+            compressed = compression.compress(self.data, encoding)
+            self.assertLess(len(compressed), len(self.data) / 10)
+            self.assertEqual(compression.decompress(compressed, encoding),
+                             self.data)
+
+    def test_stream(self):
+        lines = self.data.splitlines(True)
+        for encoding in compression.available_encodings():
+            chunks = list(compression.compress_stream(lines, encoding))
+            self.assertEqual(compression.decompress(b''.join(chunks), encoding),
+                             self.data)
+        # Each gzip chunk is flushed, and decodable as soon as received.
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunks = compression.compress_stream(lines, compression.GZIP)
+        self.assertEqual(decompressor.decompress(next(chunks)), lines[0])
+
+
+class CompressResponseTestCase(unittest.TestCase):
+    def compress(self, response, accept_encoding='gzip'):
+        with app.test_request_context(headers={'Accept-Encoding': accept_encoding}):
+            return _compress_response(response)
+
+    def test_large_response(self):
+        data = b'{"PX_LAST": 1.5}' * 200
+        response = self.compress(Response(data))
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(compression.decompress(response.get_data(), 'gzip'), data)
+        self.assertEqual(int(response.headers['Content-Length']),
+                         len(response.get_data()))
+
+    def test_not_compressed(self):
+        response = self.compress(Response(b'{"PX_LAST": 1.5}'))
+        self.assertNotIn('Content-Encoding', response.headers)
+        response = self.compress(Response(b'{"PX_LAST": 1.5}' * 200), 'identity')
+        self.assertNotIn('Content-Encoding', response.headers)
+        response = self.compress(Response(b'Error' * 500, status=500))
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_streamed_response(self):
+        lines = [b'{"ticker": "%d"}\n' % i for i in range(10)]
+        response = self.compress(Response(iter(lines)))
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(compression.decompress(b''.join(response.response), 'gzip'),
+                         b''.join(lines))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import datetime as dt
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from ezbbg.ws import consolidate
+from ezbbg.ws import parallel
+from ezbbg.ws.benchmarks.stub import StubBloomberg, installed
+from ezbbg.ws.benchmarks.runner import InProcessClient
+
+
+def _frame(dates, **columns):
+    index = pd.DatetimeIndex(dates, name='date')
+    return pd.DataFrame(columns, index=index, columns=sorted(columns))
+
+
+class ConsolidateTestCase(unittest.TestCase):
+    def setUp(self):
+        # Unsorted tickers and rows, 'B' without PX_VOLUME.
+        self.data = {'B': _frame(['2020-01-03', '2020-01-02'], PX_LAST=[4., 3.]),
+                     'A': _frame(['2020-01-02', '2020-01-06'],
+                                 PX_LAST=[1., 2.], PX_VOLUME=[10, 20]),
+                     'C': pd.DataFrame()}
+
+    def test_panel(self):
+        frame = consolidate.panel(self.data)
+        self.assertEqual(list(frame.index),
+                         [(pd.Timestamp('2020-01-02'), 'A'),
+                          (pd.Timestamp('2020-01-02'), 'B'),
+                          (pd.Timestamp('2020-01-03'), 'B'),
+                          (pd.Timestamp('2020-01-06'), 'A')])
+        self.assertEqual(list(frame['PX_LAST']), [1., 3., 4., 2.])
+        self.assertTrue(np.isnan(frame['PX_VOLUME'].iloc[1]))
+        self.assertTrue(frame.xs('A', level='ticker').equals(
+            self.data['A'].astype(float)))
+        self.assertEqual(frame.reset_index()['ticker'].dtype.name, 'category')
+
+    def test_float32(self):
+        frame = consolidate.panel(self.data, dtype=np.float32, categorical=False)
+        self.assertEqual(frame['PX_LAST'].dtype, np.float32)
+        self.assertEqual(frame.reset_index()['ticker'].dtype, object)
+
+    def test_cube(self):
+        cube = consolidate.cube(self.data, dtype=np.float32)
+        self.assertEqual(cube.values.shape, (3, 2, 2))
+        self.assertEqual(cube.values.dtype, np.float32)
+        self.assertEqual(list(cube.tickers), ['A', 'B'])
+        self.assertEqual(list(cube.fields), ['PX_LAST', 'PX_VOLUME'])
+        np.testing.assert_array_equal(cube.values[:, :, 0],
+                                      [[1., 3.], [np.nan, 4.], [2., np.nan]])
+        self.assertRaises(ValueError, consolidate.cube,
+                          {'A': _frame(['2020-01-02'], NAME=['a'])})
+
+    def test_pop_layout(self):
+        kwargs = {'layout': 'frames', 'dtype': 'float32', 'periodicity': 'DAILY'}
+        self.assertIsNone(consolidate.pop_layout(kwargs))
+        self.assertEqual(kwargs, {'periodicity': 'DAILY'})
+        self.assertRaises(ValueError, consolidate.pop_layout, {'layout': 'wide'})
+        self.assertRaises(ValueError, consolidate.pop_layout,
+                          {'layout': 'cube', 'dtype': 'int32'})
+
+
+class ClientLayoutTestCase(unittest.TestCase):
+    tickers = ['B Equity', 'A Equity']
+    fields = ['PX_LAST', 'PX_OPEN']
+
+    def query(self, wire_format, **kwargs):
+        with installed(StubBloomberg()):
+            client = InProcessClient(wire_format=wire_format)
+            return client.get_historical_data(self.tickers, self.fields,
+                                              dt.date(2020, 1, 1),
+                                              dt.date(2020, 3, 31), **kwargs)
+
+    def test_layouts(self):
+        for wire_format in ('json', 'columnar'):
+            frames = self.query(wire_format)
+            panel = self.query(wire_format, layout='panel')
+            for ticker in self.tickers:
+                self.assertTrue(np.allclose(panel.xs(ticker, level='ticker'),
+                                            frames[ticker]))
+            cube = self.query(wire_format, layout='cube', dtype='float32')
+            self.assertEqual(cube.values.shape,
+                             (len(panel.index.levels[0]), 2, 2))
+            self.assertTrue(np.allclose(cube.values[:, 1, :],
+                                        frames['B Equity'].reindex(cube.dates)))
+
+    def test_fan_out(self):
+        frames = self.query('json')
+        args = (self.tickers, self.fields, dt.date(2020, 1, 1), dt.date(2020, 3, 31))
+        with installed(StubBloomberg()):
+            gathered = parallel.gather_historical(*args, chunk_size=1,
+                                                  client=InProcessClient(),
+                                                  layout='panel')
+            planned = parallel.planned_historical(*args, max_cells=50,
+                                                  client=InProcessClient(),
+                                                  layout='cube')
+        for ticker in self.tickers:
+            self.assertTrue(np.allclose(gathered.xs(ticker, level='ticker'),
+                                        frames[ticker]))
+        self.assertEqual(list(planned.tickers), sorted(self.tickers))
+        self.assertTrue(np.allclose(planned.values[:, 1, :],
+                                    frames['B Equity'].reindex(planned.dates)))
+
+
+if __name__ == '__main__':
+    unittest.main()
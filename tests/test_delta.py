@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import datetime as dt
+import unittest
+
+import pandas as pd
+
+from ezbbg.ws import delta
+from ezbbg.ws import server
+from ezbbg.ws.benchmarks.stub import StubBloomberg, installed
+from ezbbg.ws.benchmarks.runner import InProcessClient
+
+
+def _frame(values, start='2020-01-01'):
+    index = pd.bdate_range(start, periods=len(values), name='date')
+    return pd.DataFrame({'PX_LAST': values}, index=index)
+
+
+class DigestTestCase(unittest.TestCase):
+    def test_canonical(self):
+        frame = _frame([1.0, 2.5, 3.0])
+        same = _frame([1, 2.500000000001, 3])
+        self.assertEqual(delta.frame_digest(frame), delta.frame_digest(same))
+        self.assertNotEqual(delta.frame_digest(frame),
+                            delta.frame_digest(_frame([1.0, 2.5, 3.1])))
+        json_frame = pd.read_json(frame.to_json(date_format='iso'))
+        self.assertEqual(delta.frame_digest(frame), delta.frame_digest(json_frame))
+
+    def test_diff_and_merge(self):
+        server_data = {'A': _frame([1., 2., 3., 4.]), 'B': _frame([5., 6., 7.]),
+                       'C': _frame([8.])}
+        client_data = {'A': _frame([1., 2.]), 'B': _frame([5., 0.])}
+        held = delta.held_state(client_data, dt.date(2020, 1, 1),
+                                dt.date(2020, 12, 31))
+        rows, replaced = delta.diff(server_data, held)
+        self.assertEqual(len(rows['A']), 2)
+        self.assertEqual(sorted(replaced), ['B', 'C'])
+        held_a = client_data['A']
+        changed = delta.merge(client_data, rows, replaced)
+        self.assertEqual(changed, ['A', 'B', 'C'])
+        # Updated in place.
+        self.assertIs(client_data['A'], held_a)
+        self.assertEqual(client_data['A'].index.name, 'date')
+        for ticker, frame in server_data.items():
+            self.assertTrue(client_data[ticker].equals(frame))
+
+
+class UpdateHistoricalDataTestCase(unittest.TestCase):
+    tickers = ['A Equity', 'B Equity']
+    fields = ['PX_LAST', 'PX_OPEN']
+
+    def update(self, wire_format):
+        stub = StubBloomberg()
+        with installed(stub):
+            client = InProcessClient(wire_format=wire_format)
+            data = client.get_historical_data(self.tickers, self.fields,
+                                              dt.date(2019, 1, 1),
+                                              dt.date(2020, 6, 30))
+            unchanged = client.update_historical_data(self.tickers, self.fields,
+                                                      dt.date(2019, 1, 1),
+                                                      dt.date(2020, 6, 30), data)
+            self.assertEqual(unchanged, {})
+            held = dict(data)
+            changed = client.update_historical_data(self.tickers, self.fields,
+                                                    dt.date(2019, 1, 1),
+                                                    dt.date(2020, 9, 30), data)
+            self.assertEqual(sorted(changed), self.tickers)
+            expected = stub.get_historical_data(self.tickers, self.fields,
+                                                dt.date(2019, 1, 1),
+                                                dt.date(2020, 9, 30))
+        for ticker in self.tickers:
+            self.assertIs(data[ticker], held[ticker])
+            self.assertEqual(list(data[ticker].index), list(expected[ticker].index))
+            self.assertEqual(delta.frame_digest(data[ticker]),
+                             delta.frame_digest(expected[ticker]))
+
+    def test_json(self):
+        self.update('json')
+
+    def test_columnar(self):
+        self.update('columnar')
+
+
+if __name__ == '__main__':
+    unittest.main()
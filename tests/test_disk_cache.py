@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+from datetime import date
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from ezbbg.ws.disk_cache import DiskCache
+
+
+def fake_historical_data(calls):
+    def fetch(ticker_list, field_list, start_date, end_date, **kwargs):
+        calls.append((list(ticker_list), list(field_list), start_date, end_date))
+        index = pd.date_range(start_date, end_date, name='date')
+        return {ticker: pd.DataFrame({field: index.day for field in field_list},
+                                     index=index, dtype=float)
+                for ticker in ticker_list}
+    return fetch
+
+
+class DiskCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.calls = []
+        self.fetch = fake_historical_data(self.calls)
+        self.cache = DiskCache(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def query(self, cache, start, end, tickers=('A', 'B'), **kwargs):
+        return cache.get_historical_data(self.fetch, list(tickers),
+                                         ['PX_LAST', 'PX_OPEN'], start, end,
+                                         **kwargs)
+
+    def test_persistent(self):
+        first = self.query(self.cache, date(2014, 1, 1), date(2014, 3, 31))
+        # Another process using the same directory.
+        data = self.query(DiskCache(self.path), date(2014, 2, 1), date(2014, 2, 28))
+        self.assertEqual(len(self.calls), 1)
+        self.assertTrue(data['A'].equals(first['A'].loc['2014-02-01':'2014-02-28']))
+        self.assertEqual(list(data['B'].columns), ['PX_LAST', 'PX_OPEN'])
+
+    def test_memory_mapped(self):
+        self.query(self.cache, date(2014, 1, 1), date(2014, 3, 31))
+        meta = self.cache._read_meta(self.cache._name(['A', 'PX_LAST', '{}']))
+        series = self.cache._load(self.cache._name(['A', 'PX_LAST', '{}']), meta)
+        self.assertIsInstance(series.values, np.memmap)
+
+    def test_tail_appended(self):
+        self.query(self.cache, date(2014, 1, 1), date(2014, 1, 31))
+        data = self.query(self.cache, date(2014, 1, 1), date(2014, 2, 28))
+        self.assertEqual(self.calls[1][2:], (date(2014, 2, 1), date(2014, 2, 28)))
+        self.assertEqual(len(data['A']), 59)
+        # The previous versions of the files are removed.
+        self.assertEqual(len([f for f in os.listdir(self.path) if f.endswith('.npy')]), 8)
+
+    def test_no_data(self):
+        fetch = self.fetch
+
+        def fetch_without_c(ticker_list, *args, **kwargs):
+            data = fetch(ticker_list, *args, **kwargs)
+            data.pop('C', None)
+            return data
+
+        self.fetch = fetch_without_c
+        data = self.query(self.cache, date(2014, 1, 1), date(2014, 1, 31),
+                          tickers=('A', 'C'))
+        self.assertEqual(list(data), ['A'])
+        data = self.query(DiskCache(self.path), date(2014, 1, 1),
+                          date(2014, 1, 31), tickers=('A', 'C'))
+        self.assertEqual(list(data), ['A'])
+        self.assertEqual(len(self.calls), 1)
+
+    def test_options(self):
+        self.query(self.cache, date(2014, 1, 1), date(2014, 1, 31))
+        self.query(self.cache, date(2014, 1, 1), date(2014, 1, 31), periodicity='WEEKLY')
+        self.assertEqual(len(self.calls), 2)
+
+    def test_max_age(self):
+        cache = DiskCache(self.path, max_age=0)
+        self.query(cache, date(2014, 1, 1), date(2014, 1, 31))
+        self.query(cache, date(2014, 1, 1), date(2014, 1, 31))
+        self.assertEqual(len(self.calls), 2)
+
+    def test_max_bytes(self):
+        self.query(self.cache, date(2014, 1, 1), date(2014, 12, 31))
+        size = self.cache.stats()['bytes']
+        cache = DiskCache(self.path, max_bytes=size)
+        self.query(cache, date(2014, 1, 1), date(2014, 12, 31), tickers=['C'])
+        stats = cache.stats()
+        self.assertLessEqual(stats['bytes'], size)
+        self.assertEqual(stats['series'], 4)
+
+    def test_least_recently_used(self):
+        self.query(self.cache, date(2014, 1, 1), date(2014, 12, 31), tickers=['A'])
+        size = self.cache.stats()['bytes']
+        cache = DiskCache(self.path, max_bytes=2 * size)
+        self.query(cache, date(2014, 1, 1), date(2014, 12, 31), tickers=['B'])
+        self.query(cache, date(2014, 1, 1), date(2014, 12, 31), tickers=['A'])
+        self.query(cache, date(2014, 1, 1), date(2014, 12, 31), tickers=['C'])
+        del self.calls[:]
+        self.query(cache, date(2014, 1, 1), date(2014, 12, 31), tickers=['A', 'B', 'C'])
+        self.assertEqual([call[0] for call in self.calls], [['B']])
+
+    def test_index(self):
+        self.query(self.cache, date(2014, 1, 1), date(2014, 1, 31))
+        cache = DiskCache(self.path)
+
+        def scan():
+            raise AssertionError("metadata files scanned")
+
+        # Only the index file is read while the cache isn't full.
+        self.cache._metas = cache._metas = scan
+        self.query(cache, date(2014, 1, 1), date(2014, 1, 31), tickers=['C'])
+        self.query(self.cache, date(2014, 1, 1), date(2014, 2, 28))
+        self.assertEqual(self.cache.stats()['series'], 6)
+        self.assertEqual(len(self.calls), 3)
+
+    def test_index_rebuilt(self):
+        self.query(self.cache, date(2014, 1, 1), date(2014, 1, 31))
+        os.remove(os.path.join(self.path, 'cache.index'))
+        stats = DiskCache(self.path).stats()
+        self.assertEqual(stats['series'], 4)
+        self.assertEqual(stats['bytes'], self.cache.stats()['bytes'])
+
+
+if __name__ == '__main__':
+    unittest.main()
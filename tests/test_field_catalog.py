@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+from ezbbg.ws.field_catalog import FieldCatalog
+
+
+FIELDS = {
+    'PX_LAST': {'mnemonic': 'PX_LAST', 'description': 'Last Price',
+                'categoryName': ['Market Activity/Last'], 'ftype': 'Price',
+                'documentation': 'Last price of the security.'},
+    'PX_OPEN': {'mnemonic': 'PX_OPEN', 'description': 'Open Price',
+                'categoryName': ['Market Activity/Open'], 'ftype': 'Price',
+                'documentation': 'Open price of the security.'},
+    'NAME': {'mnemonic': 'NAME', 'description': 'Name',
+             'categoryName': ['Descriptive'], 'ftype': 'Character',
+             'documentation': 'Name of the security.'},
+    'CUR_MKT_CAP': {'mnemonic': 'CUR_MKT_CAP', 'description': 'Current Market Cap',
+                    'categoryName': ['Market Activity', 'Fundamentals'],
+                    'ftype': 'Real', 'documentation': 'Market capitalization.'},
+}
+
+
+class FieldCatalogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.queries = []
+        self.removed = set()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'fields.json')
+        self.catalog = FieldCatalog(self.search_fields,
+                                    self.search_fields_by_category,
+                                    self.get_fields_info,
+                                    self.path, seeds=['a', 'e'])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def search_fields(self, search_string, *args):
+        self.queries.append(('search', search_string))
+        return {m: r for m, r in FIELDS.iteritems()
+                if search_string.lower() in r['description'].lower()
+                and m not in self.removed}
+
+    def search_fields_by_category(self, search_string, *args):
+        self.queries.append(('by_category', search_string))
+        return {}
+
+    def get_fields_info(self, field_list, return_field_documentation):
+        self.queries.append(('info', list(field_list)))
+        return {f: FIELDS[f] for f in field_list if f in FIELDS}
+
+    def test_search(self):
+        self.catalog.refresh()
+        self.assertEqual(len(self.queries), 2)
+        self.assertEqual(list(self.catalog.search_fields('price')),
+                         ['PX_LAST', 'PX_OPEN'])
+        # Prefix of words, mnemonic matches first.
+        self.assertEqual(list(self.catalog.search_fields('px_l')), ['PX_LAST'])
+        self.assertEqual(list(self.catalog.search_fields('mark')),
+                         ['CUR_MKT_CAP', 'PX_LAST', 'PX_OPEN'])
+        self.assertEqual(len(self.queries), 2)
+
+    def test_filters(self):
+        self.catalog.refresh()
+        found = self.catalog.search_fields('market', True,
+                                           ['Market Activity'], None, None,
+                                           None, None, ['Price'])
+        self.assertEqual(list(found), ['CUR_MKT_CAP'])
+        found = self.catalog.search_fields('market', False,
+                                           exclude_categories=['Fundamentals'])
+        self.assertEqual(list(found), ['PX_LAST', 'PX_OPEN'])
+        self.assertNotIn('documentation', found['PX_LAST'])
+
+    def test_by_category(self):
+        self.catalog.refresh()
+        found = self.catalog.search_fields_by_category('price')
+        self.assertEqual(list(found), ['Market Activity/Last', 'Market Activity/Open'])
+        self.assertEqual(list(found['Market Activity/Last']), ['PX_LAST'])
+
+    def test_fields_info(self):
+        info = self.catalog.get_fields_info(['PX_LAST', 'UNKNOWN'])
+        self.assertEqual(list(info), ['PX_LAST'])
+        self.catalog.get_fields_info(['PX_LAST'])
+        self.assertEqual(self.queries, [('info', ['PX_LAST', 'UNKNOWN'])])
+
+    def test_not_built(self):
+        self.catalog.get_fields_info(['PX_LAST'])
+        # The catalog only knows some of the fields: ask Bloomberg.
+        self.catalog.search_fields('price')
+        self.assertEqual(self.queries[-1], ('search', 'price'))
+
+    def test_complete(self):
+        self.catalog.refresh()
+        # Nothing found in a complete catalog: no need to ask Bloomberg.
+        self.assertEqual(list(self.catalog.search_fields('volume')), [])
+        self.assertEqual(len(self.queries), 2)
+
+    def test_blocked_refresh(self):
+        checks = []
+
+        def is_blocked():
+            checks.append(None)
+            return len(checks) > 1
+
+        self.catalog.is_blocked = is_blocked
+        self.assertRaises(RuntimeError, self.catalog.refresh)
+        self.assertFalse(self.catalog.complete)
+        self.assertEqual(self.catalog.records, {})
+        self.catalog.search_fields('price')
+        self.assertEqual(self.queries[-1], ('search', 'price'))
+
+    def test_refresh_drops_fields(self):
+        self.catalog.refresh()
+        self.removed.add('PX_OPEN')
+        self.catalog.refresh()
+        self.assertNotIn('PX_OPEN', self.catalog.records)
+        self.assertEqual(list(self.catalog.search_fields('price')), ['PX_LAST'])
+
+    def test_frames(self):
+        def search_fields(search_string, *args):
+            found = self.search_fields(search_string)
+            return pd.DataFrame.from_dict(found, orient='index')[
+                ['mnemonic', 'description', 'categoryName', 'ftype', 'documentation']]
+
+        catalog = FieldCatalog(search_fields, None, None, seeds=['a', 'e'])
+        expected = search_fields('price')
+        catalog.refresh()
+        found = catalog.search_fields('price')
+        self.assertIsInstance(found, pd.DataFrame)
+        self.assertEqual(list(found.columns), list(expected.columns))
+        self.assertTrue(found.equals(expected.loc[list(found.index)]))
+        by_category = catalog.search_fields_by_category('price')
+        self.assertIsInstance(by_category['Market Activity/Last'], pd.DataFrame)
+        self.assertEqual(list(catalog.search_fields('volume').columns),
+                         list(expected.columns))
+
+    def test_persistence(self):
+        self.catalog.refresh()
+        catalog = FieldCatalog(None, None, None, self.path)
+        self.assertEqual(catalog.records, self.catalog.records)
+        self.assertEqual(list(catalog.search_fields('px')), ['PX_LAST', 'PX_OPEN'])
+
+
+if __name__ == '__main__':
+    unittest.main()
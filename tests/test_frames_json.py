@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+import json
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from ezbbg.ws import frames_json
+
+
+def roundtrip(data):
+    return json.loads(frames_json.dumps(data),
+                      object_hook=frames_json.object_hook)
+
+
+class FramesJSONTestCase(unittest.TestCase):
+    def test_historical_frame(self):
+        index = pd.DatetimeIndex(['2020-01-02', '2020-01-03', '2020-01-06'],
+                                 name='date')
+        frame = pd.DataFrame({'PX_LAST': [1.5, np.nan, 3.25],
+                              'PX_OPEN': [1., 2., 3.],
+                              'VOLUME': [10, 20, 30],
+                              'NAME': ['a', None, 'c'],
+                              'LAST_DT': pd.to_datetime(['2020-01-01', None,
+                                                         '2020-01-05'])},
+                             index=index,
+                             columns=['PX_LAST', 'NAME', 'PX_OPEN', 'VOLUME',
+                                      'LAST_DT'])
+        decoded = roundtrip({'A': frame})['A']
+        self.assertTrue(decoded.equals(frame))
+        self.assertEqual(decoded.index.name, 'date')
+
+    def test_no_string_within_json(self):
+        frame = pd.DataFrame({'PX_LAST': [1.]},
+                             index=pd.DatetimeIndex(['2020-01-02']))
+        obj = json.loads(frames_json.dumps(frame))
+        desc = obj[frames_json.FRAME_KEY]
+        self.assertEqual(desc['index']['values'], [1577923200000])
+        self.assertEqual(desc['data'], [[1.]])
+
+    def test_empty_and_plain_index(self):
+        empty = pd.DataFrame({'PX_LAST': []}, index=pd.DatetimeIndex([]))
+        self.assertTrue(roundtrip(empty).equals(empty))
+        plain = pd.DataFrame({'Weight': [1., 2.], 'Member': ['X', 'Y']},
+                             columns=['Member', 'Weight'])
+        self.assertTrue(roundtrip(plain).equals(plain))
+
+
+if __name__ == '__main__':
+    unittest.main()
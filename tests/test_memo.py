@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+
+from ezbbg.ws.memo import Memoizer
+from ezbbg.ws.benchmarks.stub import StubBloomberg
+
+
+class MemoizerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubBloomberg()
+        self.calls = []
+        self.memo = Memoizer()
+
+    def reference(self, ticker_list, field_list, **kwargs):
+        self.calls.append((list(ticker_list), list(field_list)))
+        return self.stub.get_reference_data(ticker_list, field_list, **kwargs)
+
+    def fields_info(self, field_list, return_field_documentation=True):
+        self.calls.append(list(field_list))
+        return self.stub.get_fields_info(field_list, return_field_documentation)
+
+    def test_overlapping_tickers(self):
+        self.memo.get_reference_data(self.reference, ['A', 'B'], ['PX_LAST', 'NAME'])
+        data = self.memo.get_reference_data(self.reference, ['B', 'C'],
+                                            ['PX_LAST', 'NAME'])
+        self.assertEqual(self.calls[1], (['C'], ['PX_LAST', 'NAME']))
+        self.assertEqual(data, self.stub.get_reference_data(['B', 'C'],
+                                                            ['PX_LAST', 'NAME']))
+        stats = self.memo.stats()['reference_data']
+        self.assertEqual((stats['hits'], stats['misses']), (1, 3))
+
+    def test_options(self):
+        self.memo.get_reference_data(self.reference, ['A'], ['PX_LAST'])
+        self.memo.get_reference_data(self.reference, ['A'], ['PX_LAST'],
+                                     overrides={'EQY_FUND_CRNCY': 'EUR'})
+        self.assertEqual(len(self.calls), 2)
+
+    def test_bulk_copied(self):
+        first = self.memo.get_reference_data(self.reference, ['A'], ['INDX_MEMBERS'])
+        first['A']['INDX_MEMBERS']['Weight'] = 0.
+        second = self.memo.get_reference_data(self.reference, ['A'], ['INDX_MEMBERS'])
+        self.assertEqual(len(self.calls), 1)
+        self.assertTrue((second['A']['INDX_MEMBERS']['Weight'] > 0).any())
+
+    def test_fields_info(self):
+        self.memo.get_fields_info(self.fields_info, ['FIELD_0001', 'UNKNOWN'])
+        data = self.memo.get_fields_info(self.fields_info,
+                                         ['FIELD_0001', 'UNKNOWN', 'FIELD_0002'])
+        self.assertEqual(self.calls[1], ['FIELD_0002'])
+        self.assertEqual(list(data), ['FIELD_0001', 'FIELD_0002'])
+
+    def test_ttl(self):
+        memo = Memoizer(ttls={'reference_data': 0.01})
+        memo.get_reference_data(self.reference, ['A'], ['PX_LAST'])
+        time.sleep(0.02)
+        memo.get_reference_data(self.reference, ['A'], ['PX_LAST'])
+        self.assertEqual(len(self.calls), 2)
+
+    def test_max_bytes(self):
+        memo = Memoizer(max_bytes=500)
+        memo.get_reference_data(self.reference, ['T{}'.format(i) for i in range(50)],
+                                ['PX_LAST'])
+        stats = memo.stats()
+        self.assertLessEqual(stats['bytes'], 500)
+        self.assertLess(stats['cells'], 50)
+        # The most recent cells are kept.
+        memo.get_reference_data(self.reference, ['T49'], ['PX_LAST'])
+        self.assertEqual(len(self.calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
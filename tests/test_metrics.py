@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+
+from flask import Flask, Response
+
+from ezbbg.ws import metrics
+
+
+class HistogramTestCase(unittest.TestCase):
+    def test_quantiles(self):
+        histogram = metrics.Histogram((1, 2, 5, 10))
+        for value in [0.5] * 50 + [3] * 49 + [20]:
+            histogram.observe(value)
+        self.assertEqual(histogram.count, 100)
+        self.assertEqual(histogram.quantile(0.5), 1)
+        self.assertEqual(histogram.quantile(0.99), 5)
+        self.assertEqual(histogram.quantile(1), 20)
+        self.assertEqual(histogram.counts, [50, 0, 49, 0, 1])
+        self.assertEqual(metrics.Histogram((1,)).quantile(0.5), None)
+
+
+class MetricsMiddlewareTestCase(unittest.TestCase):
+    def setUp(self):
+        self.metrics = metrics.Metrics()
+        app = Flask(__name__)
+        app.wsgi_app = metrics.MetricsMiddleware(app.wsgi_app, self.metrics)
+
+        @app.route('/data')
+        def data():
+            metrics.record_query(['A', 'B', 'C'], ['PX_LAST'])
+            with metrics.phase('bloomberg'):
+                with metrics.phase('bloomberg'):
+                    time.sleep(0.01)
+            with metrics.phase('serialize'):
+                body = 'x' * 100
+            return Response(body)
+
+        @app.route('/fail')
+        def fail():
+            raise ValueError()
+        self.client = app.test_client()
+
+    def get(self, path):
+        # The request is recorded once its response is closed.
+        self.client.get(path, buffered=True)
+
+    def test_route_metrics(self):
+        for _ in range(3):
+            self.get('/data')
+        routes = self.metrics.snapshot()['routes']
+        data = routes['/data']
+        self.assertEqual(data['requests'], 3)
+        self.assertEqual(data['errors'], 0)
+        self.assertEqual(data['in_flight'], 0)
+        self.assertEqual(set(data['phases']), {'bloomberg', 'serialize', 'write'})
+        bloomberg = data['phases']['bloomberg']
+        self.assertEqual(bloomberg['count'], 3)
+        self.assertTrue(0.03 <= bloomberg['sum'] < data['latency']['sum'])
+        self.assertEqual(data['response_bytes']['sum'], 300)
+        self.assertEqual(data['tickers']['sum'], 9)
+        self.assertEqual(data['fields']['sum'], 3)
+
+    def test_errors(self):
+        self.get('/fail')
+        self.get('/nowhere')
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(sorted(snapshot['routes']), ['/fail', metrics.UNMATCHED_ROUTE])
+        self.assertEqual(snapshot['routes']['/fail']['errors'], 1)
+        self.assertEqual(snapshot['in_flight'], 0)
+
+    def test_no_request(self):
+        # Outside of a request, the phases are not measured.
+        with metrics.phase('bloomberg'):
+            pass
+        metrics.record_query(['A'])
+
+
+if __name__ == '__main__':
+    unittest.main()
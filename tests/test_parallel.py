@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import datetime as dt
+import threading
+import unittest
+
+import numpy as np
+import requests
+
+from ezbbg.ws import parallel
+from ezbbg.ws.benchmarks.stub import StubBloomberg, installed
+from ezbbg.ws.benchmarks.runner import InProcessClient
+
+
+class FailingBloomberg(StubBloomberg):
+    def get_reference_data(self, ticker_list, *args, **kwargs):
+        if 'BAD' in ticker_list:
+            raise RuntimeError("Bloomberg failure")
+        return StubBloomberg.get_reference_data(self, ticker_list, *args, **kwargs)
+
+
+class RecordingClient(InProcessClient):
+    """Client recording the tickers of each query.
+    """
+
+    def __init__(self, *args, **kwargs):
+        InProcessClient.__init__(self, *args, **kwargs)
+        self.queried = []
+        self._queried_lock = threading.Lock()
+
+    def _get(self, url, request=None, *args, **kwargs):
+        with self._queried_lock:
+            self.queried.append(sorted(request['ticker_list']))
+        return InProcessClient._get(self, url, request, *args, **kwargs)
+
+
+class ParallelTestCase(unittest.TestCase):
+    tickers = ['E', 'C', 'A', 'D', 'B']
+    start_date = dt.date(2020, 1, 1)
+    end_date = dt.date(2020, 3, 31)
+
+    def setUp(self):
+        self.installed = installed(FailingBloomberg(), cache=False)
+        self.installed.__enter__()
+        self.client = RecordingClient()
+
+    def tearDown(self):
+        self.installed.__exit__(None, None, None)
+
+    def test_async_client(self):
+        with parallel.AsyncClient(self.client, max_in_flight=2) as aclient:
+            pending = [aclient.get_reference_data([ticker], ['PX_LAST'])
+                       for ticker in self.tickers]
+            # Other fields, so that it isn't coalesced with the others.
+            failed = aclient.get_reference_data(['BAD'], ['NAME'])
+            data = [result.get() for result in pending]
+            self.assertRaises(requests.HTTPError, failed.get)
+        self.assertEqual([list(d) for d in data], [[t] for t in self.tickers])
+
+    def test_gather_historical(self):
+        data = parallel.gather_historical(self.tickers, ['PX_LAST'],
+                                          self.start_date, self.end_date,
+                                          chunk_size=2, client=self.client)
+        self.assertEqual(list(data), self.tickers)
+        self.assertEqual(sorted(self.client.queried),
+                         [['A', 'D'], ['B'], ['C', 'E']])
+        expected = StubBloomberg().get_historical_data(
+            ['D'], ['PX_LAST'], self.start_date, self.end_date)
+        self.assertTrue(np.allclose(data['D'], expected['D']))
+
+    def test_gather_reference(self):
+        data = parallel.gather_reference(self.tickers, ['PX_LAST', 'NAME'],
+                                         chunk_size=3, client=self.client)
+        self.assertEqual(list(data), self.tickers)
+        self.assertEqual(sorted(self.client.queried), [['A', 'C', 'E'], ['B', 'D']])
+        self.assertEqual(data['B']['NAME'], 'B name')
+
+    def test_gather_error(self):
+        with parallel.AsyncClient(self.client) as aclient:
+            self.assertRaises(requests.HTTPError, aclient.gather,
+                              'get_reference_data', self.tickers + ['BAD'],
+                              ['PX_LAST'], chunk_size=2)
+        self.assertEqual(len(self.client.queried), 3)
+
+    def test_planned_in_worker(self):
+        with parallel.AsyncClient(self.client, max_in_flight=1) as aclient:
+            # Planned from the only thread of the client pool.
+            result = aclient._pool.apply_async(
+                aclient.planned_historical,
+                (self.tickers, ['PX_LAST'], self.start_date, self.end_date),
+                {'max_cells': 150})
+            data = result.get(10)
+        self.assertEqual(list(data), self.tickers)
+        self.assertEqual(sorted(self.client.queried),
+                         [['A', 'D'], ['B'], ['C', 'E']])
+
+    def test_is_retryable(self):
+        response = requests.Response()
+        response.status_code = 503
+        self.assertTrue(parallel.is_retryable(requests.HTTPError(response=response)))
+        response.status_code = 400
+        self.assertFalse(parallel.is_retryable(requests.HTTPError(response=response)))
+        self.assertTrue(parallel.is_retryable(requests.ConnectionError()))
+        self.assertFalse(parallel.is_retryable(ValueError()))
+
+
+if __name__ == '__main__':
+    unittest.main()
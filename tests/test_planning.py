@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+import datetime as dt
+import threading
+import unittest
+
+from ezbbg.ws import planning
+from ezbbg.ws.benchmarks.stub import StubBloomberg
+
+
+class PlanTestCase(unittest.TestCase):
+    fields = ['PX_LAST', 'PX_OPEN']
+
+    def test_small_query(self):
+        chunks = planning.plan(['A', 'B'], self.fields, dt.date(2020, 1, 1),
+                               dt.date(2020, 12, 31))
+        self.assertEqual(chunks, [planning.Chunk(['A', 'B'], dt.date(2020, 1, 1),
+                                                 dt.date(2020, 12, 31))])
+
+    def test_ticker_chunks(self):
+        tickers = ['T{}'.format(i) for i in range(25)]
+        # 262 business days x 2 fields per ticker
+        chunks = planning.plan(tickers, self.fields, dt.date(2020, 1, 1),
+                               dt.date(2020, 12, 31), max_cells=10 * 524)
+        self.assertEqual([len(chunk.tickers) for chunk in chunks], [10, 10, 5])
+        self.assertEqual(sum([chunk.tickers for chunk in chunks], []), tickers)
+
+    def test_date_windows(self):
+        chunks = planning.plan(['A', 'B'], self.fields, dt.date(2000, 1, 1),
+                               dt.date(2019, 12, 31), max_cells=2000)
+        windows = sorted(set((c.start_date, c.end_date) for c in chunks))
+        self.assertEqual(len(chunks), 2 * len(windows))
+        self.assertEqual(windows[0][0], dt.date(2000, 1, 1))
+        self.assertEqual(windows[-1][1], dt.date(2019, 12, 31))
+        for (_, end), (start, _) in zip(windows, windows[1:]):
+            self.assertEqual(start - end, dt.timedelta(days=1))
+        for start, end in windows:
+            self.assertLessEqual(planning.estimate_cells(1, 2, start, end), 2000)
+
+    def test_periodicity(self):
+        self.assertEqual(planning.estimate_cells(2, 1, dt.date(2020, 1, 1),
+                                                 dt.date(2020, 12, 31),
+                                                 periodicity='WEEKLY'),
+                         2 * 53)
+
+
+class RunTestCase(unittest.TestCase):
+    tickers = ['T{} Equity'.format(i) for i in range(7)]
+    fields = ['PX_LAST']
+
+    def setUp(self):
+        self.stub = StubBloomberg()
+        self.failures = {}
+        self.lock = threading.Lock()
+
+    def fetch(self, tickers, fields, start_date, end_date):
+        with self.lock:
+            key = (tickers[0], start_date)
+            if self.failures.get(key, 0) > 0:
+                self.failures[key] -= 1
+                raise IOError("Bloomberg timeout")
+        return self.stub.get_historical_data(tickers, fields, start_date, end_date)
+
+    def test_stitched(self):
+        data = planning.run(self.fetch, self.tickers, self.fields,
+                            dt.date(2010, 1, 1), dt.date(2020, 12, 31),
+                            max_cells=1000, retry_delay=0)
+        self.assertEqual(list(data), self.tickers)
+        expected = self.stub.get_historical_data(self.tickers, self.fields,
+                                                 dt.date(2010, 1, 1),
+                                                 dt.date(2020, 12, 31))
+        for ticker in self.tickers:
+            self.assertTrue(data[ticker].equals(expected[ticker]))
+
+    def test_retry_failed_chunk(self):
+        self.failures[('T3 Equity', dt.date(2020, 1, 1))] = 2
+        calls = []
+        fetch = self.fetch
+        def counted(*args):
+            calls.append(args)
+            return fetch(*args)
+        data = planning.run(counted, self.tickers, self.fields,
+                            dt.date(2020, 1, 1), dt.date(2020, 12, 31),
+                            max_cells=262, retry_delay=0)
+        self.assertEqual(len(data), len(self.tickers))
+        # Only the failing chunk is sent again.
+        self.assertEqual(len(calls), len(self.tickers) + 2)
+
+    def test_give_up(self):
+        self.failures[('T3 Equity', dt.date(2020, 1, 1))] = 3
+        with self.assertRaises(IOError):
+            planning.run(self.fetch, self.tickers, self.fields,
+                         dt.date(2020, 1, 1), dt.date(2020, 12, 31),
+                         max_cells=262, retries=2, retry_delay=0)
+
+    def test_request_error(self):
+        calls = []
+
+        def invalid(*args):
+            calls.append(args)
+            raise ValueError("Invalid field")
+        with self.assertRaises(ValueError):
+            planning.run(invalid, self.tickers[:1], self.fields,
+                         dt.date(2020, 1, 1), dt.date(2020, 12, 31),
+                         retry_delay=0)
+        self.assertEqual(len(calls), 1)
+
+    def test_is_transient(self):
+        self.assertTrue(planning.is_transient(IOError("Connection reset")))
+        self.assertTrue(planning.is_transient(RuntimeError("Request timed out")))
+        self.assertTrue(planning.is_transient(RuntimeError("Session terminated")))
+        self.assertFalse(planning.is_transient(ValueError("Invalid field")))
+
+
+if __name__ == '__main__':
+    unittest.main()
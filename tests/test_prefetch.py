@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import datetime as dt
+import unittest
+
+from ezbbg.ws import prefetch
+from ezbbg.ws.cache import HistoricalDataCache
+from ezbbg.ws.benchmarks.stub import StubBloomberg
+
+
+class JobTestCase(unittest.TestCase):
+    def test_load(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'prefetch.json')
+            with open(path, 'w') as f:
+                json.dump({'morning': {'tickers': ['A'], 'fields': ['PX_LAST'],
+                                       'days': 10, 'at': '06:30'}}, f)
+            job, = prefetch.load_jobs(path)
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(job.name, 'morning')
+        self.assertEqual(job.at, [dt.time(6, 30)])
+        self.assertRaises(ValueError, prefetch.Job, 'x', ['A'], ['PX_LAST'])
+        self.assertRaises(ValueError, prefetch.Job, 'x', ['A'], ['PX_LAST'],
+                          at='6h30')
+
+    def test_schedule(self):
+        job = prefetch.Job('x', ['A'], ['PX_LAST'], at=['06:30', '18:00'])
+        now = time.mktime(dt.datetime(2020, 1, 2, 12).timetuple())
+        job.schedule(now)
+        self.assertEqual(dt.datetime.fromtimestamp(job.next_run),
+                         dt.datetime(2020, 1, 2, 18))
+        job.schedule(job.next_run)
+        self.assertEqual(dt.datetime.fromtimestamp(job.next_run),
+                         dt.datetime(2020, 1, 3, 6, 30))
+        job = prefetch.Job('x', ['A'], ['PX_LAST'], every=60)
+        job.schedule(now)
+        self.assertEqual(job.next_run, now + 60)
+
+
+class PrefetcherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubBloomberg()
+        self.calls = []
+        self.cache = HistoricalDataCache()
+        self.job = prefetch.Job('morning', ['A', 'B', 'C'], ['PX_LAST'],
+                                days=100, every=3600)
+
+    def bloomberg(self, ticker_list, field_list, start_date, end_date, **kwargs):
+        self.calls.append(list(ticker_list))
+        return self.stub.get_historical_data(ticker_list, field_list,
+                                             start_date, end_date, **kwargs)
+
+    def fetch(self, *args, **kwargs):
+        return self.cache.get_historical_data(self.bloomberg, *args, **kwargs)
+
+    def test_warm_cache(self):
+        prefetcher = prefetch.Prefetcher(self.fetch, [self.job], chunk_size=2)
+        prefetcher.run('morning')
+        self.assertEqual(self.calls, [['A', 'B'], ['C']])
+        stats = prefetcher.stats()['morning']
+        self.assertEqual((stats['state'], stats['done'], stats['runs']),
+                         ('done', 3, 1))
+        today = dt.date.today()
+        self.fetch(['B'], ['PX_LAST'], today - dt.timedelta(days=50),
+                   today - dt.timedelta(days=1))
+        self.assertEqual(len(self.calls), 2)
+
+    def test_back_off(self):
+        checks = []
+
+        def is_blocked():
+            checks.append(time.time())
+            return len(checks) < 3
+
+        prefetcher = prefetch.Prefetcher(self.fetch, [self.job],
+                                         is_blocked=is_blocked, backoff=0.01)
+        prefetcher.run('morning')
+        self.assertEqual(len(checks), 3)
+        self.assertGreaterEqual(checks[2] - checks[1], 0.02)
+        self.assertEqual(prefetcher.stats()['morning']['state'], 'done')
+
+    def test_background(self):
+        prefetcher = prefetch.Prefetcher(self.fetch, [self.job])
+        prefetcher.start()
+        try:
+            prefetcher.trigger('morning')
+            for _ in range(100):
+                if prefetcher.stats()['morning']['runs']:
+                    break
+                time.sleep(0.01)
+        finally:
+            prefetcher.stop()
+        self.assertEqual(prefetcher.stats()['morning']['runs'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
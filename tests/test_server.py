@@ -1,9 +1,19 @@
 # -*- coding: utf-8 -*-
 
+import json
 from datetime import date, datetime
 import unittest
 
-from ezbbg.ws.server import isoformat_date_converter
+import numpy as np
+import pandas as pd
+import requests
+
+from ezbbg.ws import client as ws_client
+from ezbbg.ws import frames_json
+from ezbbg.ws import server
+from ezbbg.ws.server import isoformat_date_converter, typed_reference_data
+from ezbbg.ws.benchmarks.stub import StubBloomberg, installed
+from ezbbg.ws.benchmarks.runner import InProcessClient
 
 
 class ServerUtilityTestCase(unittest.TestCase):
@@ -29,5 +39,215 @@ class ServerUtilityTestCase(unittest.TestCase):
             isoformat_date_converter("2013/07/17 15h12m13s")
 
 
+class TypedReferenceDataTestCase(unittest.TestCase):
+    def test_field_types(self):
+        bulk = pd.DataFrame({'Index Member': ['ABI BB', 'AI FP'],
+                             'Weight': [3.2, 2.7],
+                             'Since': [date(2001, 1, 2), date(2003, 4, 5)]},
+                            columns=['Index Member', 'Weight', 'Since'])
+        reference_data = {'SX5E Index': {'NAME': 'EURO STOXX 50',
+                                         'PX_LAST': 3100.5,
+                                         'LAST_UPDATE_DT': date(2014, 1, 2),
+                                         'INDX_MWEIGHT': bulk}}
+        typed = typed_reference_data(reference_data)
+        self.assertEqual({'NAME': 'scalar', 'PX_LAST': 'scalar',
+                          'LAST_UPDATE_DT': 'date', 'INDX_MWEIGHT': 'bulk'},
+                         typed['types'])
+        members = typed['data']['SX5E Index']['INDX_MWEIGHT']
+        self.assertEqual(['Index Member', 'Weight', 'Since'], members['columns'])
+        self.assertEqual(['Since'], members['dates'])
+        self.assertEqual(['2001-01-02T00:00:00', '2003-04-05T00:00:00'],
+                         members['data'][2])
+
+
+class UntypedClient(InProcessClient):
+    """Client of a server which doesn't type the reference data.
+    """
+
+    def _get(self, url, request=None, timeout=None, headers=None,
+             stream=False):
+        headers = {key: value for key, value in (headers or {}).iteritems()
+                   if key != 'Accept'}
+        return InProcessClient._get(self, url, request, timeout, headers, stream)
+
+
+class TypedReferenceDataRoundTripTestCase(unittest.TestCase):
+    fields = ['NAME', 'PX_LAST', 'LAST_UPDATE_DT', 'INDX_MEMBERS']
+
+    def query(self, client_class):
+        with installed(StubBloomberg()):
+            return client_class().get_reference_data(['A', 'B'], self.fields)
+
+    def check(self, data):
+        expected = StubBloomberg().get_reference_data(['A', 'B'], self.fields)
+        for ticker in ('A', 'B'):
+            values, sent = data[ticker], expected[ticker]
+            self.assertEqual(values['NAME'], sent['NAME'])
+            self.assertEqual(values['PX_LAST'], sent['PX_LAST'])
+            self.assertEqual(values['LAST_UPDATE_DT'],
+                             np.datetime64(sent['LAST_UPDATE_DT']))
+            members = values['INDX_MEMBERS']
+            self.assertIsInstance(members, pd.DataFrame)
+            self.assertEqual(sorted(members.columns), sorted(sent['INDX_MEMBERS'].columns))
+            self.assertTrue(np.allclose(members['Weight'],
+                                        sent['INDX_MEMBERS']['Weight']))
+            # The guessed dates of an untyped response are in UTC.
+            self.assertEqual(
+                list(pd.to_datetime(members['Since']).dt.strftime('%Y-%m-%d')),
+                [since.isoformat() for since in sent['INDX_MEMBERS']['Since']])
+
+    def test_typed(self):
+        self.check(self.query(InProcessClient))
+
+    def test_untyped_server(self):
+        # The client guesses the type of each value.
+        self.check(self.query(UntypedClient))
+
+    def test_type_fallback(self):
+        typed = {'types': {'LAST_UPDATE_DT': 'date'},
+                 'data': {'A': {'LAST_UPDATE_DT': '2014-01-02',
+                                'NAME': '2014-01-02',
+                                'PX_LAST': None}}}
+        data = ws_client._typed_refdata_converter(typed)
+        self.assertEqual(data['A']['LAST_UPDATE_DT'], np.datetime64('2014-01-02'))
+        # Fields without type are scalars.
+        self.assertEqual(data['A']['NAME'], '2014-01-02')
+        self.assertIsNone(data['A']['PX_LAST'])
+
+
+class BatchTestCase(unittest.TestCase):
+    def batch(self, body):
+        with installed(StubBloomberg()):
+            response = server.app.test_client().get(
+                '/batch', data=json.dumps(body), content_type='application/json')
+        if response.status_code != 200:
+            return response.status_code, None
+        return response.status_code, json.loads(response.data)['results']
+
+    def test_mixed_routes(self):
+        status, results = self.batch({'queries': [
+            {'route': 'fields_info', 'args': {'field_list': ['FIELD_0001']}},
+            {'id': 'last', 'route': 'reference_data',
+             'args': {'ticker_list': ['A'], 'field_list': ['PX_LAST']}},
+            {'route': 'historical_data',
+             'args': {'ticker_list': ['A'], 'field_list': ['PX_LAST'],
+                      'start_date': '2020-01-01', 'end_date': '2020-01-31'}},
+            {'route': 'fields', 'args': {'search_string': 'last'}}]})
+        self.assertEqual(status, 200)
+        # By default, the queries are identified by their position.
+        self.assertEqual(sorted(results), ['0', '2', '3', 'last'])
+        self.assertEqual([result['status'] for _, result in sorted(results.items())],
+                         [200] * 4)
+        self.assertIn('FIELD_0001', results['0']['data'])
+        self.assertEqual(results['last']['data']['types'], {'PX_LAST': 'scalar'})
+        self.assertIn('A', results['2']['data'])
+
+    def test_query_errors(self):
+        status, results = self.batch({'queries': [
+            {'route': 'reference_data', 'args': {'field_list': ['PX_LAST']}},
+            {'route': 'historical_data',
+             'args': {'ticker_list': ['A'], 'field_list': ['PX_LAST'],
+                      'start_date': '2020/01/01', 'end_date': '2020-01-31'}},
+            {'route': 'fields_info', 'args': {'field_list': ['FIELD_0001']}}]})
+        self.assertEqual(status, 200)
+        self.assertEqual(results['0']['status'], 400)
+        self.assertIn('ticker_list', results['0']['error'])
+        # The other errors are reported too, without failing the batch.
+        self.assertEqual(results['1']['status'], 500)
+        self.assertIn('2020/01/01', results['1']['error'])
+        self.assertEqual(results['2']['status'], 200)
+
+    def test_bad_bodies(self):
+        for body in ({'queries': {'route': 'fields_info'}},
+                     {'queries': ['fields_info']},
+                     {'queries': [{'route': 'unknown'}]},
+                     {'queries': [{'route': 'fields_info', 'args': ['PX_LAST']}]}):
+            self.assertEqual(self.batch(body)[0], 400)
+
+
+class FailingBloomberg(StubBloomberg):
+    def get_historical_data(self, ticker_list, *args, **kwargs):
+        if 'BAD' in ticker_list:
+            raise RuntimeError("Bloomberg failure")
+        return StubBloomberg.get_historical_data(self, ticker_list, *args, **kwargs)
+
+
+class StreamTestCase(unittest.TestCase):
+    args = {'field_list': ['PX_LAST', 'PX_OPEN'],
+            'start_date': '2020-01-01', 'end_date': '2020-03-31'}
+
+    def stream(self, accept=server.NDJSON_MIMETYPE, **kwargs):
+        body = dict(self.args, **kwargs)
+        with installed(FailingBloomberg(), cache=False):
+            response = server.app.test_client().get(
+                '/historical_data', data=json.dumps(body),
+                content_type='application/json',
+                headers={'Accept': accept})
+            # The body is generated as it's read.
+            lines = response.data.splitlines()
+        if response.status_code != 200:
+            return response.status_code, None
+        self.assertEqual(response.mimetype, server.NDJSON_MIMETYPE)
+        return 200, [json.loads(line, object_hook=frames_json.object_hook)
+                     for line in lines]
+
+    def test_records(self):
+        status, records = self.stream(ticker_list=['C', 'A', 'B'],
+                                      stream_chunk_size=2)
+        self.assertEqual(status, 200)
+        self.assertEqual([record['ticker'] for record in records], ['C', 'A', 'B'])
+        expected = StubBloomberg().get_historical_data(
+            ['A'], self.args['field_list'], date(2020, 1, 1), date(2020, 3, 31))
+        self.assertTrue(np.allclose(pd.read_json(records[1]['data']), expected['A']))
+
+    def test_framed_records(self):
+        accept = '{}, {}'.format(server.NDJSON_MIMETYPE,
+                                 frames_json.FRAMES_JSON_MIMETYPE)
+        status, records = self.stream(accept, ticker_list=['C', 'A'])
+        self.assertEqual([record['ticker'] for record in records], ['C', 'A'])
+        expected = StubBloomberg().get_historical_data(
+            ['A'], self.args['field_list'], date(2020, 1, 1), date(2020, 3, 31))
+        self.assertIsInstance(records[1]['data'], pd.DataFrame)
+        self.assertTrue(np.allclose(records[1]['data'], expected['A']))
+
+    def test_error_line(self):
+        status, records = self.stream(ticker_list=['A', 'BAD', 'C'],
+                                      stream_chunk_size=1)
+        self.assertEqual(status, 200)
+        self.assertEqual(records[0]['ticker'], 'A')
+        self.assertEqual(records[1], {'error': 'Bloomberg failure'})
+        self.assertEqual(len(records), 2)
+
+    def test_invalid_chunk_size(self):
+        for chunk_size in (0, -1, '2', 1.5, True, None):
+            self.assertEqual(self.stream(ticker_list=['A'],
+                                         stream_chunk_size=chunk_size)[0], 400)
+
+    def test_client(self):
+        fields = self.args['field_list']
+        with installed(FailingBloomberg(), cache=False):
+            client = InProcessClient()
+            streamed = list(client.iter_historical_data(
+                ['B', 'A'], fields, date(2020, 1, 1), date(2020, 3, 31),
+                stream_chunk_size=1))
+            received = []
+            with self.assertRaises(requests.HTTPError):
+                for ticker, _ in client.iter_historical_data(
+                        ['A', 'BAD'], fields, date(2020, 1, 1),
+                        date(2020, 3, 31), stream_chunk_size=1):
+                    received.append(ticker)
+        self.assertEqual(received, ['A'])
+        self.assertEqual([ticker for ticker, _ in streamed], ['B', 'A'])
+        expected = StubBloomberg().get_historical_data(
+            ['B'], fields, date(2020, 1, 1), date(2020, 3, 31))['B']
+        frame = streamed[0][1]
+        self.assertIsInstance(frame.index, pd.DatetimeIndex)
+        self.assertEqual(list(frame.columns), fields)
+        self.assertTrue(np.allclose(frame, expected))
+        with self.assertRaises(ValueError):
+            next(client.iter_historical_data(['A'], fields, date(2020, 1, 1),
+                                             date(2020, 3, 31), layout='panel'))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import time
+import httplib
+import threading
+import unittest
+
+from ezbbg.ws import serving
+
+
+class Application(object):
+    """WSGI application whose '/block' requests wait for `release`.
+    """
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.blocked = threading.Semaphore(0)
+
+    def __call__(self, environ, start_response):
+        if environ['PATH_INFO'] == '/block':
+            self.blocked.release()
+            self.release.wait(5)
+        body = b'ok'
+        start_response('200 OK', [('Content-Type', 'text/plain'),
+                                  ('Content-Length', str(len(body)))])
+        return [body]
+
+
+class PooledWSGIServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Application()
+        self.keep_alive_timeout = serving.KEEP_ALIVE_TIMEOUT
+
+    def tearDown(self):
+        serving.KEEP_ALIVE_TIMEOUT = self.keep_alive_timeout
+        self.app.release.set()
+        if getattr(self, 'httpd', None) is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+    def serve(self, **kwargs):
+        self.httpd = serving.PooledWSGIServer('localhost', 0, self.app, **kwargs)
+        thread = threading.Thread(target=self.httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self.httpd.socket.getsockname()[1]
+
+    def test_queue_full(self):
+        port = self.serve(workers=1, queue_size=1)
+        busy = httplib.HTTPConnection('localhost', port, timeout=5)
+        busy.request('GET', '/block')
+        self.assertTrue(self.app.blocked.acquire())
+        queued = httplib.HTTPConnection('localhost', port, timeout=5)
+        queued.request('GET', '/')
+        # Wait until the second request is queued.
+        while self.httpd._queue.empty():
+            time.sleep(0.001)
+        rejected = httplib.HTTPConnection('localhost', port, timeout=5)
+        rejected.request('GET', '/')
+        self.assertEqual(rejected.getresponse().status, 503)
+        self.app.release.set()
+        self.assertEqual(busy.getresponse().status, 200)
+        self.assertEqual(queued.getresponse().status, 200)
+        self.assertEqual(self.httpd.rejected, 1)
+
+    def test_keep_alive(self):
+        port = self.serve(workers=2)
+        connection = httplib.HTTPConnection('localhost', port, timeout=5)
+        connection.request('GET', '/')
+        self.assertEqual(connection.getresponse().read(), b'ok')
+        sock = connection.sock
+        start = time.time()
+        for _ in range(10):
+            connection.request('GET', '/')
+            self.assertEqual(connection.getresponse().read(), b'ok')
+        # Neither waiting for the poller nor for a delayed ACK.
+        self.assertLess(time.time() - start, 0.3)
+        self.assertIs(connection.sock, sock)
+        self.assertEqual(self.httpd.served, 11)
+
+    def test_idle_timeout(self):
+        serving.KEEP_ALIVE_TIMEOUT = 0.1
+        port = self.serve(workers=1)
+        connection = httplib.HTTPConnection('localhost', port, timeout=5)
+        connection.request('GET', '/')
+        self.assertEqual(connection.getresponse().read(), b'ok')
+        # Closed by the server after the timeout, within a poll interval.
+        start = time.time()
+        self.assertEqual(connection.sock.recv(1), b'')
+        self.assertLess(time.time() - start, 0.1 + 2 * serving.POLL_INTERVAL)
+        self.assertEqual(self.httpd.stats()['idle_connections'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
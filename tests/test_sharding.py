@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import requests
+
+from ezbbg.ws.sharding import ShardedClient, NoHostAvailable
+
+
+class FakeClient(object):
+    def __init__(self, name):
+        self.name = name
+        self.alive = True
+        self.error = None
+        self.calls = []
+
+    def get_reference_data(self, ticker_list, field_list, **kwargs):
+        self.calls.append(list(ticker_list))
+        if not self.alive:
+            raise requests.ConnectionError(self.name)
+        if self.error is not None:
+            raise self.error
+        return {ticker: {field: self.name for field in field_list}
+                for ticker in ticker_list}
+
+    def iter_historical_data(self, ticker_list, field_list, start_date,
+                             end_date, **kwargs):
+        self.calls.append(list(ticker_list))
+        for i, ticker in enumerate(ticker_list):
+            if not self.alive:
+                raise requests.ConnectionError(self.name)
+            if i == self.fail_after:
+                raise self.error or requests.ConnectionError(self.name)
+            yield ticker, self.name
+
+    fail_after = None
+
+    def close(self):
+        pass
+
+
+class ShardedClientTestCase(unittest.TestCase):
+    tickers = ['TICKER{} Equity'.format(i) for i in range(40)]
+
+    def make_client(self, strategy='hash'):
+        client = ShardedClient(['a', 'b', 'c'], strategy=strategy,
+                               probe_interval=60)
+        client.clients = {key: FakeClient(key[0]) for key in client.clients}
+        client._probe = lambda key: client.clients[key].alive
+        return client
+
+    def test_split_is_stable(self):
+        client = self.make_client()
+        healthy = client.healthy_hosts()
+        parts = client._split(self.tickers, healthy)
+        self.assertEqual(sorted(sum(parts.values(), [])), sorted(self.tickers))
+        self.assertEqual(len(parts), 3)
+        self.assertEqual(parts, client._split(self.tickers, healthy))
+        # Without a host, only its tickers move.
+        lost = parts.pop(('b', 6666))
+        parts_ac = client._split(self.tickers, [('a', 6666), ('c', 6666)])
+        for key, tickers in parts.iteritems():
+            self.assertTrue(set(tickers) <= set(parts_ac[key]))
+        self.assertEqual(sorted(sum(parts_ac.values(), [])), sorted(self.tickers))
+        self.assertTrue(lost)
+
+    def test_least_outstanding_split(self):
+        client = self.make_client('least_outstanding')
+        parts = client._split(self.tickers, client.healthy_hosts())
+        self.assertEqual([len(t) for t in parts.values()], [14, 14, 12])
+
+    def test_merge_in_order(self):
+        client = self.make_client()
+        data = client.get_reference_data(self.tickers, ['PX_LAST'])
+        self.assertEqual(list(data), self.tickers)
+        self.assertEqual(len(set(d['PX_LAST'] for d in data.values())), 3)
+
+    def test_failover(self):
+        client = self.make_client()
+        client.clients[('b', 6666)].alive = False
+        data = client.get_reference_data(self.tickers, ['PX_LAST'])
+        self.assertEqual(list(data), self.tickers)
+        self.assertNotIn('b', set(d['PX_LAST'] for d in data.values()))
+        self.assertEqual(client.healthy_hosts(), [('a', 6666), ('c', 6666)])
+        # Probed again once the interval elapsed.
+        client.clients[('b', 6666)].alive = True
+        client.down[('b', 6666)] = 0
+        self.assertEqual(len(client.healthy_hosts()), 3)
+
+    def test_stream_failover(self):
+        client = self.make_client()
+        first = client._least_outstanding(client.healthy_hosts())
+        client.clients[first].fail_after = 2
+        stream = client.iter_historical_data(self.tickers[:5], ['PX_LAST'],
+                                             None, None)
+        received = [next(stream) for _ in range(3)]
+        # In flight on the second host until the stream is exhausted.
+        self.assertEqual(sum(client.outstanding.values()), 1)
+        received.extend(stream)
+        self.assertEqual([ticker for ticker, _ in received], self.tickers[:5])
+        self.assertEqual([host for _, host in received[:2]], [first[0]] * 2)
+        self.assertNotIn(first[0], set(host for _, host in received[2:]))
+        self.assertIn(first, client.down)
+        self.assertEqual(sum(client.outstanding.values()), 0)
+        # Closing the stream ends its query.
+        stream = client.iter_historical_data(self.tickers, ['PX_LAST'], None, None)
+        next(stream)
+        stream.close()
+        self.assertEqual(sum(client.outstanding.values()), 0)
+
+    def test_read_timeout(self):
+        client = self.make_client()
+        for fake in client.clients.values():
+            fake.error = requests.ReadTimeout()
+        self.assertRaises(requests.ReadTimeout,
+                          client.get_reference_data, ['TICKER1 Equity'], ['PX_LAST'])
+        # Neither marked down nor sent again to another host.
+        self.assertEqual(client.down, {})
+        self.assertEqual(sum(len(fake.calls) for fake in client.clients.values()), 1)
+        self.assertEqual(sum(client.outstanding.values()), 0)
+
+    def test_stream_cut(self):
+        client = self.make_client()
+        first = client._least_outstanding(client.healthy_hosts())
+        client.clients[first].fail_after = 1
+        client.clients[first].error = requests.exceptions.ChunkedEncodingError()
+        received = list(client.iter_historical_data(self.tickers[:3], ['PX_LAST'],
+                                                    None, None))
+        self.assertEqual([ticker for ticker, _ in received], self.tickers[:3])
+        self.assertNotIn(first[0], set(host for _, host in received[1:]))
+        self.assertEqual(client.down, {})
+        # A read timeout between two records isn't failed over.
+        for fake in client.clients.values():
+            fake.fail_after = 1
+            fake.error = requests.ReadTimeout()
+        stream = client.iter_historical_data(self.tickers[:3], ['PX_LAST'], None, None)
+        self.assertRaises(requests.ReadTimeout, list, stream)
+        self.assertEqual(client.down, {})
+        self.assertEqual(sum(len(fake.calls) for fake in client.clients.values()), 3)
+
+    def test_no_host(self):
+        client = self.make_client()
+        for fake in client.clients.values():
+            fake.alive = False
+        self.assertRaises(requests.ConnectionError,
+                          client.get_reference_data, self.tickers, ['PX_LAST'])
+        self.assertRaises(NoHostAvailable, client.healthy_hosts)
+
+
+if __name__ == '__main__':
+    unittest.main()
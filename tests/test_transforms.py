@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import datetime as dt
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from ezbbg.ws import transforms
+from ezbbg.ws.benchmarks.stub import StubBloomberg, installed
+from ezbbg.ws.benchmarks.runner import InProcessClient
+
+
+def _frame(start, periods, **columns):
+    index = pd.bdate_range(start, periods=periods, name='date')
+    return pd.DataFrame(columns, index=index, columns=sorted(columns))
+
+
+class TransformTestCase(unittest.TestCase):
+    def setUp(self):
+        self.data = {'A': _frame('2020-01-01', 60,
+                                 PX_LAST=np.arange(60.), PX_VOLUME=np.ones(60)),
+                     # Starts later, with no data in January.
+                     'B': _frame('2020-02-03', 20,
+                                 PX_LAST=np.arange(20.), PX_VOLUME=np.ones(20)),
+                     'C': pd.DataFrame()}
+
+    def apply(self, **options):
+        return transforms.apply(self.data, transforms.parse(options))
+
+    def test_resample(self):
+        data = self.apply(resample='M')
+        for ticker in ('A', 'B'):
+            expected = self.data[ticker].resample('M').last().dropna(how='all')
+            self.assertTrue(data[ticker].equals(expected))
+        self.assertEqual(len(data['B']), 1)
+        self.assertEqual(data['A'].index.name, 'date')
+        self.assertTrue(data['C'].empty)
+
+    def test_sum(self):
+        data = self.apply(resample='M', how='sum', columns=['PX_VOLUME'])
+        self.assertEqual(list(data['A']['PX_VOLUME']), [23., 20., 17.])
+        self.assertEqual(list(data['B']['PX_VOLUME']), [20.])
+
+    def test_last_n_and_columns(self):
+        data = self.apply(last_n=3, columns={'PX_LAST': 'close'})
+        self.assertEqual(list(data['A'].columns), ['close'])
+        self.assertEqual(list(data['A']['close']), [57., 58., 59.])
+        self.assertEqual(len(data['B']), 3)
+
+    def test_invalid(self):
+        for options in ({'resample': 'fortnight'}, {'how': 'mode'},
+                        {'last_n': 0}, {'last_n': '3'}, {'columns': 'PX_LAST'},
+                        {'shift': 1}, ['M']):
+            self.assertRaises(ValueError, transforms.parse, options)
+        self.assertIsNone(transforms.parse(None))
+
+
+class ServerTransformTestCase(unittest.TestCase):
+    def test_query(self):
+        with installed(StubBloomberg()):
+            client = InProcessClient()
+            raw = client.get_historical_data(['A Equity'], ['PX_LAST'],
+                                             dt.date(2019, 1, 1),
+                                             dt.date(2019, 12, 31))
+            data = client.get_historical_data(['A Equity'], ['PX_LAST'],
+                                              dt.date(2019, 1, 1),
+                                              dt.date(2019, 12, 31),
+                                              transform={'resample': 'W-FRI',
+                                                         'last_n': 4})
+        expected = raw['A Equity'].resample('W-FRI').last().iloc[-4:]
+        self.assertTrue(np.allclose(data['A Equity']['PX_LAST'],
+                                    expected['PX_LAST']))
+        self.assertEqual(list(data['A Equity'].index), list(expected.index))
+
+    def test_invalid(self):
+        with installed(StubBloomberg()):
+            client = InProcessClient()
+            with self.assertRaises(Exception) as context:
+                client.get_historical_data(['A Equity'], ['PX_LAST'],
+                                           dt.date(2019, 1, 1),
+                                           dt.date(2019, 12, 31),
+                                           transform={'how': 'mode'})
+        self.assertIn('400', str(context.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
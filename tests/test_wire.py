@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+from datetime import date
+import unittest
+
+import numpy as np
+import pandas as pd
+from pandas.util.testing import assert_frame_equal
+
+from ezbbg.ws import wire
+
+
+class ColumnarWireFormatTestCase(unittest.TestCase):
+    def test_historical_data_roundtrip(self):
+        index = pd.date_range('2014-01-01', periods=5, name='date')
+        data = {'SX5E Index': pd.DataFrame({'PX_LAST': np.arange(5.),
+                                            'PX_OPEN': np.arange(5.) + .5},
+                                           index=index)}
+        decoded = wire.decode(bytearray(wire.encode(data)))
+        assert_frame_equal(data['SX5E Index'], decoded['SX5E Index'])
+
+    def test_float_block_is_not_copied(self):
+        frame = pd.DataFrame({'PX_LAST': np.arange(3.)},
+                             index=pd.date_range('2014-01-01', periods=3))
+        payload = bytearray(wire.encode(frame))
+        decoded = wire.decode(payload)
+        self.assertTrue(np.may_share_memory(decoded.values,
+                                            np.frombuffer(payload, np.uint8)))
+
+    def test_mixed_columns_and_scalars(self):
+        bulk = pd.DataFrame({'ratio': [1.5, np.nan],
+                             'count': [1, 2],
+                             'name': ['a', None],
+                             'day': pd.to_datetime(['2014-01-01', None])},
+                            columns=['name', 'ratio', 'count', 'day'])
+        data = {'SX5E Index': {'NAME': u'EURO STOXX 50',
+                               'PX_LAST': 3100.5,
+                               'LAST_UPDATE_DT': date(2014, 1, 2),
+                               'INDX_MWEIGHT': bulk}}
+        decoded = wire.decode(wire.encode(data))['SX5E Index']
+        self.assertEqual(u'EURO STOXX 50', decoded['NAME'])
+        self.assertEqual(3100.5, decoded['PX_LAST'])
+        self.assertEqual(np.datetime64('2014-01-02'), decoded['LAST_UPDATE_DT'])
+        assert_frame_equal(bulk, decoded['INDX_MWEIGHT'])
+
+    def test_not_a_columnar_payload(self):
+        with self.assertRaises(ValueError):
+            wire.decode(b'{"SX5E Index": {}}')
+
+
+if __name__ == '__main__':
+    unittest.main()
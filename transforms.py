@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+"""Transformations of the historical data run by the server.
+
+Many clients query decades of daily data only to resample them to weekly or
+month-end observations, or to keep the last few rows. The 'transform' option
+of a historical data query does it on the server, before the data are
+serialized:
+
+>>> get_historical_data(['SPX Index'], ['PX_LAST', 'PX_VOLUME'],
+...                     '2000-01-01', '2020-01-01',
+...                     transform={'resample': 'M', 'how': 'last',
+...                                'last_n': 12,
+...                                'columns': {'PX_LAST': 'close'}})
+
+The steps are run in this order:
+
+- `columns`: list of the fields kept, or {field: new name} to keep and rename
+  them;
+- `resample`: pandas frequency (e.g. 'W-FRI', 'M', 'BM', 'Q'), the rows being
+  aggregated with `how` (one of `HOWS`, 'last' by default). The periods
+  without data are dropped;
+- `last_n`: number of rows kept at the end of each history.
+
+All the tickers are resampled at once, on a single frame.
+"""
+
+from collections import namedtuple, OrderedDict
+
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+
+
+__author__ = ('eruiz070210', 'dgaraud111714')
+
+HOWS = ('last', 'first', 'mean', 'median', 'min', 'max', 'sum')
+DEFAULT_HOW = 'last'
+OPTIONS = ('resample', 'how', 'last_n', 'columns')
+
+Transform = namedtuple('Transform', ['resample', 'how', 'last_n', 'columns'])
+
+
+def parse(options):
+    """`Transform` of the 'transform' option of a query, None if there is
+    nothing to do.
+
+    Raise ValueError if the options are invalid.
+    """
+    if not options:
+        return None
+    if not isinstance(options, dict):
+        raise ValueError("The transform must be a dict, not {!r}".format(options))
+    unknown = sorted(set(options) - set(OPTIONS))
+    if unknown:
+        raise ValueError("Unknown transform options: {}".format(', '.join(unknown)))
+
+    resample = options.get('resample')
+    if resample is not None:
+        try:
+            to_offset(resample)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid resample frequency {!r}".format(resample))
+    how = options.get('how', DEFAULT_HOW)
+    if how not in HOWS:
+        raise ValueError("Invalid aggregation {!r}, expected one of {}".format(
+            how, ', '.join(HOWS)))
+
+    last_n = options.get('last_n')
+    if last_n is not None:
+        if isinstance(last_n, bool) or not isinstance(last_n, (int, long)) or last_n < 1:
+            raise ValueError("last_n must be a positive integer, not {!r}".format(last_n))
+
+    columns = options.get('columns')
+    if columns is not None:
+        if isinstance(columns, dict):
+            columns = OrderedDict(sorted(columns.iteritems()))
+        elif isinstance(columns, (list, tuple)):
+            columns = OrderedDict((column, column) for column in columns)
+        else:
+            raise ValueError("columns must be a list or a dict, not {!r}".format(columns))
+        if not all(isinstance(c, basestring) for c in columns.keys() + columns.values()):
+            raise ValueError("The columns must be strings")
+
+    return Transform(resample, how, last_n, columns)
+
+
+def _project(frame, columns):
+    return frame[[column for column in columns if column in frame.columns]]
+
+
+def _resample(frames, rule, how):
+    """Resample the frames of {ticker: DataFrame} together.
+    """
+    tickers = [ticker for ticker, frame in frames.iteritems()
+               if len(frame.index) and len(frame.columns)]
+    if not tickers:
+        return frames
+    index_name = frames[tickers[0]].index.name
+    wide = pd.concat([frames[ticker] for ticker in tickers], axis=1, keys=tickers)
+    resampler = wide.resample(rule)
+    if how == 'sum':
+        # Otherwise the periods without data would sum to 0.
+        wide = resampler.sum(min_count=1)
+    else:
+        wide = getattr(resampler, how)()
+    wide.index.name = index_name
+    # The columns which can't be aggregated, e.g. text with 'mean', are gone.
+    resampled = set(wide.columns.get_level_values(0))
+    result = OrderedDict()
+    for ticker, frame in frames.iteritems():
+        if ticker in resampled:
+            frame = wide[ticker].dropna(how='all')
+            frame.columns.name = None
+        elif ticker in tickers:
+            frame = pd.DataFrame(index=wide.index[:0])
+        result[ticker] = frame
+    return result
+
+
+def apply(data, transform):
+    """Apply `transform` to the {ticker: DataFrame} of a historical data
+    query.
+    """
+    if transform is None:
+        return data
+    frames = OrderedDict((ticker, frame) for ticker, frame in data.iteritems()
+                         if frame is not None)
+    if transform.columns is not None:
+        frames = OrderedDict((ticker, _project(frame, transform.columns))
+                             for ticker, frame in frames.iteritems())
+    if transform.resample is not None:
+        frames = _resample(frames, transform.resample, transform.how)
+    if transform.last_n is not None:
+        frames = OrderedDict((ticker, frame.iloc[-transform.last_n:])
+                             for ticker, frame in frames.iteritems())
+    if transform.columns is not None:
+        frames = OrderedDict((ticker, frame.rename(columns=transform.columns))
+                             for ticker, frame in frames.iteritems())
+    return frames
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+"""Binary columnar wire format.
+
+The payload is made of:
+
+  - the magic string 'EZBC' and the header length (little-endian uint32),
+  - a JSON header, i.e. the response where each DataFrame is replaced by the
+    description of its columns and index,
+  - the raw buffers of the numeric columns and datetime indexes, aligned on
+    8 bytes.
+
+All the float64 columns of a DataFrame are stored in a single (n_columns,
+n_rows) block, so the decoded DataFrame is a view on the payload: no copy, no
+text parsing. The other columns (strings, mixed types) are kept in the header.
+"""
+
+import json
+import struct
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+
+__author__ = ('eruiz070210', 'dgaraud111714')
+
+COLUMNAR_MIMETYPE = 'application/x-ezbbg-columnar'
+MAGIC = b'EZBC'
+_HEADER_LENGTH = struct.Struct('<I')
+_ALIGNMENT = 8
+
+
+def _padding(size):
+    return -size % _ALIGNMENT
+
+
+class _Writer(object):
+    def __init__(self):
+        self.buffers = []
+        self.offset = 0
+
+    def add(self, array):
+        """Append the raw data of `array`, return its description.
+        """
+        array = np.ascontiguousarray(array)
+        data = array.tobytes()
+        desc = {'offset': self.offset,
+                'dtype': array.dtype.str,
+                'shape': list(array.shape)}
+        self.buffers.append(data)
+        self.buffers.append(b'\0' * _padding(len(data)))
+        self.offset += len(data) + _padding(len(data))
+        return desc
+
+    def index(self, index):
+        if isinstance(index, pd.DatetimeIndex) and index.tz is None:
+            return {'kind': 'datetime', 'name': index.name,
+                    'buffer': self.add(index.asi8)}
+        if isinstance(index, pd.RangeIndex) and (len(index) < 2 or index[1] - index[0] == 1):
+            return {'kind': 'range', 'name': index.name,
+                    'start': int(index[0]) if len(index) else 0,
+                    'stop': int(index[-1]) + 1 if len(index) else 0}
+        return {'kind': 'values', 'name': index.name,
+                'values': [self.walk(x) for x in index]}
+
+    def frame(self, frame):
+        floats = [c for c, dtype in frame.dtypes.iteritems() if dtype == np.float64]
+        others = []
+        for name, dtype in frame.dtypes.iteritems():
+            if dtype == np.float64:
+                continue
+            column = frame[name]
+            if dtype.kind == 'M' and getattr(column.dt, 'tz', None) is None:
+                others.append({'name': name, 'kind': 'datetime',
+                               'buffer': self.add(column.values.view(np.int64))})
+            elif dtype.kind in 'iub':
+                others.append({'name': name, 'kind': 'numeric',
+                               'buffer': self.add(column.values)})
+            else:
+                others.append({'name': name, 'kind': 'values',
+                               'values': [self.walk(x) for x in column]})
+        block = None
+        if floats:
+            block = self.add(frame[floats].values.T)
+        return {'__frame__': {'columns': [self.walk(c) for c in frame.columns],
+                              'index': self.index(frame.index),
+                              'floats': floats,
+                              'block': block,
+                              'others': others}}
+
+    def walk(self, obj):
+        """Replace the DataFrames by their description, tag the dates.
+        """
+        if isinstance(obj, pd.DataFrame):
+            return self.frame(obj)
+        if isinstance(obj, dict):
+            return {k: self.walk(v) for k, v in obj.iteritems()}
+        if isinstance(obj, (list, tuple)):
+            return [self.walk(x) for x in obj]
+        if isinstance(obj, np.datetime64):
+            obj = pd.Timestamp(obj)
+        if obj is pd.NaT:
+            return None
+        if isinstance(obj, dt.datetime):
+            return {'__datetime__': obj.isoformat()}
+        if isinstance(obj, dt.date):
+            return {'__date__': obj.isoformat()}
+        if isinstance(obj, np.generic):
+            return obj.item()
+        if isinstance(obj, pd.Series):
+            return self.walk(obj.to_dict())
+        return obj
+
+
+def encode(data):
+    """Encode `data`, i.e. nested dicts and lists of DataFrames, scalars and
+    dates, into the columnar format.
+    """
+    writer = _Writer()
+    header = json.dumps(writer.walk(data)).encode('utf-8')
+    header += b' ' * _padding(len(MAGIC) + _HEADER_LENGTH.size + len(header))
+    return b''.join([MAGIC, _HEADER_LENGTH.pack(len(header)), header]
+                    + writer.buffers)
+
+
+class _Reader(object):
+    def __init__(self, payload, start):
+        self.payload = payload
+        self.start = start
+
+    def array(self, desc):
+        dtype = np.dtype(str(desc['dtype']))
+        count = int(np.prod(desc['shape']))
+        array = np.frombuffer(self.payload, dtype=dtype, count=count,
+                              offset=self.start + desc['offset'])
+        return array.reshape(desc['shape'])
+
+    def index(self, desc):
+        if desc['kind'] == 'datetime':
+            index = pd.DatetimeIndex(self.array(desc['buffer']).view('M8[ns]'))
+        elif desc['kind'] == 'range':
+            index = pd.RangeIndex(desc['start'], desc['stop'])
+        else:
+            index = pd.Index([self.walk(x) for x in desc['values']])
+        index.name = desc['name']
+        return index
+
+    def frame(self, desc):
+        index = self.index(desc['index'])
+        columns = [self.walk(c) for c in desc['columns']]
+        if desc['block'] is not None:
+            frame = pd.DataFrame(self.array(desc['block']).T, index=index,
+                                 columns=desc['floats'], copy=False)
+        else:
+            frame = pd.DataFrame(index=index)
+        for other in desc['others']:
+            if other['kind'] == 'datetime':
+                values = self.array(other['buffer']).view('M8[ns]')
+            elif other['kind'] == 'numeric':
+                values = self.array(other['buffer'])
+            else:
+                values = [self.walk(x) for x in other['values']]
+            frame[other['name']] = values
+        if list(frame.columns) != columns:
+            frame = frame[columns]
+        return frame
+
+    def walk(self, obj):
+        if isinstance(obj, dict):
+            if '__frame__' in obj:
+                return self.frame(obj['__frame__'])
+            if '__datetime__' in obj:
+                return pd.Timestamp(obj['__datetime__'])
+            if '__date__' in obj:
+                return np.datetime64(obj['__date__'])
+            return {k: self.walk(v) for k, v in obj.iteritems()}
+        if isinstance(obj, list):
+            return [self.walk(x) for x in obj]
+        return obj
+
+
+def decode(payload):
+    """Decode a columnar payload.
+
+    The float columns and datetime indexes of the DataFrames are views on
+    `payload`: pass a `bytearray` to get writable DataFrames.
+    """
+    if bytes(payload[:len(MAGIC)]) != MAGIC:
+        raise ValueError("Not an ezbbg columnar payload")
+    start = len(MAGIC) + _HEADER_LENGTH.size
+    length, = _HEADER_LENGTH.unpack(bytes(payload[len(MAGIC):start]))
+    header = json.loads(bytes(payload[start:start + length]).decode('utf-8'))
+    return _Reader(payload, start + length).walk(header)